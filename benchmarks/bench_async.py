@@ -0,0 +1,68 @@
+"""
+Load test of the asyncio engine against the threaded Flask server, with an LLM which injects latency.
+
+Every conversation sends a number of messages, one after the other. The async engine runs all the conversations
+on a single event loop, while the Flask application is called from a fixed pool of threads, as a threaded
+WSGI server would do.
+
+Usage: python -m benchmarks.bench_async [conversations] [threads]
+"""
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import BenchmarkConfiguration, LatencyLLM, NullChannel
+from taskyto.server import FlaskChatbotApp
+
+CHATBOT = "examples/yaml/bike-shop"
+TURNS = 3
+LATENCY = 0.05
+
+
+def run_async(configuration, conversations):
+    async def converse():
+        engine = configuration.new_engine()
+        await engine.astart(NullChannel())
+        for i in range(TURNS):
+            await engine.aexecute_with_input(f"Message {i}")
+
+    async def run_all():
+        await asyncio.gather(*[converse() for _ in range(conversations)])
+
+    start = time.perf_counter()
+    asyncio.run(run_all())
+    return time.perf_counter() - start
+
+
+def run_threaded_flask(configuration, conversations, threads):
+    app = FlaskChatbotApp(configuration).app
+
+    def converse(_):
+        client = app.test_client()
+        id_ = client.post('/conversation/new').json['id']
+        for i in range(TURNS):
+            response = client.post('/conversation/user_message', json={"id": id_, "message": f"Message {i}"})
+            assert response.status_code == 200
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(converse, range(conversations)))
+    return time.perf_counter() - start
+
+
+def main(conversations=1000, threads=32):
+    conversations, threads = int(conversations), int(threads)
+    configuration = BenchmarkConfiguration(CHATBOT, LatencyLLM(latency=LATENCY))
+    configuration.program
+
+    turns = conversations * TURNS
+    print(f"{conversations} conversations x {TURNS} turns, LLM latency {LATENCY * 1e3:.0f} ms")
+    elapsed = run_threaded_flask(configuration, conversations, threads)
+    print(f"threaded flask ({threads} threads): {turns / elapsed:>9.1f} turns/s")
+    elapsed = run_async(configuration, conversations)
+    print(f"{'asyncio engine':>26}: {turns / elapsed:>9.1f} turns/s")
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
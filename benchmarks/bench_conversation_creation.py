@@ -0,0 +1,61 @@
+"""
+Benchmark of the creation of new conversations, as done by POST /conversation/new.
+
+Compares compiling the chatbot for each conversation (the previous behaviour) with sharing a ChatbotProgram,
+both in latency and in the memory retained by each session.
+
+Usage: python -m benchmarks.bench_conversation_creation [chatbot-folder]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+
+from benchmarks.common import BenchmarkConfiguration, NullChannel
+from taskyto.engine.custom.engine import CustomPromptEngine
+
+
+def new_conversation_compiling(configuration):
+    engine = CustomPromptEngine(configuration.chatbot_model, configuration=configuration)
+    engine.start(NullChannel())
+    return engine
+
+
+def new_conversation_shared(configuration):
+    engine = configuration.new_engine()
+    engine.start(NullChannel())
+    return engine
+
+
+def measure(factory, configuration, sessions):
+    gc.collect()
+    start = time.perf_counter()
+    engines = [factory(configuration) for _ in range(sessions)]
+    latency = (time.perf_counter() - start) / sessions
+
+    gc.collect()
+    tracemalloc.start()
+    engines = [factory(configuration) for _ in range(sessions)]
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return latency, retained / len(engines)
+
+
+def main(chatbot_folder="examples/yaml/pizza-order", sessions=200):
+    configuration = BenchmarkConfiguration(chatbot_folder)
+    configuration.program  # The program is compiled once, before the measurements
+
+    print(f"Chatbot: {chatbot_folder}, {sessions} sessions")
+    print(f"{'strategy':>12} {'latency (ms)':>13} {'memory/session (KiB)':>21}")
+    results = {}
+    for name, factory in [("compile", new_conversation_compiling), ("shared", new_conversation_shared)]:
+        latency, memory = measure(factory, configuration, sessions)
+        results[name] = (latency, memory)
+        print(f"{name:>12} {latency * 1e3:>13.3f} {memory / 1024:>21.2f}")
+
+    print(f"Speed-up: {results['compile'][0] / results['shared'][0]:.0f}x, "
+          f"memory reduction: {results['compile'][1] / results['shared'][1]:.0f}x")
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
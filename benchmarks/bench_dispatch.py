@@ -0,0 +1,111 @@
+"""
+Micro-benchmark of StateMachine.transition_for.
+
+Compares the indexed dispatch table against the previous linear scan over get_all_transitions(), for
+synthetic menus with a growing number of modules (each one also wrapped in a sequence).
+
+Usage: python -m benchmarks.bench_dispatch
+"""
+import timeit
+
+from taskyto import spec
+from taskyto.engine.custom.events import ActivateModuleEvent, ActivateModuleEventType, UserInput, UserInputEventType, \
+    AIResponseEventType, TaskInProgressEventType, TaskFinishEvent, TaskFinishEventEventType
+from taskyto.engine.custom.statemachine import StateMachine, State, CompositeState, Initial
+
+
+class RuntimeStub:
+    def __init__(self, module):
+        self.module = module
+
+
+def new_state(name):
+    module = spec.ActionModule(name=name, data=[])
+    return State(module, RuntimeStub(module))
+
+
+def add_module_transitions(sm, state):
+    sm.add_transition(state, state, UserInputEventType)
+    sm.add_transition(state, state, AIResponseEventType)
+    sm.add_transition(state, state, TaskInProgressEventType)
+
+
+def build_statemachine(num_modules):
+    sm = StateMachine()
+    initial = Initial()
+    menu = new_state("menu")
+    sm.add_state(initial)
+    sm.add_state(menu)
+    sm.add_transition(initial, menu, None)
+    add_module_transitions(sm, menu)
+
+    states = []
+    for i in range(num_modules):
+        state = new_state(f"module-{i}")
+        states.append(state)
+        sm.add_state(state)
+        add_module_transitions(sm, state)
+        sm.add_transition(menu, state, ActivateModuleEventType(state.module))
+        sm.add_transition(state, menu, TaskFinishEventEventType)
+
+        seq_module = spec.SequenceModule(name=f"sequence-{i}", references=[f"step-{i}"])
+        composite = CompositeState(seq_module, RuntimeStub(seq_module))
+        inner_initial = Initial()
+        step = new_state(f"step-{i}")
+        composite.add_state(inner_initial)
+        composite.add_state(step)
+        add_module_transitions(composite, step)
+        composite.add_transition(inner_initial, step, ActivateModuleEventType(step.module))
+        composite.add_transition(step, composite, TaskFinishEventEventType)
+
+        sm.add_state(composite)
+        sm.add_transition(menu, composite, ActivateModuleEventType(seq_module))
+        sm.add_transition(composite, menu, TaskFinishEventEventType)
+
+    return sm, menu, states
+
+
+def legacy_transition_for(sm, current, event):
+    if isinstance(current, CompositeState):
+        t = legacy_transition_for(current, current.initial_state(), event)
+        if t is not None:
+            return t
+
+    for t in sm.get_all_transitions():
+        if t.source == current:
+            if event is None and t.trigger.event is None:
+                return t
+            elif t.trigger.event is not None and t.trigger.event.is_compatible(event):
+                return t
+    return None
+
+
+def main(sizes=(5, 20, 80, 320), number=2000):
+    print(f"{'modules':>8} {'transitions':>12} {'linear (us)':>12} {'indexed (us)':>13} {'speedup':>8}")
+    for size in sizes:
+        sm, menu, states = build_statemachine(size)
+        last = states[-1]
+        lookups = [(menu, UserInput("hi")),
+                   (menu, ActivateModuleEvent(last.runtime_module, None, None)),
+                   (last, TaskFinishEvent(None))]
+
+        for current, event in lookups:
+            assert legacy_transition_for(sm, current, event) is sm.transition_for(current, event)
+
+        def run_linear():
+            for current, event in lookups:
+                legacy_transition_for(sm, current, event)
+
+        def run_indexed():
+            for current, event in lookups:
+                sm.transition_for(current, event)
+
+        linear = min(timeit.repeat(run_linear, number=number // size + 1, repeat=3)) / (number // size + 1)
+        indexed = min(timeit.repeat(run_indexed, number=number, repeat=3)) / number
+        per_lookup = len(lookups)
+        print(f"{size:>8} {len(sm.get_all_transitions()):>12} {linear / per_lookup * 1e6:>12.2f} "
+              f"{indexed / per_lookup * 1e6:>13.2f} {linear / indexed:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
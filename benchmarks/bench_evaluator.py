@@ -0,0 +1,74 @@
+"""
+Latency of the actions of the pizza-order chatbot (calculate_price), comparing the previous evaluator, which read
+and compiled the file on every call, with the cached one. The output of the scripts is discarded.
+
+Usage: python -m benchmarks.bench_evaluator [calls]
+"""
+import contextlib
+import io
+import sys
+import time
+
+from taskyto.engine.common.evaluator import Evaluator
+from taskyto.spec import ExecuteElement
+
+FOLDER = "examples/yaml/pizza-order-simple"
+DATA = {"pizza_size": "Large", "pizza_type": "Carbonara", "num_drinks": 2, "drinks": "Coke"}
+INLINE = "return pizza_size.lower() + ' ' + pizza_type.lower()"
+
+
+def legacy_eval_python_file(filename: str, data: dict):
+    with open(filename) as f:
+        code_to_execute = f.read()
+        code_to_execute += f'\nglobals()["chatbot_llm_action_result_"] = main({", ".join(data.keys())})\n'
+
+        compiled = compile(code_to_execute, filename, "exec")
+        global_vars = globals().copy()
+        exec(compiled, global_vars, data.copy())
+        return global_vars["chatbot_llm_action_result_"]
+
+
+def legacy_eval_python_inline(code: str, data: dict):
+    code = "\t" + code.replace("\n", "\n\t")
+    params = ", ".join(data.keys())
+    code = f"""
+def _eval({params}):
+{code}
+
+globals()['chatbot_llm_action_result_'] = _eval({params})
+    """
+    compiled = compile(code, "<string>", "exec")
+    global_vars = globals().copy()
+    eval(compiled, global_vars, data.copy())
+    return global_vars["chatbot_llm_action_result_"]
+
+
+def measure(function, calls):
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    filename = f"{FOLDER}/calculate_price.py"
+
+    def legacy_file():
+        # The previous version also created an Evaluator, and looked up the file, on every action
+        Evaluator(load_path=[FOLDER])
+        legacy_eval_python_file(filename, DATA)
+
+    evaluator = Evaluator(load_path=[FOLDER])
+    file_execution = ExecuteElement(language="python", code="calculate_price.py")
+    inline_execution = ExecuteElement(language="python", code=INLINE)
+
+    print(f"file, before:   {measure(legacy_file, calls):8.2f} us/call")
+    print(f"file, after:    {measure(lambda: evaluator.eval_code(file_execution, DATA), calls):8.2f} us/call")
+    print(f"inline, before: {measure(lambda: legacy_eval_python_inline(INLINE, DATA), calls):8.2f} us/call")
+    print(f"inline, after:  {measure(lambda: evaluator.eval_code(inline_execution, DATA), calls):8.2f} us/call")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Replays the same conversation several times, as a regression run does, with and without the LLM cache.
+The first replay fills the cache, so the following ones do not need to call the (slow) LLM.
+
+Usage: python -m benchmarks.bench_llm_cache [replays] [latency]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.common import BenchmarkConfiguration, LatencyLLM, NullChannel
+from taskyto.engine.common.llm_cache import LLMCache, CachedLLM
+
+CHATBOT = "examples/yaml/bike-shop"
+MESSAGES = ["Hi", "I want to know the opening hours", "Thanks", "Bye"]
+
+
+def replay(configuration, replays):
+    start = time.perf_counter()
+    for _ in range(replays):
+        engine = configuration.new_engine()
+        engine.start(NullChannel())
+        for message in MESSAGES:
+            engine.execute_with_input(message)
+    return time.perf_counter() - start
+
+
+def main():
+    replays = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    llm = LatencyLLM(latency=latency)
+
+    uncached = replay(BenchmarkConfiguration(CHATBOT, llm), replays)
+    print(f"no cache:     {uncached:7.3f} s")
+
+    with tempfile.TemporaryDirectory() as folder:
+        cache = LLMCache(path=os.path.join(folder, "cache.db"))
+        cached = replay(BenchmarkConfiguration(CHATBOT, CachedLLM(llm, cache, "latency", 0.0)), replays)
+        print(f"memory+disk:  {cached:7.3f} s  {cache.stats}")
+
+        # A new process: the memory tier is empty, but the SQLite file is warm
+        cache = LLMCache(path=os.path.join(folder, "cache.db"))
+        warm = replay(BenchmarkConfiguration(CHATBOT, CachedLLM(llm, cache, "latency", 0.0)), replays)
+        print(f"warm disk:    {warm:7.3f} s  {cache.stats}")
+        cache.disk.close()
+
+
+if __name__ == '__main__':
+    main()
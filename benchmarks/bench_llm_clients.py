@@ -0,0 +1,63 @@
+"""
+Compares creating a new OpenAILLM (with its own client and connection pool) for every call, as it was done
+before, with the LLM registry of the configuration, which shares the clients and keeps the connections alive.
+The requests go to a local HTTP server which imitates the chat completions API, so the numbers do not include
+the TLS handshake that a real deployment would also save.
+
+Usage: python -m benchmarks.bench_llm_clients [calls]
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from taskyto.engine.common.configuration import ConfigurationModel
+from taskyto.engine.common.llm import OpenAILLM
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.dumps({"id": "bench", "object": "chat.completion", "created": 0, "model": "bench",
+                           "choices": [{"index": 0, "finish_reason": "stop",
+                                        "message": {"role": "assistant", "content": "Hello"}}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CompletionHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["OPENAI_API_KEY"] = "not-used"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        OpenAILLM(model_name="bench")("Hi")
+    fresh = time.perf_counter() - start
+    print(f"new client per call: {fresh / calls * 1000:6.2f} ms/call")
+
+    config = ConfigurationModel(default_llm="bench")
+    start = time.perf_counter()
+    for _ in range(calls):
+        config.get_llm_for_module_or_default("module")("Hi")
+    shared = time.perf_counter() - start
+    print(f"registry:            {shared / calls * 1000:6.2f} ms/call  {config.connection_stats}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
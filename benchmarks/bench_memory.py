@@ -0,0 +1,71 @@
+"""
+Cost of updating a conversation memory, comparing the previous ConversationMemory, which filtered, sorted and
+deduplicated the whole list on every insertion, with the append-only store. Each turn adds a human message,
+an AI response, an instruction and a data message, and reads the merged data.
+
+Usage: python -m benchmarks.bench_memory
+"""
+import time
+from typing import List
+
+from pydantic import BaseModel, ConfigDict
+
+from taskyto.engine.common.memory import ConversationMemory, MemoryPiece, Message, InstructionMessage, DataMessage
+
+
+class LegacyConversationMemory(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    messages: List[Message] = []
+
+    def add_memory(self, memory_piece):
+        for m in memory_piece.messages:
+            if isinstance(m, InstructionMessage):
+                self.messages = [i for i in self.messages if not isinstance(i, InstructionMessage)]
+                self.messages.append(m)
+            elif isinstance(m, DataMessage):
+                self.messages = [i for i in self.messages if not isinstance(i, DataMessage)]
+                self.messages.append(m)
+            else:
+                self.messages.append(m)
+        self.messages = sorted(self.messages, key=lambda x: x.timestamp)
+        self.messages = [self.messages[i] for i in range(len(self.messages)) if
+                         i == 0 or self.messages[i].timestamp != self.messages[i - 1].timestamp]
+
+    @property
+    def data(self):
+        data_messages = [m for m in self.messages if isinstance(m, DataMessage)]
+        return {k: v for d in [m.data for m in data_messages] for k, v in d.items()}
+
+
+def pieces(turns):
+    # Created in advance, so that only the memory operations are measured
+    return [(MemoryPiece().add_human_message(f"User message {i}"),
+             MemoryPiece().add_ai_response(f"Answer {i}"),
+             MemoryPiece().add_instruction_message(f"Instruction {i}"),
+             MemoryPiece().add_data_message("Collected data", {"turn": i, f"field_{i % 5}": i}))
+            for i in range(turns)]
+
+
+def converse(memory, turn_pieces):
+    start = time.perf_counter()
+    for human, ai, instruction, data in turn_pieces:
+        memory.add_memory(human)
+        memory.add_memory(ai)
+        memory.add_memory(instruction)
+        memory.add_memory(data)
+        memory.data
+    return time.perf_counter() - start
+
+
+def main():
+    print(f"{'turns':>6} {'before (ms)':>12} {'after (ms)':>11} {'after/turn (us)':>16}")
+    for turns in (10, 100, 1000):
+        turn_pieces = pieces(turns)
+        before = converse(LegacyConversationMemory(), turn_pieces)
+        after = converse(ConversationMemory(), turn_pieces)
+        print(f"{turns:>6} {before * 1e3:>12.2f} {after * 1e3:>11.2f} {after / turns * 1e6:>16.2f}")
+
+
+if __name__ == '__main__':
+    main()
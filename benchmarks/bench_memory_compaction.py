@@ -0,0 +1,54 @@
+"""
+Memory retained by a long conversation made of many tasks, with and without compacting the memories of the
+modules when they finish (the on_exit option of the memory configuration). Each task runs one of a few
+data gathering modules for some turns: the user message, the response, a new instruction and the collected
+data are added to its memories. The memory of the modules which have not finished (e.g., the history of a
+top-level menu) is not compacted, so it is left out.
+
+Usage: python -m benchmarks.bench_memory_compaction
+"""
+import gc
+import tracemalloc
+
+from taskyto import spec
+from taskyto.engine.common.memory import MemoryPiece
+from taskyto.engine.custom.runtime import ExecutionState
+
+TURNS_PER_TASK = 6
+MODULES = [spec.ActionModule(name=f"task_{i}", data=[]) for i in range(5)]
+
+
+def run_task(state, task, on_exit):
+    module = MODULES[task % len(MODULES)]
+    for turn in range(TURNS_PER_TASK):
+        state.update_memory(module, MemoryPiece().add_human_message(f"Message {turn} of task {task}")
+                            .add_ai_response(f"Answer {turn} of task {task}"), 'history')
+        state.update_memory(module, MemoryPiece().add_instruction_message(f"Ask for the field {turn}"), 'instruction')
+        state.update_memory(module, MemoryPiece().add_data_message(f"field = {turn}", {"field": turn}),
+                            'collected_data')
+    if on_exit is not None:
+        state.compact_memory(module, on_exit)
+
+
+def measure(tasks, on_exit):
+    gc.collect()
+    tracemalloc.start()
+    state = ExecutionState(None, None)
+    for task in range(tasks):
+        run_task(state, task, on_exit)
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return retained, len(state.message_log)
+
+
+def main():
+    modes = ["keep", "data", "summary"]
+    print(f"{'tasks':>6} " + " ".join(f"{mode + ' (KiB)':>14} {mode + ' (msgs)':>14}" for mode in modes))
+    for tasks in (10, 100, 200, 500, 1000):
+        results = [measure(tasks, None if mode == "keep" else mode) for mode in modes]
+        print(f"{tasks:>6} " + " ".join(f"{retained / 1024:>14.1f} {messages:>14}" for retained, messages in results))
+
+
+if __name__ == '__main__':
+    main()
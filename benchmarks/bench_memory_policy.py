@@ -0,0 +1,41 @@
+"""
+Tokens of the history sent to the LLM as a conversation grows, with and without a memory policy, and the
+time to render the history of the prompt.
+
+Usage: python -m benchmarks.bench_memory_policy
+"""
+import time
+
+from taskyto.engine.common.memory import ConversationMemory, MemoryPiece
+from taskyto.engine.common.memory_policy import MemoryPolicy, count_tokens
+
+POLICIES = {
+    "full": None,
+    "last 10 turns": MemoryPolicy(last_turns=10),
+    "1000 tokens": MemoryPolicy(max_tokens=1000),
+}
+
+
+def main():
+    memory = ConversationMemory()
+    memory.add_memory(MemoryPiece().add_data_message("Data: {'service': 'repair'}", {"service": "repair"}))
+    print(f"{'turns':>6} " + " ".join(f"{name + ' (tokens, us)':>26}" for name in POLICIES))
+    for turn in range(1, 501):
+        memory.add_memory(MemoryPiece().add_human_message(f"This is the message number {turn} of the user")
+                          .add_ai_response(f"This is the answer number {turn} of the chatbot, a bit longer"))
+        if turn in (10, 100, 500):
+            row = []
+            for name, policy in POLICIES.items():
+                start = time.perf_counter()
+                text = memory.to_text_messages() if policy is None else policy.render(memory)
+                elapsed = time.perf_counter() - start
+                row.append(f"{count_tokens(text):>16} {elapsed * 1e6:>9.1f}")
+            print(f"{turn:>6} " + " ".join(row))
+
+    for name, policy in POLICIES.items():
+        if policy is not None:
+            print(f"{name}: {policy.stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Cost of rendering the memory of a module into a prompt on every turn, comparing a full re-render of the
+messages with the cached renderings of ConversationMemory, which are extended as messages are appended.
+Each turn adds a human message, an AI response and an instruction, and renders the memory twice (the
+default memory and the conversation history), as a prompt with two memory variables does.
+
+Usage: python -m benchmarks.bench_memory_render
+"""
+import time
+
+from taskyto.engine.common.memory import ConversationMemory, MemoryPiece
+
+MEMORY_TYPES = ['default', ["human", "ai_response"]]
+
+
+def full_render(memory, memory_types):
+    messages = memory.messages
+    if isinstance(memory_types, list):
+        messages = [m for m in messages if m.memory_type in memory_types]
+    return "".join(m.prefix() + m.message + "\n" for m in messages)
+
+
+def cached_render(memory, memory_types):
+    return memory.to_text_messages(memory_types)
+
+
+def converse(turns, render):
+    memory = ConversationMemory()
+    elapsed = 0.0
+    for i in range(turns):
+        memory.add_memory(MemoryPiece().add_human_message(f"User message {i} with some words in it"))
+        memory.add_memory(MemoryPiece().add_ai_response(f"The answer to the message {i}"))
+        memory.add_memory(MemoryPiece().add_instruction_message(f"Instruction {i}"))
+        start = time.perf_counter()
+        for memory_types in MEMORY_TYPES:
+            render(memory, memory_types)
+        elapsed += time.perf_counter() - start
+    return elapsed
+
+
+def main():
+    print(f"{'turns':>6} {'before/turn (us)':>17} {'after/turn (us)':>16}")
+    for turns in (10, 100, 1000):
+        before = converse(turns, full_render)
+        after = converse(turns, cached_render)
+        print(f"{turns:>6} {before / turns * 1e6:>17.2f} {after / turns * 1e6:>16.2f}")
+
+
+if __name__ == '__main__':
+    main()
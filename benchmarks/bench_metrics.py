@@ -0,0 +1,72 @@
+"""
+Cost of the server metrics on the request path: the turns of a conversation with an instantaneous LLM without
+metrics and with the ServerMetrics sink, the cost of recording the spans of a turn from several threads at once,
+and the time to render /metrics.
+
+Usage: python -m benchmarks.bench_metrics
+"""
+import threading
+import time
+import timeit
+
+from benchmarks.common import BenchmarkConfiguration, NullChannel
+from taskyto.engine.common.spans import Tracer, TracedLLM
+from taskyto.server.conversations import ConversationRegistry
+from taskyto.server.metrics import ServerMetrics
+
+TURNS = 2000
+THREADS = 8
+EMITS = 20000
+
+
+class MetricsBenchmarkConfiguration(BenchmarkConfiguration):
+    def new_llm(self, module_name=None):
+        tracer = self.get_tracer()
+        if not tracer.enabled:
+            return self.llm
+        return TracedLLM(self.llm, tracer, module_name=module_name, model_id="mocked")
+
+
+def per_turn(configuration) -> float:
+    engine = configuration.new_engine()
+    engine.start(NullChannel())
+    return timeit.timeit(lambda: engine.execute_with_input("Hi"), number=TURNS) / TURNS
+
+
+def concurrent_emits(metrics: ServerMetrics) -> float:
+    tracer = Tracer(metrics)
+
+    def emit():
+        for _ in range(EMITS):
+            with tracer.span("turn", module="top-level"):
+                with tracer.span("llm", module="top-level", model="mocked", prompt_tokens=100) as span:
+                    span.set(completion_tokens=20)
+
+    threads = [threading.Thread(target=emit) for _ in range(THREADS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return (time.perf_counter() - start) / (THREADS * EMITS)
+
+
+def main():
+    plain = MetricsBenchmarkConfiguration("examples/yaml/bike-shop")
+    measured = MetricsBenchmarkConfiguration("examples/yaml/bike-shop")
+    metrics = ServerMetrics(measured, conversations=ConversationRegistry())
+    measured.add_span_sink(metrics)
+
+    print(f"{'configuration':>14} {'per turn (us)':>14}")
+    print(f"{'no metrics':>14} {per_turn(plain) * 1e6:>14.1f}")
+    print(f"{'metrics':>14} {per_turn(measured) * 1e6:>14.1f}")
+
+    cost = concurrent_emits(ServerMetrics(plain))
+    print(f"turn with an LLM call, {THREADS} threads: {cost * 1e6:.2f} us")
+
+    render = timeit.timeit(metrics.render, number=1000) / 1000
+    print(f"render /metrics: {render * 1e6:.1f} us ({len(metrics.render().splitlines())} lines)")
+
+
+if __name__ == '__main__':
+    main()
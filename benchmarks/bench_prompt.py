@@ -0,0 +1,77 @@
+"""
+Prompt assembly time per turn, comparing the previous build_prompt, which rebuilt the system template and the
+LangChain templates on every turn, with the cached templates. Every runtime module of the chatbot is measured
+with a conversation history of a few turns.
+
+Usage: python -m benchmarks.bench_prompt [chatbot-folder] [turns]
+"""
+import sys
+import timeit
+
+from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+
+from benchmarks.common import BenchmarkConfiguration, NullChannel
+from taskyto.engine.common.memory import MemoryPiece
+from taskyto.engine.common.prompts import FORMAT_INSTRUCTIONS, NO_TOOL_INSTRUCTIONS
+
+
+def legacy_build_prompt(module, state, input, allow_tools=True, prompts_disabled=[]):
+    format_instructions = FORMAT_INSTRUCTIONS.format(tool_names=module.get_tool_names(), ai_prefix=module.ai_prefix)
+    formatted_tools = module.get_tools_prompt()
+    if not allow_tools:
+        format_instructions = NO_TOOL_INSTRUCTIONS.format(ai_prefix=module.ai_prefix)
+        template = "\n\n".join([module.get_presentation_prompt().to_text(), module.get_task_prompt().to_text(),
+                                format_instructions, "", ""])
+    else:
+        template = "\n\n".join([module.get_presentation_prompt().to_text(), format_instructions, formatted_tools,
+                                module.get_task_prompt().to_text(), ""])
+
+    input_variables = ["input", "agent_scratchpad"]
+    human_prompt = module.get_human_prompt()
+    variables = human_prompt.variables()
+    input_variables.extend(variables)
+
+    memory_types = module.memory_types()
+    substitutions = {}
+    for memory_id in variables:
+        m = state.get_memory(module.module, memory_id)
+        substitutions[memory_id] = m.to_text_messages(memory_types.get(memory_id) or "default")
+
+    messages = [
+        SystemMessagePromptTemplate.from_template(template),
+        HumanMessagePromptTemplate.from_template(human_prompt.to_text(prompts_disabled=prompts_disabled)),
+    ]
+    template = ChatPromptTemplate(input_variables=input_variables, messages=messages)
+    substitutions['input'] = "" if input is None or input.strip() == "" else "New input: " + input
+    substitutions['agent_scratchpad'] = ""
+    return template.format_messages(**substitutions)
+
+
+def main(chatbot_folder="examples/yaml/bike-shop", turns=5):
+    configuration = BenchmarkConfiguration(chatbot_folder)
+    engine = configuration.new_engine()
+    engine.start(NullChannel())
+    state = engine.execution_state
+    program = engine.program
+
+    for name in sorted(program._runtime_modules):
+        module = program.runtime_module(name)
+        for i in range(int(turns)):
+            piece = MemoryPiece().add_human_message(f"User message {i}").add_ai_response(f"Answer {i}")
+            state.update_memory(module.module, piece, 'default')
+            state.update_memory(module.module, piece, 'history')
+
+        for allow_tools in [True, False]:
+            legacy = legacy_build_prompt(module, state, "Hello", allow_tools)
+            assert legacy == module.build_prompt(state, "Hello", allow_tools), name
+
+            number = 2000
+            before = min(timeit.repeat(lambda: legacy_build_prompt(module, state, "Hello", allow_tools),
+                                       number=number, repeat=3)) / number
+            after = min(timeit.repeat(lambda: module.build_prompt(state, "Hello", allow_tools),
+                                      number=number, repeat=3)) / number
+            print(f"{name:>25} tools={allow_tools!s:>5}: before {before * 1e6:7.1f} us, after {after * 1e6:6.1f} us")
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
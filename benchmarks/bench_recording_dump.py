@@ -0,0 +1,75 @@
+"""
+Cost of dumping the recording of a long conversation with its trace, comparing the previous path (keep
+everything in memory and yaml.dump it at the end) with the JSONL writer, which appends every item while the
+conversation runs. Reports the total time and the peak memory allocated, and the time of converting the JSONL
+file to the test format afterwards.
+
+Usage: python -m benchmarks.bench_recording_dump
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.bench_tracing import events
+import yaml
+
+from taskyto.recording import RecordedInteraction, JsonlRecordingWriter, InternalTraceItem, convert_jsonl_recording
+
+
+def legacy_dump(recording, file):
+    # The previous dump_test_recording, with PyYAML's pure-Python emitter and eagerly serialized events
+    data = {"interaction": [dict(user=i.message) if i.type == "user" else dict(chatbot=[i.message])
+                            for i in recording.interactions],
+            "trace": [dict(InternalTraceItem(type='event-transition', event=event)) for event in recording.trace]}
+    with open(file, "w") as f:
+        yaml.dump(data, f)
+
+
+def record(recording, turns, sample):
+    for i in range(turns):
+        recording.append("user", f"User message {i}")
+        for event in sample:
+            recording.append_trace(event)
+        recording.append("chatbot", f"Chatbot answer {i}")
+        recording.record_response_time(0.5)
+
+
+def measure(run):
+    tracemalloc.start()
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    sample = events()
+    print(f"{'turns':>6} {'yaml (s)':>9} {'jsonl (s)':>10} {'yaml peak (MiB)':>16} {'jsonl peak (MiB)':>17} "
+          f"{'convert (s)':>12}")
+    with tempfile.TemporaryDirectory() as folder:
+        yaml_file = os.path.join(folder, "recording.yaml")
+        jsonl_file = os.path.join(folder, "recording.jsonl")
+        for turns in (100, 1000, 5000):
+            def yaml_path():
+                recording = RecordedInteraction()
+                record(recording, turns, sample)
+                legacy_dump(recording, yaml_file)
+
+            def jsonl_path():
+                with JsonlRecordingWriter(jsonl_file) as writer:
+                    record(RecordedInteraction(max_items=100, writer=writer), turns, sample)
+
+            yaml_time, yaml_peak = measure(yaml_path)
+            jsonl_time, jsonl_peak = measure(jsonl_path)
+            start = time.perf_counter()
+            convert_jsonl_recording(jsonl_file, yaml_file, trace=True)
+            convert_time = time.perf_counter() - start
+            print(f"{turns:>6} {yaml_time:>9.2f} {jsonl_time:>10.3f} {yaml_peak / 2 ** 20:>16.1f} "
+                  f"{jsonl_peak / 2 ** 20:>17.2f} {convert_time:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
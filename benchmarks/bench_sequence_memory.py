@@ -0,0 +1,55 @@
+"""
+Cost of the memory copies of a sequence with `memory: full`, where, after each module, its history is copied
+into every remaining module. Compares memories which store their own messages with memories sharing the
+message log of the conversation (as in ExecutionState), measuring the time and the memory allocated.
+
+Usage: python -m benchmarks.bench_sequence_memory
+"""
+import time
+import tracemalloc
+
+from taskyto.engine.common.memory import ConversationMemory, MemoryPiece, MessageLog, HumanMessage, AIResponse, \
+    DataMessage
+
+FILTER = [HumanMessage, AIResponse, DataMessage]
+
+
+def run_sequence(modules, turns, log):
+    memories = [ConversationMemory(log=log) if log is not None else ConversationMemory() for _ in range(modules)]
+    for idx, memory in enumerate(memories):
+        for i in range(turns):
+            memory.add_memory(MemoryPiece().add_human_message(f"User message {idx}.{i}"))
+            memory.add_memory(MemoryPiece().add_ai_response(f"Answer {idx}.{i}"))
+            memory.add_memory(MemoryPiece().add_instruction_message(f"Instruction {idx}.{i}"))
+        memory.add_memory(MemoryPiece().add_data_message("Collected data", {f"field_{idx}": idx}))
+        memory.to_text_messages()
+        for target in memories[idx + 1:]:
+            target.copy_memory_from(memory, filter=FILTER)
+    return memories
+
+
+def measure(modules, turns, shared):
+    start = time.perf_counter()
+    run_sequence(modules, turns, MessageLog() if shared else None)
+    elapsed = time.perf_counter() - start
+
+    # Measured separately, because tracing the allocations slows down the run
+    tracemalloc.start()
+    memories = run_sequence(modules, turns, MessageLog() if shared else None)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del memories
+    return elapsed, allocated
+
+
+def main():
+    print(f"{'modules':>7} {'turns':>6} {'own (ms)':>9} {'shared (ms)':>12} {'own (KiB)':>10} {'shared (KiB)':>13}")
+    for modules, turns in ((5, 10), (10, 50), (20, 100)):
+        own_time, own_memory = measure(modules, turns, shared=False)
+        shared_time, shared_memory = measure(modules, turns, shared=True)
+        print(f"{modules:>7} {turns:>6} {own_time * 1e3:>9.2f} {shared_time * 1e3:>12.2f} "
+              f"{own_memory / 1024:>10.0f} {shared_memory / 1024:>13.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Throughput of the Flask server with a pool of request threads, each one sending the messages of its own
+conversation through the WSGI application. The LLM has a latency, during which other conversations can run,
+so the throughput is expected to grow linearly with the threads.
+
+Usage: python -m benchmarks.bench_server_concurrency
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import BenchmarkConfiguration, LatencyLLM
+from taskyto.server import FlaskChatbotApp
+
+LATENCY = 0.02
+MESSAGES = 20
+
+
+def throughput(threads: int) -> float:
+    chatbot_app = FlaskChatbotApp(BenchmarkConfiguration("examples/yaml/bike-shop", LatencyLLM(latency=LATENCY)))
+    client = chatbot_app.app.test_client()
+    ids = [client.post('/conversation/new').json["id"] for _ in range(threads)]
+
+    def converse(id):
+        client = chatbot_app.app.test_client()
+        for _ in range(MESSAGES):
+            response = client.post('/conversation/user_message', json={"id": id, "message": "Hi"})
+            assert response.status_code == 200
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(converse, ids))
+    return threads * MESSAGES / (time.perf_counter() - start)
+
+
+def main():
+    print(f"{'threads':>8} {'messages/s':>11} {'speedup':>8}")
+    baseline = None
+    for threads in [1, 2, 4, 8, 16]:
+        result = throughput(threads)
+        baseline = baseline or result
+        print(f"{threads:>8} {result:>11.1f} {result / baseline:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Memory retained by the conversation memory of a session, and time to build it, comparing the previous
+pydantic messages with the slotted ones. Each turn adds a human message, an AI response, an instruction and
+a data message, in the pieces the engine creates for them.
+
+Usage: python -m benchmarks.bench_session_memory
+"""
+import gc
+import itertools
+import time
+import tracemalloc
+
+from pydantic import BaseModel, Field
+
+from taskyto.engine.common.memory import ConversationMemory, MemoryPiece, MessageLog
+
+_sequence = itertools.count(10 ** 9)
+
+
+class PydanticMessage(BaseModel):
+    timestamp: float = Field(default_factory=lambda: time.time())
+    seq: int = Field(default_factory=lambda: next(_sequence))
+    message: str
+
+
+class PydanticHumanMessage(PydanticMessage):
+    memory_type: str = "human"
+
+    def prefix(self) -> str:
+        return "Human: "
+
+
+class PydanticAIResponse(PydanticMessage):
+    memory_type: str = "ai_response"
+
+    def prefix(self) -> str:
+        return "AI: "
+
+
+class PydanticInstructionMessage(PydanticMessage):
+    memory_type: str = "instruction"
+
+    def prefix(self) -> str:
+        return "Instruction: "
+
+
+class PydanticDataMessage(PydanticMessage):
+    memory_type: str = "data"
+    data: dict
+
+    def prefix(self) -> str:
+        return ""
+
+
+def pydantic_turn(i):
+    return [MemoryPiece([PydanticHumanMessage(message=f"User message {i}")]),
+            MemoryPiece([PydanticAIResponse(message=f"Answer {i}")]),
+            MemoryPiece([PydanticInstructionMessage(message=f"Instruction {i}")]),
+            MemoryPiece([PydanticDataMessage(message="Collected data", data={"turn": i})])]
+
+
+def slotted_turn(i):
+    return [MemoryPiece().add_human_message(f"User message {i}"),
+            MemoryPiece().add_ai_response(f"Answer {i}"),
+            MemoryPiece().add_instruction_message(f"Instruction {i}"),
+            MemoryPiece().add_data_message("Collected data", {"turn": i})]
+
+
+def build_session(turns, make_turn):
+    memory = ConversationMemory(log=MessageLog())
+    for i in range(turns):
+        for piece in make_turn(i):
+            memory.add_memory(piece)
+    return memory
+
+
+def measure(turns, make_turn):
+    start = time.perf_counter()
+    build_session(turns, make_turn)
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    session = build_session(turns, make_turn)
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del session
+    return elapsed, retained
+
+
+def main():
+    print(f"{'turns':>6} {'pydantic (ms)':>14} {'slotted (ms)':>13} {'pydantic (KiB)':>15} {'slotted (KiB)':>14} "
+          f"{'bytes/msg before':>17} {'bytes/msg after':>16}")
+    for turns in (10, 100, 1000):
+        before_time, before_memory = measure(turns, pydantic_turn)
+        after_time, after_memory = measure(turns, slotted_turn)
+        messages = turns * 4
+        print(f"{turns:>6} {before_time * 1e3:>14.2f} {after_time * 1e3:>13.2f} {before_memory / 1024:>15.1f} "
+              f"{after_memory / 1024:>14.1f} {before_memory / messages:>17.0f} {after_memory / messages:>16.0f}")
+
+
+if __name__ == '__main__':
+    main()
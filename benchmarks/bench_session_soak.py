@@ -0,0 +1,60 @@
+"""
+Soak test of the server under a steady stream of new conversations, each one sending a few messages and then
+abandoned. The resident memory of the process is sampled while the conversations are created, with the
+conversations kept forever (as before) and with a bounded registry which hibernates them on disk.
+
+Usage: python -m benchmarks.bench_session_soak
+"""
+import gc
+import multiprocessing
+import resource
+import tempfile
+import time
+
+from benchmarks.common import BenchmarkConfiguration
+from taskyto.engine.common.configuration import SessionConfiguration
+from taskyto.server import FlaskChatbotApp
+
+CONVERSATIONS = 10000
+MESSAGES = 3
+SAMPLES = 5
+
+
+def rss_mib() -> float:
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() / (1024 * 1024)
+
+
+def soak(sessions):
+    chatbot_app = FlaskChatbotApp(BenchmarkConfiguration("examples/yaml/bike-shop"), sessions=sessions)
+    client = chatbot_app.app.test_client()
+    samples = []
+    start = time.perf_counter()
+    for i in range(1, CONVERSATIONS + 1):
+        id = client.post('/conversation/new').json["id"]
+        for _ in range(MESSAGES):
+            client.post('/conversation/user_message', json={"id": id, "message": "Hi"})
+        if i % (CONVERSATIONS // SAMPLES) == 0:
+            gc.collect()
+            samples.append(rss_mib())
+    elapsed = time.perf_counter() - start
+    return samples, elapsed, len(chatbot_app.conversations), chatbot_app.conversations.hibernated_count
+
+
+def main():
+    print(f"{'registry':>10} {'RSS (MiB) every ' + str(CONVERSATIONS // SAMPLES) + ' conversations':>44} "
+          f"{'live':>6} {'on disk':>8} {'ms/conv':>8}")
+    # Each registry is measured in a fresh process, since the memory freed by one is not returned to the system
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as folder:
+        for name, sessions in [("unbounded", None),
+                               ("bounded", SessionConfiguration(max_live=200, hibernation_folder=folder))]:
+            with context.Pool(1) as pool:
+                samples, elapsed, live, hibernated = pool.apply(soak, (sessions,))
+            print(f"{name:>10} {' '.join(f'{s:7.1f}' for s in samples):>44} {live:>6} "
+                  f"{hibernated:>8} {elapsed / CONVERSATIONS * 1000:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
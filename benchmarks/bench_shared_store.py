@@ -0,0 +1,92 @@
+"""
+Throughput of the server with its conversations in a shared SQLite store, served by 1, 2, 4 and 8 worker processes
+without sticky routing: in each round, every conversation receives a message in a different worker than in the
+previous round, so each message loads the latest version written by another worker. The baseline is a single
+process keeping the conversations in memory. Each worker sends the messages of a round from a pool of threads,
+and the LLM answers instantaneously (CPU bound) or after a latency.
+
+Usage: python -m benchmarks.bench_shared_store
+"""
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import BenchmarkConfiguration, LatencyLLM
+from taskyto.engine.common.configuration import SessionConfiguration
+from taskyto.server import FlaskChatbotApp
+
+CONVERSATIONS = 32
+ROUNDS = 10
+THREADS = 4
+
+
+def new_app(latency: float, store=None) -> FlaskChatbotApp:
+    sessions = SessionConfiguration(store=store) if store is not None else None
+    return FlaskChatbotApp(BenchmarkConfiguration("examples/yaml/bike-shop", LatencyLLM(latency=latency)),
+                           metrics=False, sessions=sessions)
+
+
+def serve(chatbot_app: FlaskChatbotApp, executor, ids):
+    def send(id):
+        response = chatbot_app.app.test_client().post('/conversation/user_message', json={"id": id, "message": "Hi"})
+        assert response.status_code == 200, response.json
+
+    list(executor.map(send, ids))
+
+
+def worker(index: int, workers: int, ids, store: str, latency: float, barrier, results):
+    chatbot_app = new_app(latency, store)
+    barrier.wait()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        for round in range(ROUNDS):
+            serve(chatbot_app, executor, [id for i, id in enumerate(ids) if (i + round) % workers == index])
+            # The next round is sent to other workers once every conversation has processed its message
+            barrier.wait()
+    results.put(time.perf_counter() - start)
+
+
+def baseline(latency: float) -> float:
+    chatbot_app = new_app(latency)
+    client = chatbot_app.app.test_client()
+    ids = [client.post('/conversation/new').json["id"] for _ in range(CONVERSATIONS)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        for _ in range(ROUNDS):
+            serve(chatbot_app, executor, ids)
+    return CONVERSATIONS * ROUNDS / (time.perf_counter() - start)
+
+
+def shared(workers: int, latency: float) -> float:
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as folder:
+        store = os.path.join(folder, "conversations.db")
+        client = new_app(latency, store).app.test_client()
+        ids = [client.post('/conversation/new').json["id"] for _ in range(CONVERSATIONS)]
+
+        barrier = context.Barrier(workers)
+        results = context.Queue()
+        processes = [context.Process(target=worker, args=(i, workers, ids, store, latency, barrier, results))
+                     for i in range(workers)]
+        for process in processes:
+            process.start()
+        elapsed = max(results.get() for _ in processes)
+        for process in processes:
+            process.join()
+    return CONVERSATIONS * ROUNDS / elapsed
+
+
+def main():
+    print(f"{'LLM latency':>12} {'workers':>16} {'messages/s':>11} {'speedup':>8}")
+    for latency in [0.0, 0.02]:
+        reference = baseline(latency)
+        print(f"{latency * 1000:>10.0f}ms {'1 (in memory)':>16} {reference:>11.1f} {1:>8.2f}")
+        for workers in [1, 2, 4, 8]:
+            result = shared(workers, latency)
+            print(f"{latency * 1000:>10.0f}ms {workers:>16} {result:>11.1f} {result / reference:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Benchmark of snapshotting and restoring conversations of increasing size.
+
+Usage: python -m benchmarks.bench_snapshot [chatbot-folder]
+"""
+import sys
+import timeit
+
+from benchmarks.common import BenchmarkConfiguration, NullChannel
+from taskyto.engine.common.memory import MemoryPiece
+from taskyto.engine.custom import snapshot
+
+
+def new_conversation(configuration, turns):
+    engine = configuration.new_engine()
+    engine.start(NullChannel())
+    state = engine.execution_state
+    module = state.current.module
+    for i in range(turns):
+        state.update_memory(module, MemoryPiece().add_human_message(f"This is the user message number {i}"), 'history')
+        state.update_memory(module, MemoryPiece().add_ai_response(f"This is the answer number {i}"), 'history')
+        state.update_memory(module, MemoryPiece().add_instruction_message(f"Instruction {i}"), 'instruction')
+    return engine
+
+
+def main(chatbot_folder="examples/yaml/bike-shop", sizes=(10, 100, 1000)):
+    configuration = BenchmarkConfiguration(chatbot_folder)
+    print(f"{'turns':>6} {'size (KiB)':>11} {'snapshot (ms)':>14} {'restore (ms)':>13}")
+    for turns in sizes:
+        engine = new_conversation(configuration, turns)
+        serialized = snapshot.dumps(engine.snapshot())
+        restored = configuration.new_engine()
+
+        number = max(1, 2000 // turns)
+        snapshot_time = min(timeit.repeat(lambda: snapshot.dumps(engine.snapshot()), number=number, repeat=3)) / number
+        restore_time = min(timeit.repeat(lambda: restored.restore(snapshot.loads(serialized), NullChannel()),
+                                         number=number, repeat=3)) / number
+        print(f"{turns:>6} {len(serialized) / 1024:>11.1f} {snapshot_time * 1e3:>14.3f} {restore_time * 1e3:>13.3f}")
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,66 @@
+"""
+Overhead of the span instrumentation on the turns of a conversation with an instantaneous LLM, with the null
+tracer (the default), an in-memory collector and a JSONL file. The cost of opening a single span is also shown,
+to compare the null tracer with a recording one.
+
+Usage: python -m benchmarks.bench_spans
+"""
+import os
+import tempfile
+import timeit
+
+from benchmarks.common import BenchmarkConfiguration, NullChannel
+from taskyto.engine.common.spans import Tracer, InMemorySpanSink, JsonlSpanSink, TracedLLM, NULL_TRACER
+
+TURNS = 2000
+SPANS = 200000
+
+
+class SpanBenchmarkConfiguration(BenchmarkConfiguration):
+    def __init__(self, root_folder, tracer):
+        super().__init__(root_folder)
+        self.tracer = tracer
+
+    def get_tracer(self):
+        return self.tracer
+
+    def new_llm(self, module_name=None):
+        if not self.tracer.enabled:
+            return self.llm
+        return TracedLLM(self.llm, self.tracer, module_name=module_name, model_id="mocked")
+
+
+def per_turn(tracer) -> float:
+    engine = SpanBenchmarkConfiguration("examples/yaml/bike-shop", tracer).new_engine()
+    engine.start(NullChannel())
+    return timeit.timeit(lambda: engine.execute_with_input("Hi"), number=TURNS) / TURNS
+
+
+def per_span(tracer) -> float:
+    def open_span():
+        with tracer.span("action", action="SayAction"):
+            pass
+    return timeit.timeit(open_span, number=SPANS) / SPANS
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        in_memory = InMemorySpanSink()
+        tracers = {
+            "null (default)": NULL_TRACER,
+            "in-memory": Tracer(in_memory),
+            "jsonl": Tracer(JsonlSpanSink(os.path.join(folder, "spans.jsonl"))),
+        }
+        print(f"{'tracer':>16} {'per turn (us)':>14} {'per span (us)':>14}")
+        for name, tracer in tracers.items():
+            turn = per_turn(tracer)
+            if tracer is tracers["in-memory"]:
+                spans_per_turn = len(in_memory.spans) / (TURNS + 1)
+            span = per_span(tracer)
+            print(f"{name:>16} {turn * 1e6:>14.1f} {span * 1e6:>14.3f}")
+            tracer.close()
+        print(f"spans per turn: {spans_per_turn:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Cost of the stateless mode of the server: the size of the signed state of a conversation and the time to encode
+and decode it as the conversation grows, without trimming and keeping the last 10 turns, and the time of a whole
+turn through the server keeping the conversations in memory and in stateless mode.
+
+Usage: python -m benchmarks.bench_state_blob
+"""
+import os
+import timeit
+
+from benchmarks.common import BenchmarkConfiguration, NullChannel
+from taskyto.engine.common.configuration import SessionConfiguration, StatelessConfiguration
+from taskyto.engine.custom.snapshot import dumps
+from taskyto.server import FlaskChatbotApp
+from taskyto.server.state import StateCodec
+
+REPEAT = 200
+TURNS = [1, 10, 50, 200]
+
+
+def snapshots():
+    engine = BenchmarkConfiguration("examples/yaml/bike-shop").new_engine()
+    engine.start(NullChannel())
+    for turn in range(1, max(TURNS) + 1):
+        engine.execute_with_input(f"I would like to know the opening hours, this is message {turn}")
+        if turn in TURNS:
+            yield turn, engine.snapshot()
+
+
+def per_turn(sessions) -> float:
+    chatbot_app = FlaskChatbotApp(BenchmarkConfiguration("examples/yaml/bike-shop"), metrics=False,
+                                  sessions=sessions)
+    client = chatbot_app.app.test_client()
+    response = client.post('/conversation/new').json
+    message = {"id": response["id"], "message": "Hi", "state": response.get("state")}
+    # Long enough for the state to reach the trimming window
+    for _ in range(20):
+        message["state"] = client.post('/conversation/user_message', json=message).json.get("state")
+
+    def turn():
+        message["state"] = client.post('/conversation/user_message', json=message).json.get("state")
+
+    return timeit.timeit(turn, number=REPEAT) / REPEAT
+
+
+def main():
+    print(f"{'turns':>6} {'window':>7} {'snapshot (B)':>13} {'blob (B)':>9} {'encode (us)':>12} {'decode (us)':>12}")
+    for turns, snapshot in snapshots():
+        for last_turns in [None, 10]:
+            codec = StateCodec(b"secret", max_size=1 << 24, last_turns=last_turns)
+            blob = codec.encode("id", snapshot)
+            encode = timeit.timeit(lambda: codec.encode("id", snapshot), number=REPEAT) / REPEAT
+            decode = timeit.timeit(lambda: codec.decode("id", blob), number=REPEAT) / REPEAT
+            print(f"{turns:>6} {str(last_turns or 'all'):>7} {len(dumps(snapshot)):>13} {len(blob):>9} "
+                  f"{encode * 1e6:>12.1f} {decode * 1e6:>12.1f}")
+
+    os.environ.setdefault("TASKYTO_STATE_SECRET", "benchmark")
+    in_memory = per_turn(None)
+    stateless = per_turn(SessionConfiguration(stateless=StatelessConfiguration()))
+    print(f"turn through the server: in memory {in_memory * 1e6:.0f} us, stateless {stateless * 1e6:.0f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Measures the time to the first byte of the response received by an HTTP client, with and without
+Server-Sent Events, using an LLM which generates its tokens (words) at a fixed pace.
+
+Usage: python -m benchmarks.bench_streaming [latency]
+"""
+import sys
+import time
+
+from benchmarks.common import BenchmarkConfiguration, LatencyLLM
+from taskyto.server import FlaskChatbotApp
+
+CHATBOT = "examples/yaml/bike-shop"
+ANSWER = " ".join(["word"] * 40)
+MESSAGES = 5
+
+
+def measure(client, streaming):
+    id_ = client.post('/conversation/new').json['id']
+    headers = {"Accept": "text/event-stream"} if streaming else {}
+    first, total = [], []
+    for i in range(MESSAGES):
+        start = time.perf_counter()
+        response = client.post('/conversation/user_message', json={"id": id_, "message": f"Message {i}"},
+                               headers=headers, buffered=False)
+        received = None
+        for _ in response.response:
+            if received is None:
+                received = time.perf_counter() - start
+        first.append(received)
+        total.append(time.perf_counter() - start)
+        response.close()
+    return sum(first) / MESSAGES, sum(total) / MESSAGES
+
+
+def main():
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    configuration = BenchmarkConfiguration(CHATBOT, LatencyLLM(answer=ANSWER, latency=latency))
+    client = FlaskChatbotApp(configuration).app.test_client()
+
+    print(f"LLM latency: {latency * 1000:.0f} ms for {len(ANSWER.split())} words")
+    for name, streaming in [("json", False), ("sse", True)]:
+        first, total = measure(client, streaming)
+        print(f"{name:>5}: first byte {first * 1000:8.1f} ms, full response {total * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
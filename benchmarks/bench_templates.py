@@ -0,0 +1,49 @@
+"""
+Rendering of on-success responses, comparing the previous replace_values, which replaced every data key and then
+evaluated each line as an f-string, with the precompiled templates.
+
+Usage: python -m benchmarks.bench_templates [renders]
+"""
+import sys
+import time
+
+from taskyto.engine.common import replace_values
+
+TEMPLATES = {
+    "variables": "Your appointment for a {{service}} is booked on {{date}} at {{time}}.\nSee you soon!",
+    "expression": "You ordered {num_drinks} {drinks}.\nThe total is {result:.2f}$",
+}
+DATA = {"service": "repair", "date": "2024-05-10", "time": "10:00", "num_drinks": 2, "drinks": "coke",
+        "result": 23.5, "pizza_size": "large", "pizza_type": "margarita"}
+
+
+def legacy_replace_values(response, data):
+    for k, v in data.items():
+        response = response.replace("{{" + k + "}}", str(v))
+        response = response.replace("{" + k + "}", str(v))
+
+    def eval_expression(expr, data):
+        string_eval = "f\"" + expr + "\""
+        return eval(string_eval, data)
+
+    return "\n".join([eval_expression(line, data) for line in response.split("\n")])
+
+
+def measure(function, template, renders):
+    start = time.perf_counter()
+    for _ in range(renders):
+        function(template, dict(DATA))
+    return (time.perf_counter() - start) / renders * 1e6
+
+
+def main():
+    renders = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for name, template in TEMPLATES.items():
+        assert legacy_replace_values(template, dict(DATA)) == replace_values(template, dict(DATA))
+        before = measure(legacy_replace_values, template, renders)
+        after = measure(replace_values, template, renders)
+        print(f"{name:>10}: before {before:7.2f} us, after {after:6.2f} us ({before / after:.0f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Cost of recording the trace of a conversation, per event, comparing the previous recording (which wrapped every
+serialized event into a pydantic InternalTraceItem) with the current one, which keeps the serialized event, with
+tracing off, and with a ring buffer. The events are those of a task: the activation of a module with the previous answer, the user input,
+its progress, and the response.
+
+Usage: python -m benchmarks.bench_tracing
+"""
+import timeit
+
+from taskyto.engine.common.memory import MemoryPiece
+from taskyto.engine.custom.events import ActivateModuleEvent, UserInput, TaskInProgressEvent, AIResponseEvent
+from taskyto.recording import RecordedInteraction, InternalTraceItem
+
+NUMBER = 20000
+
+
+class ModuleStub:
+    def name(self):
+        return "make_appointment"
+
+
+def events():
+    previous_answer = (MemoryPiece().add_ai_reasoning_message("Thought: Do I need to use a tool? Yes")
+                       .add_ai_response("I will schedule an appointment"))
+    progress = {'collected_data': MemoryPiece().add_data_message("service = repair", {"service": "repair"}),
+                'instruction': MemoryPiece().add_instruction_message("Ask for the date and the time")}
+    return [ActivateModuleEvent(ModuleStub(), "{'service': 'repair'}", previous_answer),
+            UserInput("I need a repair"),
+            TaskInProgressEvent(memory=progress),
+            AIResponseEvent("When do you want to come?")]
+
+
+class EagerRecording:
+    def __init__(self):
+        self.trace = []
+
+    def append_trace(self, event):
+        self.trace.append(InternalTraceItem(type='event-transition', event=event.to_dict()))
+
+
+def per_event(recording, sample):
+    def record():
+        # As in CustomPromptEngine.next_transition
+        for event in sample:
+            if recording.tracing:
+                recording.append_trace(event)
+    return timeit.timeit(record, number=NUMBER) / (NUMBER * len(sample))
+
+
+def main():
+    sample = events()
+    eager = EagerRecording()
+    eager.tracing = True
+    recordings = {
+        "pydantic (before)": eager,
+        "dict": RecordedInteraction(),
+        "ring buffer (100)": RecordedInteraction(max_items=100),
+        "off": RecordedInteraction(tracing=False),
+    }
+    print(f"{'recording':>18} {'per event (us)':>15} {'kept events':>12}")
+    for name, recording in recordings.items():
+        cost = per_event(recording, sample)
+        print(f"{name:>18} {cost * 1e6:>15.3f} {len(recording.trace):>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Throughput of the server as a single process and as a front process forwarding the messages to 1, 2, 4 and 8
+worker processes (see taskyto.server.pool). A pool of client threads sends the messages of their own
+conversations, and the LLM answers instantaneously, so the engines are CPU bound and a single process is limited
+by the GIL.
+
+Usage: python -m benchmarks.bench_worker_pool
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import BenchmarkConfiguration
+from taskyto.server import FlaskChatbotApp
+from taskyto.server.pool import WorkerPool, PooledChatbotApp
+
+THREADS = 16
+MESSAGES = 50
+
+
+def new_configuration():
+    # Called in the worker processes
+    return BenchmarkConfiguration("examples/yaml/bike-shop")
+
+
+def throughput(app) -> float:
+    client = app.test_client()
+    ids = [client.post('/conversation/new').json["id"] for _ in range(THREADS)]
+
+    def converse(id):
+        client = app.test_client()
+        for _ in range(MESSAGES):
+            response = client.post('/conversation/user_message', json={"id": id, "message": "Hi"})
+            assert response.status_code == 200
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        list(executor.map(converse, ids))
+    return THREADS * MESSAGES / (time.perf_counter() - start)
+
+
+def main():
+    print(f"{os.cpu_count()} CPUs, {THREADS} client threads")
+    print(f"{'workers':>16} {'messages/s':>11} {'speedup':>8}")
+    baseline = throughput(FlaskChatbotApp(new_configuration(), metrics=False).app)
+    print(f"{'single process':>16} {baseline:>11.1f} {1:>8.2f}")
+    for workers in [1, 2, 4, 8]:
+        pool = WorkerPool(new_configuration, workers)
+        pool.start()
+        try:
+            result = throughput(PooledChatbotApp(pool).app)
+        finally:
+            pool.stop()
+        print(f"{workers:>16} {result:>11.1f} {result / baseline:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Shared helpers for the benchmarks: a configuration which does not need an API key and a silent channel."""
+import asyncio
+import time
+from typing import Optional, List, Iterator
+
+from taskyto.engine.common.configuration import ConfigurationModel
+from taskyto.engine.common.llm import LLM, LLMInput, LLMResponse
+from taskyto.engine.custom.runtime import Channel
+from taskyto.main import CustomConfiguration
+
+
+class LatencyLLM(LLM):
+    """Always gives the same answer, after waiting for the given latency (in seconds)."""
+
+    def __init__(self, answer: str = "Hello, how can I help you?", latency: float = 0.0):
+        self.answer = answer
+        self.latency = latency
+
+    def __call__(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
+        return self.invoke(input_, stop)
+
+    def invoke(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return self.response()
+
+    async def ainvoke(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        return self.response()
+
+    def stream(self, input_: LLMInput, stop: Optional[List[str]] = None) -> Iterator[str]:
+        # The latency is spread over the tokens (words) of the completion
+        tokens = self.response().content.split(" ")
+        for i, token in enumerate(tokens):
+            if self.latency > 0:
+                time.sleep(self.latency / len(tokens))
+            yield token if i == 0 else " " + token
+
+    def response(self):
+        return LLMResponse(f"Thought: Do I need to use a tool? No\nAI: {self.answer}")
+
+
+class BenchmarkConfiguration(CustomConfiguration):
+
+    def __init__(self, root_folder: str, llm: LLM = None):
+        super().__init__(root_folder, ConfigurationModel(default_llm="mocked", languages="en"))
+        self.llm = llm if llm is not None else LatencyLLM()
+
+    def new_llm(self, module_name: Optional[str] = None):
+        return self.llm
+
+
+class NullChannel(Channel):
+
+    def __init__(self):
+        self.responses = []
+
+    def input(self):
+        return None
+
+    def output(self, msg, who=None):
+        self.responses.append(msg)
+
+    def thinking(self, text: str):
+        pass
+
+    def stop_thinking(self):
+        pass
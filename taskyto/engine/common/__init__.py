@@ -7,6 +7,7 @@ import networkx as nx
 
 from taskyto import spec
 from taskyto.engine.common.evaluator import Evaluator
+from taskyto.engine.common.template import compile_template
 
 class DebugInfo:
     def __init__(self, current_module: str):
@@ -44,6 +45,38 @@ class Configuration(abc.ABC):
     def new_rephraser(self):
         raise NotImplementedError()
 
+    def get_memory_policy(self, module_name: Optional[str] = None):
+        """The policy which limits the memory of the given module sent to the LLM. None means no limit."""
+        return None
+
+    def new_recording(self):
+        """The recording of the interactions of a new conversation (see taskyto.recording)"""
+        from taskyto.recording import RecordedInteraction
+        return RecordedInteraction()
+
+    def get_tracer(self):
+        """The tracer of the spans of the engine (see taskyto.engine.common.spans). By default, nothing is traced."""
+        from taskyto.engine.common.spans import NULL_TRACER
+        return getattr(self, "_tracer", NULL_TRACER)
+
+    def add_span_sink(self, sink):
+        """Sends the spans of the engines created from now on also to the given sink"""
+        from taskyto.engine.common.spans import Tracer
+        tracer = self.get_tracer()
+        if tracer.enabled:
+            tracer.add_sink(sink)
+        else:
+            self._tracer = Tracer(sink)
+
+    def remove_span_sink(self, sink):
+        """Stops sending the spans to a sink given to add_span_sink"""
+        from taskyto.engine.common.spans import NULL_TRACER
+        tracer = self.get_tracer()
+        if tracer.enabled:
+            tracer.remove_sink(sink)
+            if not tracer.sinks:
+                self._tracer = NULL_TRACER
+
 
 class BasicConfiguration(Configuration, metaclass=ABCMeta):
     "A basic configuration for the most commonly used components"
@@ -51,9 +84,11 @@ class BasicConfiguration(Configuration, metaclass=ABCMeta):
     def __init__(self, root_folder):
         self.chatbot_model = spec.load_chatbot_model(root_folder)
         self.root_folder = root_folder
+        self.evaluator = Evaluator(load_path=[self.root_folder])
 
     def new_evaluator(self):
-        return Evaluator(load_path=[self.root_folder])
+        # The evaluator does not keep state of the conversation, so it can be shared
+        return self.evaluator
 
 
 class Rephraser(abc.ABC):
@@ -122,18 +157,8 @@ def get_property_value(p: spec.DataProperty, data):
 
 
 def replace_values(response, data):
-    for k, v in data.items():
-        # Handle both {{ }} and { }
-        response = response.replace("{{" + k + "}}", str(v))
-        response = response.replace("{" + k + "}", str(v))
-
-    def eval_expression(expr, data):
-        string_eval = "f\"" + expr + "\""
-        return eval(string_eval, data)
-
-    # We eval expressions line by line because the format trick only works line by line
-    response = "\n".join([eval_expression(line, data) for line in response.split("\n")])
-    return response
+    # Templates are parsed once and cached, see taskyto.engine.common.template
+    return compile_template(response).render(data)
 
 
 def compute_init_module(chatbot_model: spec.ChatbotModel) -> spec.Module:
@@ -1,10 +1,15 @@
-from typing import List, Any, Union, Optional
+import threading
+from typing import List, Any, Union, Optional, Dict, Literal
 
 import pydantic
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, PrivateAttr
 
-from taskyto.engine.common.llm import LLM, OpenAILLM, ExtensionLLM
+from taskyto.engine.common.llm import LLM, OpenAILLM, ExtensionLLM, OpenAIClients
+from taskyto.engine.common.llm_cache import LLMCache, CachedLLM
+from taskyto.engine.common.memory_policy import MemoryPolicy
+from taskyto.engine.common.spans import Tracer, NULL_TRACER, JsonlSpanSink, TracedLLM, SpanSink
 from taskyto.extensions.extension import ExtensionLoader
+from taskyto.recording import RecordedInteraction, new_recording
 
 from taskyto.utils import parse_obj_as_
 
@@ -13,9 +18,77 @@ class LLMConfiguration(BaseModel):
     id: str
     temperature: float = 0.0
 
+class CacheConfiguration(BaseModel):
+    enabled: bool = True
+    memory_entries: int = 1024
+    path: Optional[str] = None
+    """SQLite file shared by all the processes. If not given, completions are only cached in memory."""
+    max_size_mb: float = 100
+    max_temperature: float = 0.0
+    """Requests with a higher temperature are not cached, since their completions are not expected to be repeatable"""
+
+class MemoryPolicyConfiguration(BaseModel):
+    last_turns: Optional[int] = None
+    """Number of turns of the history which are sent to the LLM"""
+    max_tokens: Optional[int] = None
+    """Token budget of each memory in the prompt"""
+    pinned: List[str] = ["data", "instruction"]
+    """Memory types which are always sent, regardless of the limits"""
+    on_exit: Literal["keep", "data", "summary"] = "keep"
+    """What is kept in the memories of a module when it finishes: everything, the collected data, or the
+    collected data and the last response"""
+
+    def to_policy(self) -> MemoryPolicy:
+        return MemoryPolicy(last_turns=self.last_turns, max_tokens=self.max_tokens, pinned=self.pinned,
+                            on_exit=self.on_exit)
+
+class TracingConfiguration(BaseModel):
+    mode: Literal["full", "sampled", "off"] = "full"
+    """Whether the events of every conversation are traced, only those of a sample of them, or none"""
+    sample_rate: float = 0.1
+    """Fraction of the conversations which are traced in sampled mode"""
+    max_items: Optional[int] = None
+    """If given, only the last interactions, events and response times of each conversation are kept"""
+    spans: Optional[str] = None
+    """JSONL file to which the spans of the turns, transitions, actions, modules and LLM calls are written"""
+
+    def new_recording(self) -> RecordedInteraction:
+        return new_recording(mode=self.mode, sample_rate=self.sample_rate, max_items=self.max_items)
+
+    def new_tracer(self) -> Tracer:
+        if self.spans is None:
+            return NULL_TRACER
+        return Tracer(JsonlSpanSink(self.spans))
+
+class StatelessConfiguration(BaseModel):
+    secret_env: str = "TASKYTO_STATE_SECRET"
+    """Environment variable with the secret which signs the states, shared by all the replicas of the server"""
+    max_size: int = 32768
+    """Maximum size in bytes of the state of a conversation"""
+    last_turns: Optional[int] = 10
+    """Turns of each memory which are kept in the state"""
+
+class SessionConfiguration(BaseModel):
+    max_live: Optional[int] = None
+    """Maximum number of conversations kept in memory by the server. The least recently used are hibernated."""
+    idle_ttl: Optional[float] = None
+    """Seconds without messages after which a conversation is hibernated"""
+    expire_after: Optional[float] = None
+    """Seconds without messages after which a conversation is removed, even if it is hibernated"""
+    hibernation_folder: Optional[str] = None
+    """Folder where hibernated conversations are stored. If not given, they are removed instead."""
+    store: Optional[str] = None
+    """SQLite file where the conversations are stored, shared by the workers of the server so that any of them can
+    serve any conversation. max_live and idle_ttl then limit the conversations cached by each worker, and
+    expire_after removes them from the store."""
+    stateless: Optional[StatelessConfiguration] = None
+    """If given, the server keeps no conversations: their signed state is sent back and forth with the client"""
+
 class ModuleConfiguration(BaseModel):
     name: str
-    llm: Union[LLMConfiguration, str]
+    llm: Optional[Union[LLMConfiguration, str]] = None
+    cache: Optional[Union[CacheConfiguration, bool]] = None
+    memory: Optional[MemoryPolicyConfiguration] = None
 
 class ConversationStart(BaseModel):
     with_: Optional[str] = Field(alias="with")
@@ -37,18 +110,150 @@ class ConfigurationModel(BaseModel):
     languages: str = "any"
     modules: List[ModuleConfiguration] = []
     begin: Optional[ConversationStart] = None
+    cache: Optional[Union[CacheConfiguration, bool]] = None
+    """Default cache of LLM completions, which can be overridden per module"""
+    memory: Optional[MemoryPolicyConfiguration] = None
+    """Default policy to limit the memory sent in the prompts, which can be overridden per module"""
+    tracing: Optional[TracingConfiguration] = None
+    """How the interactions and the events of the conversations are recorded. By default, everything is kept."""
+    sessions: Optional[SessionConfiguration] = None
+    """Limits of the conversations kept by the server (see taskyto.server.conversations). By default, none."""
 
     extension_loader: Optional[ExtensionLoader] = None
 
+    # The registry of LLMs. Each module is resolved once, and modules with the same LLM and cache configuration
+    # share the LLM object. OpenAI LLMs share the clients, and therefore their pools of connections.
+    _llms_by_module: Dict[Optional[str], LLM] = PrivateAttr(default_factory=dict)
+    _llms: Dict[str, LLM] = PrivateAttr(default_factory=dict)
+    _caches: Dict[str, LLMCache] = PrivateAttr(default_factory=dict)
+    _openai_clients: OpenAIClients = PrivateAttr(default_factory=OpenAIClients)
+    _memory_policies: Dict[Optional[str], Optional[MemoryPolicy]] = PrivateAttr(default_factory=dict)
+    _tracer: Optional[Tracer] = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.RLock)
+
+    @property
+    def connection_stats(self):
+        """Counters of the HTTP connections opened and reused by the OpenAI LLMs"""
+        return self._openai_clients.stats
+
     def set_module_path(self, module_path: List[str]):
         if self.extension_loader is None:
             self.extension_loader = ExtensionLoader(module_path)
         else:
             self.extension_loader.module_path = module_path
+        with self._lock:
+            self._llms_by_module.clear()
+            self._llms.clear()
+
+    def resolve_llms(self, module_names: List[str]):
+        """Resolves in advance the LLM of the given modules and the default one"""
+        for module_name in [None, *module_names]:
+            self.get_llm_for_module_or_default(module_name)
 
-    def get_llm_for_module_or_default(self, module_name: str) -> LLM:
+    def get_llm_for_module_or_default(self, module_name: Optional[str]) -> LLM:
+        llm = self._llms_by_module.get(module_name)
+        if llm is None:
+            with self._lock:
+                llm = self._llms_by_module.get(module_name)
+                if llm is None:
+                    llm = self._resolve_llm(module_name)
+                    tracer = self.get_tracer()
+                    if tracer.enabled:
+                        # Traced per module, so that the spans tell on whose behalf the LLM is called
+                        model_id = self._get_config_for_module_or_default(module_name).id
+                        llm = TracedLLM(llm, tracer, module_name=module_name, model_id=model_id)
+                    self._llms_by_module[module_name] = llm
+        return llm
+
+    def get_tracer(self) -> Tracer:
+        """The tracer shared by all the conversations, which records nothing unless tracing.spans is given"""
+        if self._tracer is None:
+            with self._lock:
+                if self._tracer is None:
+                    self._tracer = self.tracing.new_tracer() if self.tracing is not None else NULL_TRACER
+        return self._tracer
+
+    def add_span_sink(self, sink: SpanSink):
+        """Sends the spans also to the given sink. LLMs are resolved again, so that their calls are traced."""
+        with self._lock:
+            tracer = self.get_tracer()
+            if tracer.enabled:
+                tracer.add_sink(sink)
+            else:
+                self._tracer = Tracer(sink)
+            self._llms_by_module.clear()
+
+    def remove_span_sink(self, sink: SpanSink):
+        """Stops sending the spans to a sink given to add_span_sink. LLMs are no longer traced if no sink is left."""
+        with self._lock:
+            tracer = self.get_tracer()
+            if tracer.enabled:
+                tracer.remove_sink(sink)
+                if not tracer.sinks:
+                    self._tracer = NULL_TRACER
+                    self._llms_by_module.clear()
+
+    def _resolve_llm(self, module_name: Optional[str]) -> LLM:
         config = self._get_config_for_module_or_default(module_name)
-        return self._create_llm(config)
+        cache_config = self._get_cache_config_for_module_or_default(module_name)
+        if cache_config is not None and config.temperature > cache_config.max_temperature:
+            cache_config = None
+
+        key = config.model_dump_json() + (cache_config.model_dump_json() if cache_config is not None else "")
+        llm = self._llms.get(key)
+        if llm is None:
+            llm = self._create_llm(config)
+            if cache_config is not None:
+                llm = CachedLLM(llm, self.get_cache(cache_config), model_id=config.id, temperature=config.temperature)
+            self._llms[key] = llm
+        return llm
+
+    def get_memory_policy(self, module_name: Optional[str]) -> Optional[MemoryPolicy]:
+        if module_name not in self._memory_policies:
+            with self._lock:
+                if module_name not in self._memory_policies:
+                    config = self.memory
+                    for module in self.modules:
+                        if module.name == module_name and module.memory is not None:
+                            config = module.memory
+                    self._memory_policies[module_name] = config.to_policy() if config is not None else None
+        return self._memory_policies[module_name]
+
+    @property
+    def cache_stats(self):
+        """The hits and misses of each cache of LLM completions, by its file (or memory, if it has no file)"""
+        with self._lock:
+            caches = list(self._caches.values())
+        return {cache.disk.path if cache.disk is not None else f"memory:{cache.memory.max_entries}": cache.stats
+                for cache in caches}
+
+    @property
+    def memory_policy_stats(self):
+        """The tokens saved by the memory policy of each module"""
+        return {module_name: policy.stats for module_name, policy in self._memory_policies.items()
+                if policy is not None}
+
+    def get_cache(self, cache_config: CacheConfiguration) -> LLMCache:
+        key = cache_config.model_dump_json()
+        with self._lock:
+            cache = self._caches.get(key)
+            if cache is None:
+                cache = LLMCache(memory_entries=cache_config.memory_entries,
+                                 path=cache_config.path,
+                                 max_disk_bytes=int(cache_config.max_size_mb * 1024 * 1024))
+                self._caches[key] = cache
+            return cache
+
+    def _get_cache_config_for_module_or_default(self, module_name: str) -> Optional[CacheConfiguration]:
+        cache = self.cache
+        for module in self.modules:
+            if module.name == module_name and module.cache is not None:
+                cache = module.cache
+        if cache is None or cache is False:
+            return None
+        if cache is True:
+            return CacheConfiguration()
+        return cache if cache.enabled else None
 
     def _create_llm(self, config: LLMConfiguration) -> LLM:
         for service in self.llm_services:
@@ -56,11 +261,11 @@ class ConfigurationModel(BaseModel):
                 return ExtensionLLM(self._create_llm_from_service(service))
 
         # Return this as a default, but we should possibly raise an exception if the model name is valid
-        return OpenAILLM(model_name=config.id, temperature=config.temperature)
+        return OpenAILLM(model_name=config.id, temperature=config.temperature, clients=self._openai_clients)
 
     def _get_config_for_module_or_default(self, module_name: str) -> LLMConfiguration:
         for module in self.modules:
-            if module.name == module_name:
+            if module.name == module_name and module.llm is not None:
                 return ConfigurationModel.__to_llm_config(module.llm)
         return ConfigurationModel.__to_llm_config(self.default_llm)
 
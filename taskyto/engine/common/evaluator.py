@@ -1,4 +1,5 @@
 import os
+import threading
 from typing import List
 
 from taskyto.spec import ExecuteElement
@@ -14,46 +15,97 @@ def find_file(filename, load_path):
     raise ValueError(f"File {filename} not found in load path")
 
 
-def eval_python_file(filename: str, data: dict):
-    with open(filename) as f:
-        code_to_execute = f.read()
-        code_to_execute += f'\nglobals()["chatbot_llm_action_result_"] = main({", ".join(data.keys())})\n'
+# Compiled code is cached: files by path, and reloaded when their modification time or size changes,
+# and inline code by its source and parameters.
+_file_cache = {}
+_inline_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _file_stamp(filename: str):
+    stat = os.stat(filename)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_python_file(filename: str):
+    """Returns the main function defined in the given file."""
+    stamp = _file_stamp(filename)
+    cached = _file_cache.get(filename)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
 
-        compiled = compile(code_to_execute, filename, "exec")
+    with _cache_lock:
+        cached = _file_cache.get(filename)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        with open(filename) as f:
+            compiled = compile(f.read(), filename, "exec")
         global_vars = globals().copy()
-        exec(compiled, global_vars, data.copy())
-        result = global_vars["chatbot_llm_action_result_"]
-        return result
+        exec(compiled, global_vars)
+        main = global_vars.get("main")
+        if main is None:
+            raise ValueError(f"File {filename} does not define a main function")
 
+        _file_cache[filename] = (stamp, main)
+        return main
 
-def eval_python_inline(code: str, data: dict):
-    # insert a "\t" at the beginning of all lines of code
-    code = "\t" + code.replace("\n", "\n\t")
-    params = ", ".join(data.keys())
-    code = f"""
-def _eval({params}):
-{code}
 
-globals()['chatbot_llm_action_result_'] = _eval({params})
-    """
+def eval_python_file(filename: str, data: dict):
+    main = load_python_file(filename)
+    return main(*data.values())
+
 
-    compiled = compile(code, "<string>", "exec")
-    global_vars = globals().copy()
-    eval(compiled, global_vars, data.copy())
-    result = global_vars["chatbot_llm_action_result_"]
-    return result
+def compile_python_inline(code: str, params: tuple):
+    """Returns a function whose body is the given code and whose parameters are params."""
+    key = (code, params)
+    function = _inline_cache.get(key)
+    if function is not None:
+        return function
+
+    with _cache_lock:
+        function = _inline_cache.get(key)
+        if function is not None:
+            return function
+
+        # insert a "\t" at the beginning of all lines of code
+        body = "\t" + code.replace("\n", "\n\t")
+        source = f"""
+def _eval({", ".join(params)}):
+{body}
+"""
+        compiled = compile(source, "<string>", "exec")
+        global_vars = globals().copy()
+        exec(compiled, global_vars)
+        function = global_vars["_eval"]
+
+        _inline_cache[key] = function
+        return function
+
+
+def eval_python_inline(code: str, data: dict):
+    function = compile_python_inline(code, tuple(data.keys()))
+    return function(*data.values())
 
 
 class Evaluator:
     def __init__(self, load_path: List[str] = []):
         self.load_path = load_path
+        self._files = {}
+
+    def find_file(self, filename):
+        full_path = self._files.get(filename)
+        if full_path is None:
+            full_path = find_file(filename, self.load_path)
+            self._files[filename] = full_path
+        return full_path
 
     def eval_code(self, execution: ExecuteElement, data: dict):
         lang = execution.language.lower()
         if lang == "python":
 
             if execution.code.endswith(".py"):
-                filename = find_file(execution.code, self.load_path)
+                filename = self.find_file(execution.code)
                 return eval_python_file(filename, data)
             else:
                 code_to_execute = execution.code
@@ -1,5 +1,6 @@
 import abc
-from typing import Union, List, Optional
+import asyncio
+from typing import Union, List, Optional, Iterator, AsyncIterator
 
 
 class Message:
@@ -19,21 +20,192 @@ class LLMResponse:
 
 class LLM(abc.ABC):
     @abc.abstractmethod
-    def __call__(self, input_: LLMInput) -> LLMResponse:
+    def __call__(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
         raise NotImplementedError()
 
-from openai import OpenAI
+    async def ainvoke(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
+        """Asynchronous version of invoke. By default, the blocking call is run in a worker thread."""
+        return await asyncio.to_thread(self, input_, stop)
+
+    def stream(self, input_: LLMInput, stop: Optional[List[str]] = None) -> Iterator[str]:
+        """Yields the completion in chunks as it is generated. By default, there is a single chunk."""
+        yield self(input_, stop).content
+
+    async def astream(self, input_: LLMInput, stop: Optional[List[str]] = None) -> AsyncIterator[str]:
+        yield (await self.ainvoke(input_, stop)).content
+
+
+async def ainvoke(llm, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
+    """Invokes asynchronously any llm, including plain callables which are not an LLM (e.g., test mocks)."""
+    if isinstance(llm, LLM):
+        return await llm.ainvoke(input_, stop)
+    return await asyncio.to_thread(llm, input_, stop=stop)
+
+
+def stream(llm, input_: LLMInput, stop: Optional[List[str]] = None) -> Iterator[str]:
+    """Streams the completion of any llm. Plain callables produce a single chunk."""
+    if isinstance(llm, LLM):
+        yield from llm.stream(input_, stop)
+    else:
+        yield llm(input_, stop=stop).content
+
+
+async def astream(llm, input_: LLMInput, stop: Optional[List[str]] = None) -> AsyncIterator[str]:
+    if isinstance(llm, LLM):
+        async for chunk in llm.astream(input_, stop):
+            yield chunk
+    else:
+        yield (await ainvoke(llm, input_, stop)).content
+
+
+import threading
+import weakref
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+
+class ConnectionStats:
+    """Counts the HTTP requests and how many of them had to open a new connection"""
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self._seen = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    @property
+    def reused_connections(self):
+        return self.requests - self.new_connections
+
+    def record(self, network_stream):
+        with self._lock:
+            self.requests += 1
+            if network_stream is None or network_stream not in self._seen:
+                self.new_connections += 1
+                if network_stream is not None:
+                    self._seen.add(network_stream)
+
+    def __repr__(self):
+        return f"ConnectionStats(requests={self.requests}, new_connections={self.new_connections})"
+
+
+class _CountingTransport(httpx.HTTPTransport):
+    def __init__(self, stats: ConnectionStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    def handle_request(self, request):
+        response = super().handle_request(request)
+        self.stats.record(response.extensions.get("network_stream"))
+        return response
+
+
+class _AsyncCountingTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, stats: ConnectionStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    async def handle_async_request(self, request):
+        response = await super().handle_async_request(request)
+        self.stats.record(response.extensions.get("network_stream"))
+        return response
+
+
+class OpenAIClients:
+    """
+    The OpenAI clients shared by the OpenAILLMs of a configuration, across conversations and threads.
+    Each client keeps a pool of keep-alive connections, so that only the first requests pay the TLS handshake.
+    Clients are created on first use. The connections of an async client belong to an event loop, so there is an
+    async client per loop.
+    """
+
+    def __init__(self, max_connections: int = 100):
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.stats = ConnectionStats()
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> OpenAI:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    transport = _CountingTransport(self.stats, limits=self.limits)
+                    self._client = OpenAI(http_client=DefaultHttpxClient(transport=transport))
+        return self._client
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            with self._lock:
+                client = self._async_clients.get(loop)
+                if client is None:
+                    # The connections of a client may keep its loop alive, so they are dropped once it is closed
+                    for closed in [other for other in list(self._async_clients.keys()) if other.is_closed()]:
+                        del self._async_clients[closed]
+                    transport = _AsyncCountingTransport(self.stats, limits=self.limits)
+                    client = AsyncOpenAI(http_client=DefaultAsyncHttpxClient(transport=transport))
+                    self._async_clients[loop] = client
+        return client
+
 
 class OpenAILLM(LLM):
-    def __init__(self, model_name: str, temperature: float = 0.0):
+    def __init__(self, model_name: str, temperature: float = 0.0, clients: Optional[OpenAIClients] = None):
         self.model_name = model_name
         self.temperature = temperature
-        self.client = OpenAI()
+        self.clients = clients if clients is not None else OpenAIClients()
+
+    @property
+    def client(self) -> OpenAI:
+        return self.clients.client
 
     def __call__(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
         return self.invoke(input_, stop)
 
     def invoke(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
+        completion = self.client.chat.completions.create(model=self.model_name,
+                                                         temperature=self.temperature,
+                                                         messages=self.to_openai_messages(input_),
+                                                         stop=stop)
+
+        result = completion.choices[0].message
+        return LLMResponse(result.content)
+
+    async def ainvoke(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
+        completion = await self.clients.async_client.chat.completions.create(model=self.model_name,
+                                                                             temperature=self.temperature,
+                                                                             messages=self.to_openai_messages(input_),
+                                                                             stop=stop)
+
+        result = completion.choices[0].message
+        return LLMResponse(result.content)
+
+    def stream(self, input_: LLMInput, stop: Optional[List[str]] = None) -> Iterator[str]:
+        chunks = self.client.chat.completions.create(model=self.model_name,
+                                                     temperature=self.temperature,
+                                                     messages=self.to_openai_messages(input_),
+                                                     stop=stop,
+                                                     stream=True)
+        for chunk in chunks:
+            if len(chunk.choices) > 0 and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def astream(self, input_: LLMInput, stop: Optional[List[str]] = None) -> AsyncIterator[str]:
+        chunks = await self.clients.async_client.chat.completions.create(model=self.model_name,
+                                                                         temperature=self.temperature,
+                                                                         messages=self.to_openai_messages(input_),
+                                                                         stop=stop,
+                                                                         stream=True)
+        async for chunk in chunks:
+            if len(chunk.choices) > 0 and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    @staticmethod
+    def to_openai_messages(input_: LLMInput) -> list:
         llm_input_messages = []
         if isinstance(input_, str):
             llm_input_messages.append({ "role": "user", "content":input_ })
@@ -44,14 +216,7 @@ class OpenAILLM(LLM):
                 else:
                     llm_input_messages.append({ "role": "developer", "content": message.content })
                 # TODO: Identify assistant role
-
-        completion = self.client.chat.completions.create(model=self.model_name,
-                                                         temperature=self.temperature,
-                                                         messages=llm_input_messages,
-                                                         stop=stop)
-
-        result = completion.choices[0].message
-        return LLMResponse(result.content)
+        return llm_input_messages
 
 
 class ExtensionLLM(LLM):
@@ -65,3 +230,16 @@ class ExtensionLLM(LLM):
 
     def invoke(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
         return LLMResponse(self.extension(input=input_, stop=stop))
+
+    async def ainvoke(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
+        # Extensions may provide an ainvoke coroutine, otherwise the blocking invoke runs in a worker thread
+        if self.extension.has_async():
+            return LLMResponse(await self.extension.acall(input=input_, stop=stop))
+        return await super().ainvoke(input_, stop)
+
+    def stream(self, input_: LLMInput, stop: Optional[List[str]] = None) -> Iterator[str]:
+        # Extensions may provide a stream generator, otherwise the whole completion is a single chunk
+        if self.extension.has_stream():
+            yield from self.extension.stream(input=input_, stop=stop)
+        else:
+            yield from super().stream(input_, stop)
@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, List, Iterator, AsyncIterator
+
+from taskyto.engine.common.llm import LLM, LLMInput, LLMResponse
+
+
+class CacheStats:
+    def __init__(self):
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def hits(self):
+        return self.memory_hits + self.disk_hits
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def __repr__(self):
+        return (f"CacheStats(memory_hits={self.memory_hits}, disk_hits={self.disk_hits}, "
+                f"misses={self.misses}, evictions={self.evictions})")
+
+
+class MemoryTier:
+    """An in-memory LRU of completions, bounded by the number of entries."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: str) -> int:
+        """Stores the value and returns the number of evicted entries"""
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        evicted = 0
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            evicted += 1
+        return evicted
+
+
+class SQLiteTier:
+    """
+    A SQLite file which can be shared by several processes. When the size of the stored completions
+    exceeds max_bytes, the least recently accessed ones are removed. The total size is kept in a row updated
+    with each write, in the same transaction, so that it is right for every process without adding the sizes.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS llm_cache ("
+                                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                                "size INTEGER NOT NULL, accessed REAL NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache(accessed)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS llm_cache_size ("
+                                "id INTEGER PRIMARY KEY, total INTEGER NOT NULL)")
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            # Files created before the size was kept are added up once
+            self.connection.execute("INSERT OR IGNORE INTO llm_cache_size (id, total) "
+                                    "SELECT 0, COALESCE(SUM(size), 0) FROM llm_cache")
+        self._lock = threading.Lock()
+        """The connection is shared by the threads, so each transaction holds it"""
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self.connection.execute("SELECT response FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, value: str) -> int:
+        """Stores the value and returns the number of evicted entries"""
+        size = len(value.encode("utf-8"))
+        with self._lock, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            row = self.connection.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            self.connection.execute("INSERT OR REPLACE INTO llm_cache (key, response, size, accessed) "
+                                    "VALUES (?, ?, ?, ?)", (key, value, size, time.time()))
+            total = self.total_size() + size - (row[0] if row is not None else 0)
+            evicted, total = self._evict(total)
+            self.connection.execute("UPDATE llm_cache_size SET total = ? WHERE id = 0", (total,))
+            return evicted
+
+    def total_size(self) -> int:
+        return self.connection.execute("SELECT total FROM llm_cache_size WHERE id = 0").fetchone()[0]
+
+    def _evict(self, total: int):
+        """Removes the least recently accessed entries until total fits, and returns their number and the new total"""
+        if total <= self.max_bytes:
+            return 0, total
+
+        to_remove = []
+        for key, size in self.connection.execute("SELECT key, size FROM llm_cache ORDER BY accessed"):
+            if total <= self.max_bytes:
+                break
+            to_remove.append((key,))
+            total -= size
+        self.connection.executemany("DELETE FROM llm_cache WHERE key = ?", to_remove)
+        return len(to_remove), total
+
+    def close(self):
+        self.connection.close()
+
+
+class LLMCache:
+    """
+    Cache of LLM completions with two tiers: an in-memory LRU and, optionally, a SQLite file shared across
+    processes. Entries found on disk are promoted to memory. The asynchronous methods access the disk in a worker
+    thread, so that they do not block the event loop.
+    """
+
+    def __init__(self, memory_entries: int = 1024, path: Optional[str] = None, max_disk_bytes: int = 100 * 1024 * 1024):
+        self.memory = MemoryTier(memory_entries)
+        self.disk = SQLiteTier(path, max_disk_bytes) if path is not None else None
+        self.stats = CacheStats()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(model_id: str, temperature: float, stop: Optional[List[str]], input_: LLMInput) -> str:
+        """The content-address of a request: a hash of the model, its parameters and the normalized messages"""
+        if isinstance(input_, str):
+            messages = [("human", normalize_content(input_))]
+        else:
+            messages = [(message.type, normalize_content(message.content)) for message in input_]
+        request = json.dumps([model_id, temperature, stop or [], messages], ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._get_from_memory(key)
+        if value is not None:
+            return value
+        # The memory tier is not locked while the disk is read
+        return self._got_from_disk(key, self.disk.get(key) if self.disk is not None else None)
+
+    async def aget(self, key: str) -> Optional[str]:
+        value = self._get_from_memory(key)
+        if value is not None:
+            return value
+        return self._got_from_disk(key, await asyncio.to_thread(self.disk.get, key) if self.disk is not None else None)
+
+    def put(self, key: str, value: str):
+        self._put_in_memory(key, value)
+        if self.disk is not None:
+            self._evicted(self.disk.put(key, value))
+
+    async def aput(self, key: str, value: str):
+        self._put_in_memory(key, value)
+        if self.disk is not None:
+            self._evicted(await asyncio.to_thread(self.disk.put, key, value))
+
+    def _get_from_memory(self, key: str) -> Optional[str]:
+        with self.lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.stats.memory_hits += 1
+            return value
+
+    def _got_from_disk(self, key: str, value: Optional[str]) -> Optional[str]:
+        with self.lock:
+            if value is not None:
+                self.stats.disk_hits += 1
+                self.stats.evictions += self.memory.put(key, value)
+            else:
+                self.stats.misses += 1
+        return value
+
+    def _put_in_memory(self, key: str, value: str):
+        with self.lock:
+            self.stats.evictions += self.memory.put(key, value)
+
+    def _evicted(self, evicted: int):
+        with self.lock:
+            self.stats.evictions += evicted
+
+
+def normalize_content(content: str) -> str:
+    return "\n".join(line.rstrip() for line in content.replace("\r\n", "\n").split("\n")).strip()
+
+
+class CachedLLM(LLM):
+    """
+    Wraps an LLM so that completions for already seen requests are taken from an LLMCache. Completions without
+    content (which OpenAI may return) are not cached.
+    """
+
+    def __init__(self, llm: LLM, cache: LLMCache, model_id: str, temperature: float):
+        self.llm = llm
+        self.cache = cache
+        self.model_id = model_id
+        self.temperature = temperature
+
+    def __call__(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
+        return self.invoke(input_, stop)
+
+    def invoke(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
+        key = LLMCache.key(self.model_id, self.temperature, stop, input_)
+        content = self.cache.get(key)
+        if content is None:
+            content = self.llm(input_, stop).content
+            if content is not None:
+                self.cache.put(key, content)
+        return LLMResponse(content)
+
+    async def ainvoke(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
+        key = LLMCache.key(self.model_id, self.temperature, stop, input_)
+        content = await self.cache.aget(key)
+        if content is None:
+            content = (await self.llm.ainvoke(input_, stop)).content
+            if content is not None:
+                await self.cache.aput(key, content)
+        return LLMResponse(content)
+
+    def stream(self, input_: LLMInput, stop: Optional[List[str]] = None) -> Iterator[str]:
+        key = LLMCache.key(self.model_id, self.temperature, stop, input_)
+        content = self.cache.get(key)
+        if content is not None:
+            yield content
+            return
+
+        chunks = []
+        for chunk in self.llm.stream(input_, stop):
+            chunks.append(chunk)
+            yield chunk
+        self.cache.put(key, "".join(chunks))
+
+    async def astream(self, input_: LLMInput, stop: Optional[List[str]] = None) -> AsyncIterator[str]:
+        key = LLMCache.key(self.model_id, self.temperature, stop, input_)
+        content = await self.cache.aget(key)
+        if content is not None:
+            yield content
+            return
+
+        chunks = []
+        async for chunk in self.llm.astream(input_, stop):
+            chunks.append(chunk)
+            yield chunk
+        await self.cache.aput(key, "".join(chunks))
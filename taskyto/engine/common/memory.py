@@ -1,148 +1,497 @@
 import abc
+import itertools
 import time
-from typing import List, Union
+import weakref
+from typing import List, Union, Optional, Tuple, Literal, Iterator
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel
 
+# Sequence numbers give a total order to the messages created in this process. Unlike timestamps, they
+# never collide, so distinct messages are never merged.
+_sequence = itertools.count()
 
-class Message(BaseModel, abc.ABC):
-    timestamp: float = Field(default_factory=lambda: time.time())
-    message: str
+
+class Message(abc.ABC):
+    """
+    A message of a conversation. Messages are plain objects with __slots__, because a conversation keeps many of
+    them; they are validated (see SerializedMessage) only when they are read from a serialized form.
+    """
+
+    __slots__ = ("message", "timestamp", "seq")
+
+    # The type tag of the messages of each class. As string literals, they are interned, so that comparisons
+    # between the tags of the messages and the memory types of a prompt are usually resolved by identity.
+    memory_type: str = None
+
+    def __init__(self, message: str, timestamp: Optional[float] = None, seq: Optional[int] = None):
+        self.message = message
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.seq = next(_sequence) if seq is None else seq
 
     @abc.abstractmethod
     def prefix(self) -> str:
         raise NotImplementedError()
 
+    def __repr__(self):
+        return f"{self.__class__.__name__}(message={self.message!r}, seq={self.seq})"
+
 
 class HumanMessage(Message):
+    __slots__ = ()
+    memory_type = "human"
 
     def prefix(self) -> str:
         return "Human: "
 
-    @property
-    def memory_type(self) -> str:
-        return "human"
-
 
 class DataMessage(Message):
-    data: dict
+    __slots__ = ("data",)
+    memory_type = "data"
+
+    def __init__(self, message: str, data: dict, timestamp: Optional[float] = None, seq: Optional[int] = None):
+        super().__init__(message, timestamp, seq)
+        self.data = data
 
     def prefix(self) -> str:
         return ""
 
-    @property
-    def memory_type(self) -> str:
-        return "data"
-
 
 class InstructionMessage(Message):
+    __slots__ = ()
+    memory_type = "instruction"
 
     def prefix(self) -> str:
         return "Instruction: "
 
-    @property
-    def memory_type(self) -> str:
-        return "instruction"
-
 
 class AIMessage(Message):
-    pass
+    __slots__ = ()
 
 
 class AIReasoningMessage(AIMessage):
+    __slots__ = ()
+    memory_type = "ai_reasoning"
 
     def prefix(self) -> str:
         return ""
 
-    @property
-    def memory_type(self) -> str:
-        return "ai_reasoning"
-
 
 class AIResponse(AIMessage):
+    __slots__ = ()
+    memory_type = "ai_response"
 
     def prefix(self) -> str:
         return "AI: "
 
-    @property
-    def memory_type(self) -> str:
-        return "ai_response"
 
+MESSAGE_TYPES = {
+    "human": HumanMessage,
+    "data": DataMessage,
+    "instruction": InstructionMessage,
+    "ai_reasoning": AIReasoningMessage,
+    "ai_response": AIResponse
+}
 
-class ConversationMemory(BaseModel):
-    """Conversation memory model."""
 
-    messages: List[Message] = []
+class SerializedMessage(BaseModel):
+    type: Literal["human", "data", "instruction", "ai_reasoning", "ai_response"]
+    message: str
+    timestamp: float
+    data: Optional[dict] = None
+
+
+def _seq_of(message: Message) -> int:
+    return message.seq
+
+
+def message_to_dict(message: Message) -> dict:
+    serialized = {"type": message.memory_type, "message": message.message, "timestamp": message.timestamp}
+    if isinstance(message, DataMessage):
+        serialized["data"] = message.data
+    return serialized
+
+
+def message_from_dict(serialized: dict) -> Message:
+    validated = SerializedMessage.model_validate(serialized)
+    if validated.type == "data":
+        return DataMessage(validated.message, validated.data or {}, timestamp=validated.timestamp)
+    return MESSAGE_TYPES[validated.type](validated.message, timestamp=validated.timestamp)
+
+
+class MessageLog:
+    """
+    The messages of a conversation, shared by its memories. Each message is stored once, and a memory is the
+    set of positions of its messages in the log (a bitmask), so that copying a memory into another one is a
+    bitwise or instead of a copy of its messages.
+    """
+
+    def __init__(self):
+        self.messages: List[Message] = []
+        # Whether the positions in the log follow the order of the messages (i.e., their sequence numbers)
+        self.ordered = True
+        self._positions = {}
+        self._type_masks = {}
+        self._memories = weakref.WeakSet()
+        # Messages removed from some memory since the last collection, which may be dead
+        self._removed = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def attach(self, memory: "ConversationMemory"):
+        self._memories.add(memory)
+
+    def removed(self, count: int):
+        """Called by the memories when they remove messages, to collect the log once they may dominate it"""
+        self._removed += count
+        if self._removed * 4 >= len(self.messages):
+            self.collect()
+
+    def collect(self) -> int:
+        """
+        Removes the messages which are no longer in any memory, if they are at least a quarter of the log, and
+        returns the number of removed messages. The positions of the messages in the memories are remapped.
+        """
+        self._removed = 0
+        live = 0
+        for memory in self._memories:
+            live |= memory._bits
+        removed = len(self.messages) - _popcount(live)
+        if removed == 0 or removed * 4 < len(self.messages):
+            return 0
+
+        old_messages = self.messages
+        # Sorting restores the order of the log, which may have been lost when messages were appended
+        kept = sorted((old_messages[i] for i in _positions_of(live)), key=_seq_of)
+        self.messages = []
+        self._positions = {}
+        self._type_masks = {}
+        self.ordered = True
+        for m in kept:
+            self.position(m)
+        for memory in self._memories:
+            memory._bits = self._remap(memory._bits, old_messages)
+        return removed
+
+    def _remap(self, bits: int, old_messages: List[Message]) -> int:
+        digits = bytearray(b"0" * len(self.messages))
+        for i in _positions_of(bits):
+            digits[self._positions[old_messages[i].seq]] = ord("1")
+        digits.reverse()
+        return int(digits, 2) if len(digits) > 0 else 0
+
+    def position(self, m: Message) -> int:
+        """The position of the message in the log, which is appended if it is not already there"""
+        pos = self._positions.get(m.seq)
+        if pos is None:
+            pos = len(self.messages)
+            if pos > 0 and m.seq < self.messages[-1].seq:
+                self.ordered = False
+            self.messages.append(m)
+            self._positions[m.seq] = pos
+            self._type_masks[m.__class__] = self._type_masks.get(m.__class__, 0) | (1 << pos)
+        return pos
+
+    def mask(self, message_classes) -> int:
+        """The positions of the messages which are instances of exactly one of the given classes"""
+        mask = 0
+        for message_class in message_classes:
+            mask |= self._type_masks.get(message_class, 0)
+        return mask
+
+    def select(self, bits: int) -> List[Message]:
+        """The messages at the positions set in bits, in order"""
+        selected = [self.messages[i] for i in _positions_of(bits)]
+        if not self.ordered:
+            selected.sort(key=_seq_of)
+        return selected
+
+
+def _popcount(bits: int) -> int:
+    # int.bit_count needs Python 3.10
+    return bin(bits).count("1")
+
+
+def _positions_of(bits: int) -> Iterator[int]:
+    digits = bin(bits)[:1:-1]
+    i = digits.find("1")
+    while i >= 0:
+        yield i
+        i = digits.find("1", i + 1)
+
+
+class ConversationMemory:
+    """
+    Conversation memory. Messages are kept in the order in which they were created (see Message.seq), and a
+    message is stored only once even if it is added several times.
+
+    The messages are stored in a MessageLog, which the memories of a conversation share (see ExecutionState),
+    and the memory only records which of them it contains. When add_memory replaces the instruction or the data,
+    the previous messages are just removed from that set. Memories created without a log get their own one.
+    """
+
+    def __init__(self, messages: Optional[List[Message]] = None, log: Optional[MessageLog] = None):
+        self._log = log if log is not None else MessageLog()
+        self._log.attach(self)
+        self._bits = 0
+        self._live_view: Optional[List[Message]] = None
+        # The messages which add_memory replaces (normally, a single one) and the merged view of the data
+        self._instructions: List[InstructionMessage] = []
+        self._data_messages: List[DataMessage] = []
+        self._data = {}
+        # The rendered text of the messages for each filter of memory types used in to_text_messages
+        self._renderings = {}
+
+        if messages is not None:
+            self._insert_all(messages)
+
+    @property
+    def log(self) -> MessageLog:
+        return self._log
+
+    @property
+    def messages(self) -> List[Message]:
+        """The messages of the memory, in order. The list must not be modified."""
+        if self._live_view is None:
+            self._live_view = self._log.select(self._bits)
+        return self._live_view
 
     def add_memory(self, memory_piece: "MemoryPiece"):
         # Append memory_piece.messages to self.messages but keep only the last one of InstructionMessage,
         # and append the rest of messages types
         for m in memory_piece.messages:
+            # m itself stays tracked if it is already in the memory, since _insert does nothing then
             if isinstance(m, InstructionMessage):
-                self.messages = [i for i in self.messages if not isinstance(i, InstructionMessage)]
-                self.messages.append(m)
+                self._remove([i for i in self._instructions if i is not m])
+                self._instructions = [i for i in self._instructions if i is m]
             elif isinstance(m, DataMessage):
-                self.messages = [i for i in self.messages if not isinstance(i, DataMessage)]
-                self.messages.append(m)
-            else:
-                self.messages.append(m)
-
-        self.__normalize_messages()
-
-    def copy_memory_from(self, other_memory: "ConversationMemory", filter=None):
-        to_be_copied = other_memory.messages
+                self._remove([d for d in self._data_messages if d is not m])
+                self._data_messages = [d for d in self._data_messages if d is m]
+                self._data = dict(m.data) if self._data_messages else {}
+            self._insert(m)
+
+    def copy_memory_from(self, other_memory: Union["ConversationMemory", "MemoryPiece"], filter=None):
+        if getattr(other_memory, "_log", None) is not self._log:
+            to_be_copied = other_memory.messages
+            if filter is not None:
+                to_be_copied = [m for m in to_be_copied if m.__class__ in filter]
+            self._insert_all(to_be_copied)
+            return
+
+        bits = other_memory._bits
         if filter is not None:
-            to_be_copied = [m for m in to_be_copied if m.__class__ in filter]
-
-        self.messages = self.messages + to_be_copied
-        self.__normalize_messages()
+            bits &= self._log.mask(filter)
+        new_bits = bits & ~self._bits
+        if new_bits == 0:
+            return
+
+        first = (new_bits & -new_bits).bit_length() - 1
+        in_order = self._log.ordered and (self._bits >> first) == 0
+        self._bits |= new_bits
+        for m in self._log.select(new_bits & self._log.mask((InstructionMessage, DataMessage))):
+            self._track(m)
+        if in_order and (self._live_view is not None or len(self._renderings) > 0):
+            for m in self._log.select(new_bits):
+                self._append_to_views(m)
+        elif not in_order:
+            self._invalidate()
+
+    def retain(self, messages: List[Message]):
+        """Removes every message of the memory except the given ones"""
+        bits = 0
+        for m in messages:
+            bits |= 1 << self._log.position(m)
+        removed = _popcount(self._bits & ~bits)
+        self._bits &= bits
+        kept = self._log.select(self._bits)
+        self._instructions = [m for m in kept if isinstance(m, InstructionMessage)]
+        self._data_messages = [m for m in kept if isinstance(m, DataMessage)]
+        self._data = {k: v for d in self._data_messages for k, v in d.data.items()}
+        self._invalidate()
+        self._log.removed(removed)
+
+    def is_empty(self) -> bool:
+        return self._bits == 0
 
     @property
     def data(self):
-        data_messages = [m for m in self.messages if isinstance(m, DataMessage)]
-        # Get the data for every message and merge in a single dict
-        return {k: v for d in [m.data for m in data_messages] for k, v in d.items()}
-
-    # TODO: This should be done as we insert messages, but for the moment the number of messages is expected
-    #  to be small so it's ok to do this at the end which is easier
-    def __normalize_messages(self):
-        self.messages = sorted(self.messages, key=lambda x: x.timestamp)
-        self.messages = [self.messages[i] for i in range(len(self.messages)) if
-                         i == 0 or self.messages[i].timestamp != self.messages[i - 1].timestamp]
+        # The data of every message in the memory merged in a single dict
+        return dict(self._data)
+
+    def _insert(self, m: Message):
+        pos = self._log.position(m)
+        bit = 1 << pos
+        if self._bits & bit:
+            return
+
+        in_order = self._log.ordered and (self._bits >> pos) == 0
+        self._bits |= bit
+        self._track(m)
+        if in_order:
+            self._append_to_views(m)
+        else:
+            self._invalidate()
+
+    def _insert_all(self, messages: List[Message]):
+        for m in messages:
+            self._insert(m)
+
+    def _track(self, m: Message):
+        if isinstance(m, InstructionMessage):
+            self._instructions.append(m)
+        elif isinstance(m, DataMessage):
+            self._data_messages.append(m)
+            if len(self._data_messages) > 1 and m.seq < self._data_messages[-2].seq:
+                self._data_messages.sort(key=_seq_of)
+                self._data = {k: v for d in self._data_messages for k, v in d.data.items()}
+            else:
+                self._data.update(m.data)
+
+    def _remove(self, messages: List[Message]):
+        for m in messages:
+            self._bits &= ~(1 << self._log.position(m))
+            if self._live_view is not None:
+                _remove_by_seq(self._live_view, m)
+            for rendering in self._renderings.values():
+                rendering.remove(m)
+        if len(messages) > 0:
+            self._log.removed(len(messages))
+
+    def _append_to_views(self, m: Message):
+        if self._live_view is not None:
+            self._live_view.append(m)
+        for rendering in self._renderings.values():
+            rendering.append(m)
+
+    def _invalidate(self):
+        self._live_view = None
+        self._renderings.clear()
 
     def add_data_message(self, message: str, data: dict):
-        self.messages.append(DataMessage(message=message, data=data))
+        self._insert(DataMessage(message, data))
         return self
 
     def add_instruction_message(self, message: str):
-        self.messages.append(InstructionMessage(message=message))
+        self._insert(InstructionMessage(message))
         return self
 
     def add_human_message(self, message: str):
-        self.messages.append(HumanMessage(message=message))
+        self._insert(HumanMessage(message))
         return self
 
     def add_ai_reasoning_message(self, message: str):
-        self.messages.append(AIReasoningMessage(message=message))
+        self._insert(AIReasoningMessage(message))
         return self
 
     def add_ai_response(self, message: str):
-        self.messages.append(AIResponse(message=message))
+        self._insert(AIResponse(message))
         return self
 
+    def to_list(self) -> list:
+        return [message_to_dict(m) for m in self.messages]
+
+    @classmethod
+    def from_list(cls, serialized: list):
+        return cls(messages=[message_from_dict(m) for m in serialized])
+
     def to_text_messages(self, memory_types: Union[List[str], str] = 'default') -> str:
-        text = ""
-        last_type = None
-        for m in self.messages:
-            if isinstance(memory_types, list) and m.memory_type not in memory_types:
-                continue
+        return self._rendering(memory_types).text()
+
+    def to_text_lines(self, memory_types: Union[List[str], str] = 'default') -> Tuple[List[Message], List[str]]:
+        """The messages with the given memory types and the line of text of each one. The lists must not be modified."""
+        rendering = self._rendering(memory_types)
+        return rendering.messages, rendering.lines
+
+    def _rendering(self, memory_types: Union[List[str], str]) -> "_Rendering":
+        key = tuple(memory_types) if isinstance(memory_types, list) else None
+        rendering = self._renderings.get(key)
+        if rendering is None:
+            rendering = _Rendering(key)
+            for m in self.messages:
+                rendering.append(m)
+            self._renderings[key] = rendering
+        return rendering
+
+
+class _Rendering:
+    """
+    The text of the messages of a memory which have one of the given memory types (or all, if None).
+    It is kept up to date as messages are appended or removed, so that only the changes are rendered.
+    """
+
+    def __init__(self, memory_types: Optional[tuple]):
+        self.memory_types = memory_types
+        self.messages = []
+        self.lines = []
+        # The text of the first _rendered lines, which is extended with the appended lines when it is requested
+        self._text = ""
+        self._rendered = 0
+
+    def append(self, m: Message):
+        if self.memory_types is None or m.memory_type in self.memory_types:
+            self.messages.append(m)
+            self.lines.append(m.prefix() + m.message + "\n")
+
+    def remove(self, m: Message):
+        index = _remove_by_seq(self.messages, m)
+        if index is not None:
+            del self.lines[index]
+            self._text = ""
+            self._rendered = 0
+
+    def text(self) -> str:
+        if self._rendered < len(self.lines):
+            self._text += "".join(self.lines[self._rendered:])
+            self._rendered = len(self.lines)
+        return self._text
+
+
+def _remove_by_seq(messages: List[Message], m: Message) -> Optional[int]:
+    # The key argument of bisect needs Python 3.10
+    index, high = 0, len(messages)
+    while index < high:
+        middle = (index + high) // 2
+        if messages[middle].seq < m.seq:
+            index = middle + 1
+        else:
+            high = middle
+    if index < len(messages) and messages[index].seq == m.seq:
+        del messages[index]
+        return index
+    return None
+
+
+class MemoryPiece:
+    """The messages produced by a step of the conversation, to be added to a memory with add_memory"""
+
+    __slots__ = ("messages",)
+
+    def __init__(self, messages: Optional[List[Message]] = None):
+        self.messages: List[Message] = list(messages) if messages is not None else []
 
-            if m.memory_type != last_type:
-                last_type = m.memory_type
+    def add_data_message(self, message: str, data: dict):
+        self.messages.append(DataMessage(message, data))
+        return self
 
-            text += m.prefix() + m.message + "\n"
-        return text
+    def add_instruction_message(self, message: str):
+        self.messages.append(InstructionMessage(message))
+        return self
+
+    def add_human_message(self, message: str):
+        self.messages.append(HumanMessage(message))
+        return self
+
+    def add_ai_reasoning_message(self, message: str):
+        self.messages.append(AIReasoningMessage(message))
+        return self
+
+    def add_ai_response(self, message: str):
+        self.messages.append(AIResponse(message))
+        return self
 
+    def to_list(self) -> list:
+        return [message_to_dict(m) for m in self.messages]
 
-class MemoryPiece(ConversationMemory):
-    pass
+    @classmethod
+    def from_list(cls, serialized: list):
+        return cls([message_from_dict(m) for m in serialized])
@@ -0,0 +1,127 @@
+import functools
+import threading
+from typing import List, Optional, Union
+
+from taskyto.engine.common.memory import ConversationMemory, Message, DataMessage, AIResponse
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception:
+                    # tiktoken is optional, and it needs to download the encoding the first time
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+
+@functools.lru_cache(maxsize=65536)
+def count_tokens(text: str) -> int:
+    """Counts the tokens of a text with tiktoken if it is available, or estimates them (4 characters per token)."""
+    return count_tokens_uncached(text)
+
+
+def count_tokens_uncached(text: str) -> int:
+    """As count_tokens, for texts which are not expected to be counted again (e.g., whole prompts)"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+class MemoryPolicyStats:
+    def __init__(self):
+        self.renders = 0
+        self.full_tokens = 0
+        self.sent_tokens = 0
+        self._lock = threading.Lock()
+
+    @property
+    def saved_tokens(self):
+        return self.full_tokens - self.sent_tokens
+
+    def record(self, full_tokens: int, sent_tokens: int):
+        with self._lock:
+            self.renders += 1
+            self.full_tokens += full_tokens
+            self.sent_tokens += sent_tokens
+
+    def __repr__(self):
+        return (f"MemoryPolicyStats(renders={self.renders}, full_tokens={self.full_tokens}, "
+                f"sent_tokens={self.sent_tokens}, saved_tokens={self.saved_tokens})")
+
+
+ON_EXIT_KEEP = "keep"
+ON_EXIT_DATA = "data"
+ON_EXIT_SUMMARY = "summary"
+
+
+class MemoryPolicy:
+    """
+    Limits the part of a memory which is rendered in a prompt. Pinned messages (by default, the data and the
+    instruction) are always kept. The rest of the messages form a rolling history, limited to the last_turns
+    (a turn starts with a human message) and to the messages which fit in max_tokens, counting the pinned ones.
+
+    on_exit is what remains of the memories of a module once it finishes its task: everything (keep), only the
+    collected data (data) or the collected data and the last response of the module (summary).
+    """
+
+    def __init__(self, last_turns: Optional[int] = None, max_tokens: Optional[int] = None,
+                 pinned: List[str] = ("data", "instruction"), on_exit: str = ON_EXIT_KEEP):
+        if on_exit not in (ON_EXIT_KEEP, ON_EXIT_DATA, ON_EXIT_SUMMARY):
+            raise ValueError(f"Unknown on_exit compaction: {on_exit}")
+        self.last_turns = last_turns
+        self.max_tokens = max_tokens
+        self.pinned = set(pinned)
+        self.on_exit = on_exit
+        self.stats = MemoryPolicyStats()
+
+    def render(self, memory: ConversationMemory, memory_types: Union[List[str], str] = 'default') -> str:
+        messages, lines = memory.to_text_lines(memory_types)
+        tokens = [count_tokens(line) for line in lines]
+        kept = self.select(messages, tokens)
+
+        self.stats.record(sum(tokens), sum(tokens[i] for i in kept))
+        return "".join(lines[i] for i in kept)
+
+    def select(self, messages: List[Message], tokens: List[int]) -> List[int]:
+        """The positions of the messages to be kept, in order"""
+        pinned = [i for i, m in enumerate(messages) if m.memory_type in self.pinned]
+        rolling = [i for i, m in enumerate(messages) if m.memory_type not in self.pinned]
+
+        if self.last_turns is not None:
+            starts = [j for j, i in enumerate(rolling) if messages[i].memory_type == "human"]
+            if len(starts) > self.last_turns:
+                rolling = rolling[starts[-self.last_turns]:] if self.last_turns > 0 else []
+
+        if self.max_tokens is not None:
+            budget = self.max_tokens - sum(tokens[i] for i in pinned)
+            first = len(rolling)
+            while first > 0 and tokens[rolling[first - 1]] <= budget:
+                first -= 1
+                budget -= tokens[rolling[first]]
+            rolling = rolling[first:]
+
+        return sorted(pinned + rolling)
+
+
+def compact(memory: ConversationMemory, on_exit: str):
+    """Removes from the memory what the on_exit compaction does not keep"""
+    if on_exit == ON_EXIT_KEEP:
+        return
+    messages = memory.messages
+    kept = [m for m in messages if isinstance(m, DataMessage)]
+    if on_exit == ON_EXIT_SUMMARY:
+        last_response = next((m for m in reversed(messages) if isinstance(m, AIResponse)), None)
+        if last_response is not None:
+            kept.append(last_response)
+    memory.retain(kept)
@@ -0,0 +1,270 @@
+import abc
+import contextvars
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from typing import Optional, List, Iterator, AsyncIterator
+
+from taskyto.engine.common.llm import LLM, LLMInput, LLMResponse, ainvoke, stream, astream
+from taskyto.engine.common.memory_policy import count_tokens_uncached
+
+_current_span = contextvars.ContextVar("taskyto_current_span", default=None)
+_span_ids = itertools.count(1)
+
+
+class Span:
+    """
+    A timed operation of the engine: a turn, a transition, an action, the run of a module, a formatter or an
+    LLM call. Spans nest: the parent is the span which was open in the same thread or task when it started,
+    and the trace is the id of the root span (usually, the turn).
+    """
+
+    __slots__ = ("name", "span_id", "parent_id", "trace_id", "start", "duration", "attributes", "_started")
+
+    recording = True
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: dict):
+        self.name = name
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.trace_id = parent.trace_id if parent is not None else self.span_id
+        self.start = time.time()
+        self.duration = None
+        self.attributes = attributes
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "id": self.span_id, "parent": self.parent_id, "trace": self.trace_id,
+                "start": self.start, "duration": self.duration, "attributes": self.attributes}
+
+    def __repr__(self):
+        return f"Span({self.name}, id={self.span_id}, parent={self.parent_id}, attributes={self.attributes})"
+
+
+class SpanSink(abc.ABC):
+    """Receives the spans of a tracer as they finish. Sinks may be shared by several threads."""
+
+    names = None
+    """The names of the spans which the sink receives, or None for all of them"""
+
+    @abc.abstractmethod
+    def emit(self, span: Span):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class InMemorySpanSink(SpanSink):
+    """Collects the finished spans, keeping only the last max_spans if given."""
+
+    def __init__(self, max_spans: Optional[int] = None):
+        self.spans = deque(maxlen=max_spans)
+
+    def emit(self, span: Span):
+        self.spans.append(span)
+
+    def named(self, name: str) -> List[Span]:
+        return [span for span in self.spans if span.name == name]
+
+    def children(self, span: Span) -> List[Span]:
+        return [child for child in self.spans if child.parent_id == span.span_id]
+
+    def clear(self):
+        self.spans.clear()
+
+
+class JsonlSpanSink(SpanSink):
+    """Writes each finished span to a file as a JSON object per line (see Span.to_dict)."""
+
+    def __init__(self, file: str):
+        self.file = file
+        # Line buffered, so that the spans are written as they finish and not lost if the process is killed
+        self._stream = open(file, "a", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def emit(self, span: Span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self._stream.write(line)
+
+    def flush(self):
+        with self._lock:
+            self._stream.flush()
+
+    def close(self):
+        with self._lock:
+            self._stream.close()
+
+
+class _SpanScope:
+    __slots__ = ("tracer", "name", "attributes", "span", "token")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self) -> Span:
+        self.span = Span(self.name, _current_span.get(), self.attributes)
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        span = self.span
+        span.duration = time.perf_counter() - span._started
+        _current_span.reset(self.token)
+        if exc_type is not None:
+            span.attributes["error"] = exc_type.__name__
+        span.attributes = {key: _attribute_value(value) for key, value in span.attributes.items()}
+        for sink in self.tracer.sinks:
+            if sink.names is None or span.name in sink.names:
+                sink.emit(span)
+        return False
+
+
+def _attribute_value(value):
+    # Attributes may be given as engine objects (e.g., states), which are only converted if the span is recorded
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+class Tracer:
+    """Opens spans and sends them to the sinks when they finish: with tracer.span("turn", module=...) as span"""
+
+    enabled = True
+
+    def __init__(self, *sinks: SpanSink):
+        self.sinks = []
+        self._names = set()
+        for sink in sinks:
+            self.add_sink(sink)
+
+    def add_sink(self, sink: SpanSink):
+        self.sinks = self.sinks + [sink]
+        if sink.names is None or self._names is None:
+            self._names = None
+        else:
+            self._names = self._names | set(sink.names)
+
+    def remove_sink(self, sink: SpanSink):
+        self.sinks = [other for other in self.sinks if other is not sink]
+        if any(other.names is None for other in self.sinks):
+            self._names = None
+        else:
+            self._names = {name for other in self.sinks for name in other.names}
+
+    def span(self, name: str, **attributes):
+        # Spans which no sink receives are not recorded, so the spans of a sink are nested in the closest
+        # recorded ones
+        if self._names is not None and name not in self._names:
+            return _NULL_SPAN
+        return _SpanScope(self, name, attributes)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    recording = False
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class NullTracer(Tracer):
+    """A tracer which records nothing. Its span is a shared object which does nothing."""
+
+    enabled = False
+
+    def __init__(self):
+        super().__init__()
+
+    def span(self, name: str, **attributes) -> _NullSpan:
+        return _NULL_SPAN
+
+    def close(self):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+NULL_TRACER = NullTracer()
+
+
+def _input_tokens(input_: LLMInput) -> int:
+    if isinstance(input_, str):
+        return count_tokens_uncached(input_)
+    return sum(count_tokens_uncached(message.content) for message in input_)
+
+
+class TracedLLM(LLM):
+    """
+    Wraps an LLM (or a plain callable) so that each call is an "llm" span, with the module on whose behalf
+    it is made, the model and the tokens of the prompt and the completion.
+    """
+
+    def __init__(self, llm, tracer: Tracer, module_name: Optional[str] = None, model_id: Optional[str] = None):
+        self.llm = llm
+        self.tracer = tracer
+        self.module_name = module_name
+        self.model_id = model_id
+
+    def _span(self, input_: LLMInput, streaming: bool):
+        scope = self.tracer.span("llm", module=self.module_name, model=self.model_id, streaming=streaming)
+        # The prompt is only tokenized if a sink receives the span
+        if isinstance(scope, _SpanScope):
+            scope.attributes["prompt_tokens"] = _input_tokens(input_)
+        return scope
+
+    def __call__(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
+        return self.invoke(input_, stop)
+
+    def invoke(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
+        with self._span(input_, False) as span:
+            response = self.llm(input_, stop=stop)
+            if span.recording:
+                span.set(completion_tokens=count_tokens_uncached(response.content))
+        return response
+
+    async def ainvoke(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
+        with self._span(input_, False) as span:
+            response = await ainvoke(self.llm, input_, stop)
+            if span.recording:
+                span.set(completion_tokens=count_tokens_uncached(response.content))
+        return response
+
+    def stream(self, input_: LLMInput, stop: Optional[List[str]] = None) -> Iterator[str]:
+        with self._span(input_, True) as span:
+            chunks = []
+            for chunk in stream(self.llm, input_, stop):
+                if span.recording:
+                    chunks.append(chunk)
+                yield chunk
+            if span.recording:
+                span.set(completion_tokens=count_tokens_uncached("".join(chunks)))
+
+    async def astream(self, input_: LLMInput, stop: Optional[List[str]] = None) -> AsyncIterator[str]:
+        with self._span(input_, True) as span:
+            chunks = []
+            async for chunk in astream(self.llm, input_, stop):
+                if span.recording:
+                    chunks.append(chunk)
+                yield chunk
+            if span.recording:
+                span.set(completion_tokens=count_tokens_uncached("".join(chunks)))
+
@@ -0,0 +1,131 @@
+import ast
+import functools
+import re
+from typing import List, Tuple
+
+_LITERAL = 0
+_VARIABLE = 1
+_FIELD = 2
+
+_DOUBLE_BRACED = re.compile(r"\{\{([^{}]*)\}\}")
+
+
+class ResponseTemplate:
+    """
+    A response text parsed into segments, so that it can be rendered with different data without parsing it again.
+
+    The syntax is the one of the responses of the chatbot modules:
+      * {{var}} and {var} are replaced by the value of var in the data. A {{var}} which is not in the data is
+        rendered as {var}.
+      * Otherwise, {expression} is a Python f-string field (e.g., {price:.2f} or {len(items)}), evaluated
+        with the data as globals.
+    Values taken from the data are inserted as they are, they are not interpreted as part of the template.
+    """
+
+    def __init__(self, text: str, segments: List[Tuple[int, str, object]]):
+        self.text = text
+        self.segments = segments
+
+    def render(self, data: dict) -> str:
+        parts = []
+        for kind, value, code in self.segments:
+            if kind == _LITERAL:
+                parts.append(value)
+            elif value in data:
+                parts.append(str(data[value]))
+            elif kind == _VARIABLE:
+                parts.append("{" + value + "}")
+            else:
+                # eval adds __builtins__ to the globals, so the data is copied
+                parts.append(eval(code, dict(data)))
+        return "".join(parts)
+
+    def __repr__(self):
+        return f"ResponseTemplate({self.text!r})"
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_template(text: str) -> ResponseTemplate:
+    """Parses a response text. Raises SyntaxError if some field is not a valid Python expression."""
+    segments = []
+    for i, line in enumerate(text.split("\n")):
+        if i > 0:
+            segments.append((_LITERAL, "\n", None))
+        _parse_line(line, segments)
+    return ResponseTemplate(text, _merge_literals(segments))
+
+
+def _parse_line(line: str, segments: list):
+    literal = []
+
+    def flush():
+        if literal:
+            segments.append((_LITERAL, _unescape("".join(literal)), None))
+            literal.clear()
+
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if c == "{":
+            match = _DOUBLE_BRACED.match(line, i)
+            if match:
+                flush()
+                segments.append((_VARIABLE, match.group(1), None))
+                i = match.end()
+            elif line.startswith("{{", i):
+                literal.append("{")
+                i += 2
+            else:
+                end = _find_field_end(line, i)
+                flush()
+                field = line[i + 1:end]
+                segments.append((_FIELD, field, compile('f"{' + field + '}"', "<response>", "eval")))
+                i = end + 1
+        elif c == "}":
+            if not line.startswith("}}", i):
+                raise SyntaxError(f"f-string: single '}}' is not allowed: {line}")
+            literal.append("}")
+            i += 2
+        else:
+            literal.append(c)
+            i += 1
+    flush()
+
+
+def _find_field_end(line: str, start: int) -> int:
+    depth = 0
+    quote = None
+    for j in range(start, len(line)):
+        c = line[j]
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in "'\"":
+            quote = c
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return j
+    raise SyntaxError(f"f-string: expecting '}}': {line}")
+
+
+def _unescape(literal: str) -> str:
+    # Backslash escapes are interpreted, as in the literal parts of an f-string
+    if "\\" not in literal:
+        return literal
+    try:
+        return ast.literal_eval('"' + literal + '"')
+    except (SyntaxError, ValueError):
+        return literal
+
+
+def _merge_literals(segments: list) -> list:
+    merged = []
+    for segment in segments:
+        if merged and segment[0] == _LITERAL and merged[-1][0] == _LITERAL:
+            merged[-1] = (_LITERAL, merged[-1][1] + segment[1], None)
+        else:
+            merged.append(segment)
+    return merged
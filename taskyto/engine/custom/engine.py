@@ -5,18 +5,25 @@ from typing import Optional, List
 from taskyto import spec
 from taskyto import utils
 from taskyto.engine.common import Configuration, compute_init_module, Engine
+from taskyto.engine.common.template import compile_template
 from taskyto.engine.common.memory import HumanMessage, AIResponse, DataMessage, MemoryPiece
+from taskyto.engine.common.memory_policy import ON_EXIT_KEEP
 from taskyto.engine.custom.events import ActivateModuleEventType, UserInput, UserInputEventType, ActivateModuleEvent, \
     TaskInProgressEventType, TaskInProgressEvent, AIResponseEventType, TaskFinishEventEventType, TaskFinishEvent, \
     AIResponseEvent, Event
 from taskyto.engine.custom.generator import ModuleGenerator
 from taskyto.engine.custom.runtime import RuntimeChatbotModule, ExecutionState
+from taskyto.engine.custom.snapshot import snapshot_execution_state, restore_execution_state
 from taskyto.engine.custom.statemachine import StateMachine, State, CompositeState, Initial, Action
 from taskyto.engine.custom.tasks import SequenceChatbotModule
-from taskyto.recording import RecordedInteraction
 from taskyto.spec import Visitor, ChatbotModel
 
 
+def module_name(vertex) -> Optional[str]:
+    """The name of the module of a state of the state machine, or None for other vertices (e.g., the initial one)"""
+    return vertex.state_id() if isinstance(vertex, State) else None
+
+
 class RunModuleAction(Action):
 
     def __init__(self, runtime_module: RuntimeChatbotModule, prompts_disabled: list[str] = []):
@@ -31,6 +38,14 @@ class RunModuleAction(Action):
         self.runtime_module.run(execution_state, event.message, prompts_disabled=self.prompts_disabled)
         execution_state.channel.stop_thinking()
 
+    async def aexecute(self, execution_state, event):
+        if not isinstance(event, UserInput):
+            raise ValueError(f"Expected UserInput, but got {event}. No other event type is supported now.")
+
+        execution_state.channel.thinking("Thinking...")
+        await self.runtime_module.arun(execution_state, event.message, prompts_disabled=self.prompts_disabled)
+        execution_state.channel.stop_thinking()
+
     def __str__(self):
         disabled = " , -" + ",".join(self.prompts_disabled) if len(self.prompts_disabled) > 0 else ""
         return f"RunModuleOnInput({self.runtime_module.module.name}{disabled})"
@@ -50,6 +65,11 @@ class ApplyLLM(Action):
         self.tool.run(execution_state, None, allow_tools=self.allow_tools, prompts_disabled=self.prompts_disabled)
         execution_state.channel.stop_thinking()
 
+    async def aexecute(self, execution_state, event):
+        execution_state.channel.thinking("Thinking...")
+        await self.tool.arun(execution_state, None, allow_tools=self.allow_tools, prompts_disabled=self.prompts_disabled)
+        execution_state.channel.stop_thinking()
+
     def __str__(self):
         use_tools = "with tools" if self.allow_tools else "without tools"
         disabled = " , -" + ",".join(self.prompts_disabled) if len(self.prompts_disabled) > 0 else ""
@@ -65,18 +85,30 @@ class SayAction(Action):
         self.message = message
         self.consume_event = consume_event
 
+    def message_for(self, event):
+        # The action is shared by all the conversations, so the consumed message is not stored in the action
+        if self.consume_event:
+            return event.message
+        return self.message
+
     def execute(self, execution_state, event):
         who = execution_state.current.state_id()
-        if self.consume_event:
-            self.message = event.message
+        message = self.message_for(event)
 
         # An activating message may decide to skip a SayAction by setting its message to None
-        if self.message is None:
+        if message is None:
             return
 
-        execution_state.channel.output(self.message, who=who)
+        execution_state.channel.output(message, who=who)
         # return ChatbotResult(self.message, DebugInfo(current_module=execution_state.current.name()))
 
+    async def aexecute(self, execution_state, event):
+        message = self.message_for(event)
+        if message is None:
+            return
+
+        await execution_state.channel.aoutput(message, who=execution_state.current.state_id())
+
     def to_dict(self):
         return {"message": self.message, "consume_event": self.consume_event}
 
@@ -89,6 +121,10 @@ class RunTool(Action):
         # assert isinstance(event, ActivateModuleEvent)
         self.tool.run_as_tool(execution_state, input, activating_event=event)
 
+    async def aexecute(self, execution_state, event):
+        input = event.input if isinstance(event, ActivateModuleEvent) else None
+        await self.tool.arun_as_tool(execution_state, input, activating_event=event)
+
     def __str__(self):
         return f"RunTool({self.tool.module.name})"
 
@@ -100,9 +136,18 @@ class CompositeAction(Action):
         self.actions = actions
 
     def execute(self, execution_state, event):
+        tracer = execution_state.tracer
         for a in self.actions:
-            a.execute(execution_state, event)
-            execution_state.notify_action_listeners(a)
+            with tracer.span("action", action=type(a).__name__):
+                a.execute(execution_state, event)
+            execution_state.notify_action_listeners(a, event)
+
+    async def aexecute(self, execution_state, event):
+        tracer = execution_state.tracer
+        for a in self.actions:
+            with tracer.span("action", action=type(a).__name__):
+                await a.aexecute(execution_state, event)
+            execution_state.notify_action_listeners(a, event)
 
     def add_if(self, condition, action):
         if condition:
@@ -149,6 +194,22 @@ class UpdateMemory(Action):
         return {"module": self.module.name, "copy_from": self.copy_from.name if self.copy_from is not None else None}
 
 
+class CompactMemory(Action):
+
+    def __init__(self, module: spec.Module, on_exit: str):
+        self.module = module
+        self.on_exit = on_exit
+
+    def execute(self, execution_state, event):
+        execution_state.compact_memory(self.module, self.on_exit)
+
+    def __str__(self):
+        return f"CompactMemory({self.module.name}, {self.on_exit})"
+
+    def to_dict(self):
+        return {"module": self.module.name, "on_exit": self.on_exit}
+
+
 class PushEvent(Action):
     def __init__(self, event: Event):
         self.event = event
@@ -176,6 +237,13 @@ class StateMachineTransformer(Visitor):
         # Configured in the specific visitor
         self.allow_go_back_to = []
 
+    def exit_actions(self, module: spec.Module) -> List[Action]:
+        """The actions which compact the memories of the module once it finishes, if configured"""
+        policy = self.configuration.get_memory_policy(module.name)
+        if policy is None or policy.on_exit == ON_EXIT_KEEP:
+            return []
+        return [CompactMemory(module, policy.on_exit)]
+
     def new_state(self, sm, module: spec.Module) -> State:
         runtime_module = self.module_generator.generate(module, allow_go_back_to=self.allow_go_back_to)
         state = State(module, runtime_module)
@@ -235,7 +303,7 @@ class StateMachineTransformer(Visitor):
                                        CompositeAction([RunTool(state.runtime_module), UpdateMemory(state.module)]))
 
                 self.sm.add_transition(state, current_state, TaskFinishEventEventType,
-                                       CompositeAction([]).
+                                       CompositeAction(self.exit_actions(state.module)).
                                             add_if((is_top_level_module and not is_item_menu_module) or
                                                    (not is_top_level_module and not is_item_menu_module), SayAction(None, consume_event=True)).
                                             add_if(not is_top_level_module, PushEvent(TaskFinishEvent(None))))
@@ -248,7 +316,8 @@ class StateMachineTransformer(Visitor):
 
                 self.sm.add_transition(state, current_state, TaskFinishEventEventType,
                                        CompositeAction([UpdateMemory(current_state.module),
-                                                        ApplyLLM(current_state.runtime_module, allow_tools=False)]).
+                                                        ApplyLLM(current_state.runtime_module, allow_tools=False),
+                                                        *self.exit_actions(state.module)]).
                                                     add_if(not is_top_level_module, PushEvent(TaskFinishEvent(None))))
             else:
                 raise ValueError(f"Unsupported response type: {response}")
@@ -272,7 +341,8 @@ class StateMachineTransformer(Visitor):
 
             self.sm.add_transition(state, current_state, TaskFinishEventEventType,
                                    CompositeAction([UpdateMemory(current_state.module),
-                                                    ApplyLLM(current_state.runtime_module, allow_tools=False)]))
+                                                    ApplyLLM(current_state.runtime_module, allow_tools=False),
+                                                    *self.exit_actions(state.module)]))
         return current_state
 
 
@@ -368,16 +438,21 @@ class StateMachineTransformer(Visitor):
                                                  CompositeAction([RunTool(previous_state.runtime_module),
                                                                   UpdateMemory(previous_state.module)]))
                         # Not sure if memory should be updated here
-
+                else:
+                    # The previous module cannot be re-entered, and its memory has already been copied
+                    actions.extend(self.exit_actions(last.module))
 
             composite.add_transition(last, state, event_type, CompositeAction(actions))
 
             last = state
             last_module = resolved_module
 
-        # Or use a final state
+        # Or use a final state. The modules which could be re-entered with go back are compacted now.
+        exit_actions = [a for s in (previous_states if seq_module.goback else [last])
+                        for a in self.exit_actions(s.module)]
         composite.add_transition(last, composite, TaskFinishEventEventType,
-                                 CompositeAction([SayAction(message=None, consume_event=True), RunTool(runtime_module)]))
+                                 CompositeAction([SayAction(message=None, consume_event=True), RunTool(runtime_module),
+                                                  *exit_actions]))
 
         self.sm = self.sm_stack.pop()
 
@@ -389,20 +464,95 @@ def compute_statemachine(chatbot_model: spec.ChatbotModel, configuration: Config
     return chatbot_model.accept(transformer)
 
 
-class CustomPromptEngine(Visitor, Engine):
+class ChatbotProgram:
+    """
+    The compiled form of a chatbot specification: the state machine, with its runtime modules and their prompts.
+    Nothing in a program depends on a conversation, so it is built once per specification and shared by all
+    the engines, which only allocate an ExecutionState for each conversation.
+    """
 
     def __init__(self, chatbot_model: ChatbotModel, configuration: Configuration):
+        self._chatbot_model = chatbot_model
+        self._configuration = configuration
+        self._statemachine = compute_statemachine(chatbot_model, configuration)
+        self._statemachine.compile()
+
+        self._vertex_ids = self._statemachine.vertex_ids()
+        self._vertices_by_id = {vertex_id: v for v, vertex_id in self._vertex_ids.items()}
+        self._runtime_modules = {}
+        for v in self._vertex_ids:
+            if isinstance(v, State):
+                self._register_runtime_module(v.runtime_module)
+
+        self._compile_response_templates()
+
+        if utils.DEBUG:
+            self._statemachine.to_visualization()
+
+    def _register_runtime_module(self, runtime_module: RuntimeChatbotModule):
+        if runtime_module.name() in self._runtime_modules:
+            return
+        self._runtime_modules[runtime_module.name()] = runtime_module
+        for tool in runtime_module.tools:
+            self._register_runtime_module(tool)
+
+    def _compile_response_templates(self):
+        for module in self._chatbot_model.modules:
+            action = getattr(module, 'on_success', None)
+            if isinstance(action, spec.Action):
+                try:
+                    compile_template(action.get_response_element().text)
+                except SyntaxError:
+                    # The error is reported when the response is rendered
+                    pass
+
+    @property
+    def chatbot_model(self) -> ChatbotModel:
+        return self._chatbot_model
+
+    @property
+    def configuration(self) -> Configuration:
+        return self._configuration
+
+    @property
+    def statemachine(self) -> StateMachine:
+        return self._statemachine
+
+    def new_execution_state(self, channel) -> ExecutionState:
+        return ExecutionState(self._statemachine.initial_state(), channel, tracer=self._configuration.get_tracer())
+
+    def vertex_id(self, vertex) -> str:
+        return self._vertex_ids[vertex]
+
+    def vertex_by_id(self, vertex_id: str):
+        try:
+            return self._vertices_by_id[vertex_id]
+        except KeyError:
+            raise ValueError(f"Unknown vertex {vertex_id}. Has the chatbot specification changed?")
+
+    def runtime_module(self, name: str) -> RuntimeChatbotModule:
+        try:
+            return self._runtime_modules[name]
+        except KeyError:
+            raise ValueError(f"Unknown module {name}. Has the chatbot specification changed?")
+
+
+class CustomPromptEngine(Visitor, Engine):
+
+    def __init__(self, chatbot_model: ChatbotModel, configuration: Configuration,
+                 program: Optional[ChatbotProgram] = None):
+        if program is None:
+            program = ChatbotProgram(chatbot_model, configuration)
+
         self._chatbot_model = chatbot_model
         self.configuration = configuration  # to access the languages stored in the configuration when building prompts
-        self.statemachine = compute_statemachine(chatbot_model, configuration)
+        self.program = program
+        self.statemachine = program.statemachine
         self.state_manager = None
-        self.recorded_interaction = RecordedInteraction()
+        self.recorded_interaction = configuration.new_recording()
 
         self.execution_state = None
 
-        if utils.DEBUG:
-            self.statemachine.to_visualization()
-
     def run_all(self, channel):
         self.start(channel)
         while True:
@@ -411,52 +561,115 @@ class CustomPromptEngine(Visitor, Engine):
                 break
             self.execute_with_input(inp)
 
-    def record_output_interaction_(self, action):
-        if isinstance(action, SayAction) and action.message is not None:
-            self.recorded_interaction.append(type="chatbot", message=action.message)
+    def record_output_interaction_(self, action, event):
+        if isinstance(action, SayAction):
+            message = action.message_for(event)
+            if message is not None:
+                self.recorded_interaction.append(type="chatbot", message=message)
 
     def start(self, channel):
-        self.execution_state = ExecutionState(self.statemachine.initial_state(), channel)
-        self.execution_state.add_action_listener(self.record_output_interaction_)
+        self.set_execution_state(self.program.new_execution_state(channel))
         self.execute()
 
+    def set_execution_state(self, execution_state: ExecutionState):
+        self.execution_state = execution_state
+        self.execution_state.add_action_listener(self.record_output_interaction_)
+
+    def snapshot(self) -> dict:
+        """Returns a serializable snapshot of the conversation. See taskyto.engine.custom.snapshot."""
+        return snapshot_execution_state(self.execution_state, self.program)
+
+    def restore(self, snapshot: dict, channel):
+        """Continues the conversation from a snapshot taken with an engine of the same chatbot."""
+        self.set_execution_state(restore_execution_state(snapshot, self.program, channel))
+
+    def fork(self, channel) -> "CustomPromptEngine":
+        engine = CustomPromptEngine(self._chatbot_model, self.configuration, program=self.program)
+        engine.restore(self.snapshot(), channel)
+        return engine
+
+    async def astart(self, channel):
+        self.set_execution_state(self.program.new_execution_state(channel))
+        await self.aexecute()
+
+    def next_transition(self):
+        """Pops the next event, if any, and returns the transition that it fires or None to stop."""
+        event = None
+        if self.execution_state.more_events():
+            event = self.execution_state.pop_event()
+            transition = self.statemachine.transition_for(self.execution_state.current, event=event)
+        else:
+            # Check transitions with empty events
+            transition = self.statemachine.transition_for(self.execution_state.current, event=event)
+
+        if event is not None and self.recorded_interaction.tracing:
+            self.recorded_interaction.append_trace(event)
+
+        if transition is None:
+            if utils.DEBUG and event is not None:
+                print(f"No transition found for event: {event} in state: {self.execution_state.current}")
+            return None, event
+
+        if utils.DEBUG:
+            print(f"Executing transition: {transition} for event: {event}")
+
+        return transition, event
+
     def execute(self):
         while True:
-            event = None
-            if self.execution_state.more_events():
-                event = self.execution_state.pop_event()
-                transition = self.statemachine.transition_for(self.execution_state.current, event=event)
-            else:
-                # Check transitions with empty events
-                transition = self.statemachine.transition_for(self.execution_state.current, event=event)
-
-            if event is not None:
-                self.recorded_interaction.append_trace(event)
+            transition, event = self.next_transition()
+            if transition is None:
+                break
+            self.execute_transition(transition, event)
 
+    async def aexecute(self):
+        while True:
+            transition, event = self.next_transition()
             if transition is None:
-                if utils.DEBUG and event is not None:
-                    print(f"No transition found for event: {event} in state: {self.execution_state.current}")
                 break
+            await self.aexecute_transition(transition, event)
 
-            if utils.DEBUG:
-                print(f"Executing transition: {transition} for event: {event}")
+    def execute_with_input(self, input_: str):
+        start = time.time()
 
-            self.execute_transition(transition, event)
+        self.recorded_interaction.append(type="user", message=input_)
+        with self.execution_state.tracer.span("turn", module=module_name(self.execution_state.current)):
+            self.execution_state.push_event(UserInput(input_))
+            self.execute()
 
-    def execute_with_input(self, input_: str):
+        self.record_response_time_(time.time() - start)
+
+    async def aexecute_with_input(self, input_: str):
         start = time.time()
 
         self.recorded_interaction.append(type="user", message=input_)
-        self.execution_state.push_event(UserInput(input_))
-        self.execute()
+        with self.execution_state.tracer.span("turn", module=module_name(self.execution_state.current)):
+            self.execution_state.push_event(UserInput(input_))
+            await self.aexecute()
+
+        self.record_response_time_(time.time() - start)
 
-        end = time.time()
+    def record_response_time_(self, response_time):
         if utils.DEBUG:
-            print(f"Execution time: {end - start}")
-        self.recorded_interaction.record_response_time(end - start)
+            print(f"Execution time: {response_time}")
+        self.recorded_interaction.record_response_time(response_time)
 
     def execute_transition(self, transition, event):
-        self.execution_state.current = transition.target
-        if transition.trigger.action is not None:
-            transition.trigger.action.execute(self.execution_state, event)
-            self.execution_state.notify_action_listeners(transition.trigger.action)
+        with self.execution_state.tracer.span("transition", source=transition.source, target=transition.target,
+                                              event=type(event).__name__ if event is not None else None):
+            self.execution_state.current = transition.target
+            action = transition.trigger.action
+            if action is not None:
+                with self.execution_state.tracer.span("action", action=type(action).__name__):
+                    action.execute(self.execution_state, event)
+                self.execution_state.notify_action_listeners(action, event)
+
+    async def aexecute_transition(self, transition, event):
+        with self.execution_state.tracer.span("transition", source=transition.source, target=transition.target,
+                                              event=type(event).__name__ if event is not None else None):
+            self.execution_state.current = transition.target
+            action = transition.trigger.action
+            if action is not None:
+                with self.execution_state.tracer.span("action", action=type(action).__name__):
+                    await action.aexecute(self.execution_state, event)
+                self.execution_state.notify_action_listeners(action, event)
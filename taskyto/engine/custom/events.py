@@ -16,6 +16,10 @@ class Event(abc.ABC):
         assert value is not None
         return value
 
+    def dispatch_key(self):
+        """The (event class, discriminator) pair used to look up the transitions triggered by this event."""
+        return self.__class__, None
+
     def to_dict(self):
         return {"type": self.__class__.__name__}
 
@@ -26,6 +30,9 @@ class ActivateModuleEventType(TriggerEvent):
     def is_compatible(self, event):
         return isinstance(event, ActivateModuleEvent) and event.module.module == self.module
 
+    def dispatch_key(self):
+        return ActivateModuleEvent, self.module
+
     def __str__(self):
         return f"ActivateModule({self.module.name})"
 
@@ -39,9 +46,12 @@ class ActivateModuleEvent(Event):
     def __str__(self):
         return f"ActivateModule({self.module.name()}, {self.input})" #, {self.previous_answer})"
 
+    def dispatch_key(self):
+        return self.__class__, self.module.module
+
     def to_dict(self):
         return super().to_dict() | { "module": self.module.name(), "input": self.input,
-                                     "previous_answer": self.previous_answer.dict() }
+                                     "previous_answer": _memory_to_dict(self.previous_answer) }
 
 class AIResponseEvent(Event):
 
@@ -71,8 +81,7 @@ class TaskInProgressEvent(Event):
         self.memory = memory
 
     def to_dict(self):
-        # Traverse memory and apply the dict method to each value
-        serialized = {k: v.dict() for k, v in self.memory.items()}
+        serialized = {k: _memory_to_dict(v) for k, v in self.memory.items()}
         return super().to_dict() | { "memory": serialized }
 
 TaskInProgressEventType = TriggerEventMatchByClass(TaskInProgressEvent)
@@ -90,6 +99,13 @@ class TaskFinishEvent(Event):
         return self.message is not None
 
     def to_dict(self):
-        return super().to_dict() | { "message": self.message, "memory": self.memory }
+        serialized = {k: _memory_to_dict(v) for k, v in self.memory.items()}
+        return super().to_dict() | { "message": self.message, "memory": serialized }
 
 TaskFinishEventEventType = TriggerEventMatchByClass(TaskFinishEvent)
+
+
+def _memory_to_dict(memory) -> dict:
+    if memory is None:
+        return None
+    return {"messages": memory.to_list()}
@@ -1,30 +1,39 @@
 import abc
+import asyncio
 import re
+import string
 from typing import List, Optional, Union
 
 from langchain.agents.conversational.output_parser import ConvoOutputParser
-from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+from langchain.prompts import HumanMessagePromptTemplate
 from langchain.prompts.chat import MessageLike
-from langchain.schema import AgentAction, OutputParserException, HumanMessage, AIMessage, AgentFinish
-from pydantic import BaseModel, ConfigDict
+from langchain.schema import AgentAction, OutputParserException, HumanMessage, AIMessage, AgentFinish, SystemMessage, \
+    BaseMessage
+from pydantic import BaseModel, ConfigDict, PrivateAttr
 
 from taskyto import spec
 from taskyto import utils
 from taskyto.engine.common import Configuration, logger, replace_values, Rephraser, prompts
-from taskyto.engine.common.memory import ConversationMemory, MemoryPiece
+from taskyto.engine.common.llm import ainvoke, stream, astream, LLMResponse
+from taskyto.engine.common.memory import ConversationMemory, MemoryPiece, MessageLog
+from taskyto.engine.common.memory_policy import compact
 from taskyto.engine.common.prompts import FORMAT_INSTRUCTIONS, NO_TOOL_INSTRUCTIONS
+from taskyto.engine.common.spans import Tracer, NULL_TRACER
 from taskyto.engine.custom.events import ActivateModuleEvent, AIResponseEvent
 from taskyto.utils import get_unparsed_output
 
 
 class ExecutionState:
 
-    def __init__(self, initial, channel: "Channel"):
+    def __init__(self, initial, channel: "Channel", tracer: Tracer = NULL_TRACER):
         self.current = initial
         self.channel = channel
+        self.tracer = tracer
         self.action_listeners = []
         self.event_stack = []
         self.memory = {}
+        # The messages of all the memories of the conversation, which only keep references to them
+        self.message_log = MessageLog()
 
         # To pass data between modules
         self.data = {}
@@ -36,9 +45,9 @@ class ExecutionState:
     def add_action_listener(self, listener):
         self.action_listeners.append(listener)
 
-    def notify_action_listeners(self, action):
+    def notify_action_listeners(self, action, event):
         for listener in self.action_listeners:
-            listener(action)
+            listener(action, event)
 
     def copy_memory(self, from_module, to_module, memory_id: str, filter=None):
         original_memory = self.get_memory(from_module, memory_id)
@@ -49,6 +58,19 @@ class ExecutionState:
         memory = self.get_or_create_memory(module, memory_id)
         memory.add_memory(memory_piece)
 
+    def compact_memory(self, module, on_exit: str):
+        """Compacts the memories of a module which has finished (see MemoryPolicy.on_exit), dropping the empty ones"""
+        memories = self.memory.get(module.name)
+        if memories is None:
+            return
+        for memory_id, memory in list(memories.items()):
+            compact(memory, on_exit)
+            if memory.is_empty():
+                del memories[memory_id]
+        if len(memories) == 0:
+            del self.memory[module.name]
+        self.message_log.collect()
+
     def get_memory(self, module, memory_id):
         return self.get_or_create_memory(module, memory_id)
         # TODO: For the moment, create the memory if it doesnt' exist, but maybe we need a protocol to make sure
@@ -61,7 +83,7 @@ class ExecutionState:
         if module_id not in self.memory:
             self.memory[module_id] = {}
         if memory_id not in self.memory[module_id]:
-            self.memory[module_id][memory_id] = ConversationMemory()
+            self.memory[module_id][memory_id] = ConversationMemory(log=self.message_log)
 
         return self.memory[module_id][memory_id]
 
@@ -76,7 +98,22 @@ class ExecutionState:
 
 
 class Channel(abc.ABC):
-    pass
+
+    streaming = False
+    """Whether the channel wants to receive the chatbot responses in chunks, as they are generated"""
+
+    async def aoutput(self, msg, who=None):
+        """Asynchronous version of output. Channels which may block when writing should override it."""
+        self.output(msg, who=who)
+
+    def output_chunk(self, chunk, who=None):
+        """Receives a fragment of a response which is being generated. The complete response is always
+        delivered afterwards through output, so channels which do not stream can ignore the chunks."""
+        pass
+
+    def discard_chunks(self, who=None):
+        """The chunks received since the last output are not part of the response, which is streamed again"""
+        pass
 
 
 from halo import Halo
@@ -143,10 +180,94 @@ class ChatbotOutputParser(ConvoOutputParser):
         return action
 
 
+class ResponseStreamFilter:
+    """
+    Forwards to a channel the chunks of an LLM completion which are part of the response to the Human, that is,
+    the text after the last "{ai_prefix}:" as ChatbotOutputParser takes it. Trailing whitespace and "```" are held
+    back until the end, since the parser removes them, and so is a tail which may be the beginning of another
+    marker. If a marker appears once part of the response has been forwarded, the channel discards the chunks
+    and the response is streamed again from the new marker.
+    """
+
+    def __init__(self, channel: Channel, ai_prefix: str, who=None):
+        self.channel = channel
+        self.who = who
+        self.marker = f"{ai_prefix}:"
+        self.text = ""
+        self.response_start = None
+        self.emitted = 0
+
+    def feed(self, chunk: str):
+        # Only the end of the text and the new chunk may contain a marker which has not been seen yet
+        scan_from = max(0, len(self.text) - len(self.marker) + 1)
+        self.text += chunk
+
+        marker_index = self.text.rfind(self.marker, scan_from)
+        if marker_index >= 0:
+            if self.emitted > 0:
+                self.channel.discard_chunks(who=self.who)
+                self.emitted = 0
+            self.response_start = marker_index + len(self.marker)
+        if self.response_start is None:
+            return
+
+        response = self.text[self.response_start:].lstrip()
+        pending = min(len(response.rstrip(" \t\n`")), len(response) - self._marker_prefix(response))
+        if pending > self.emitted:
+            self.channel.output_chunk(response[self.emitted:pending], who=self.who)
+            self.emitted = pending
+
+    def _marker_prefix(self, text: str) -> int:
+        """The length of the longest end of text which is the beginning of the marker"""
+        for length in range(min(len(self.marker) - 1, len(text)), 0, -1):
+            if text.endswith(self.marker[:length]):
+                return length
+        return 0
+
+    def close(self) -> str:
+        """Flushes the held back text and returns the whole completion."""
+        if self.response_start is not None:
+            action = AgentFinish({"output": self.text[self.response_start:].strip()}, self.text)
+            response = ChatbotOutputParser.remove_trailing_stuff(action).return_values['output']
+            if len(response) > self.emitted:
+                self.channel.output_chunk(response[self.emitted:], who=self.who)
+                self.emitted = len(response)
+        return self.text
+
+
 # HUMAN_MESSAGE_TEMPLATE = "{input}\n\n{agent_scratchpad}"
 HUMAN_MESSAGE_TEMPLATE = "Begin!\n\nPrevious conversation history:\n{history}\n\n{input}\n\n{agent_scratchpad}\n"
 
 
+class PromptTemplates:
+    """
+    The system and human templates of the prompt of a module. The system message is formatted in advance
+    when it has no variables, so that only the human message is formatted on each turn.
+    """
+
+    def __init__(self, system_template: str, human_template: str, variables: List[str]):
+        self.system_template = system_template
+        self.human_template = human_template
+        self.variables = variables
+        """The variables of the human prompt, including the ones in disabled sections"""
+        self.active_variables = set(template_variables(human_template))
+
+        if len(template_variables(system_template)) == 0:
+            self.system_message = SystemMessage(content=system_template.format())
+        else:
+            self.system_message = None
+
+    def format_messages(self, substitutions: dict) -> List[BaseMessage]:
+        system_message = self.system_message
+        if system_message is None:
+            system_message = SystemMessage(content=self.system_template.format(**substitutions))
+        return [system_message, HumanMessage(content=self.human_template.format(**substitutions))]
+
+
+def template_variables(template: str) -> List[str]:
+    return [name for _, name, _, _ in string.Formatter().parse(template) if name is not None]
+
+
 class CustomRephraser(Rephraser):
     def rephrase(self, message: str, context: Optional[str] = None) -> str:
         prompt = "Please rephrase the following message:\n" + message
@@ -177,6 +298,8 @@ class RuntimeChatbotModule(BaseModel):
     ai_prefix: str = "AI"
     parser: ChatbotOutputParser = ChatbotOutputParser()
 
+    _prompt_templates: dict = PrivateAttr(default_factory=dict)
+
     def name(self):
         return self.module.name
 
@@ -216,6 +339,14 @@ class RuntimeChatbotModule(BaseModel):
         # Activating event is here just for sequence module...
         raise NotImplementedError("This module cannot be run as a tool")
 
+    async def arun_as_tool(self, state: ExecutionState, tool_input: str, activating_event=None):
+        """
+        Asynchronous version of run_as_tool. By default, run_as_tool is executed in a worker thread since it
+        may block (e.g., formatters calling the LLM or actions executing code). The conversation does not
+        advance in the meantime, so the execution state is not accessed concurrently.
+        """
+        await asyncio.to_thread(self.run_as_tool, state, tool_input, activating_event=activating_event)
+
     def find_tool_by_name(self, tool_name: str):
         for tool in self.tools:
             if tool.name() == tool_name:
@@ -248,6 +379,74 @@ class RuntimeChatbotModule(BaseModel):
             raise ValueError("No response available")
 
     def run(self, state: ExecutionState, input: str, allow_tools=True, prompts_disabled=[]):
+        with state.tracer.span("module.run", module=self.name()):
+            with state.tracer.span("prompt", module=self.name()):
+                formatted_prompt = self.build_prompt(state, input, allow_tools=allow_tools,
+                                                     prompts_disabled=prompts_disabled)
+            llm = self.configuration.new_llm(module_name=self.name())
+            if state.channel.streaming:
+                response_filter = ResponseStreamFilter(state.channel, self.ai_prefix, who=state.current.state_id())
+                for chunk in stream(llm, formatted_prompt, stop=["\nObservation:"]):
+                    response_filter.feed(chunk)
+                result = LLMResponse(response_filter.close())
+            else:
+                result = llm(formatted_prompt, stop=["\nObservation:"])
+            self.process_result(state, input, result)
+
+    async def arun(self, state: ExecutionState, input: str, allow_tools=True, prompts_disabled=[]):
+        with state.tracer.span("module.run", module=self.name()):
+            with state.tracer.span("prompt", module=self.name()):
+                formatted_prompt = self.build_prompt(state, input, allow_tools=allow_tools,
+                                                     prompts_disabled=prompts_disabled)
+            llm = self.configuration.new_llm(module_name=self.name())
+            if state.channel.streaming:
+                response_filter = ResponseStreamFilter(state.channel, self.ai_prefix, who=state.current.state_id())
+                async for chunk in astream(llm, formatted_prompt, stop=["\nObservation:"]):
+                    response_filter.feed(chunk)
+                result = LLMResponse(response_filter.close())
+            else:
+                result = await ainvoke(llm, formatted_prompt, stop=["\nObservation:"])
+            self.process_result(state, input, result)
+
+    def build_prompt(self, state: ExecutionState, input: str, allow_tools=True, prompts_disabled=[]):
+        templates = self.get_prompt_templates(allow_tools, prompts_disabled)
+
+        memory_types = self.memory_types()
+        memory_policy = self.configuration.get_memory_policy(self.name())
+        substitutions = {}
+        # The variable is the same as the memory_id... by convention
+        for memory_id in templates.variables:
+            m = state.get_memory(self.module, memory_id)
+            if memory_id in templates.active_variables:
+                memory_type = memory_types.get(memory_id) or "default"
+                if memory_policy is None:
+                    substitutions[memory_id] = m.to_text_messages(memory_type)
+                else:
+                    substitutions[memory_id] = memory_policy.render(m, memory_type)
+
+        if input is None or input.strip() == "":
+            prompt_input = ""
+        else:
+            prompt_input = "New input: " + input
+
+        substitutions['input'] = prompt_input
+        substitutions['agent_scratchpad'] = ""
+
+        formatted_prompt = templates.format_messages(substitutions)
+        # agent_scratchpad="Thought: ")
+        logger.debug_prompt(formatted_prompt)
+        return formatted_prompt
+
+    def get_prompt_templates(self, allow_tools=True, prompts_disabled=[]) -> "PromptTemplates":
+        """The static part of the prompt is built once per tool mode and set of disabled prompts"""
+        key = (allow_tools, tuple(prompts_disabled))
+        templates = self._prompt_templates.get(key)
+        if templates is None:
+            templates = self._build_prompt_templates(allow_tools, prompts_disabled)
+            self._prompt_templates[key] = templates
+        return templates
+
+    def _build_prompt_templates(self, allow_tools, prompts_disabled) -> "PromptTemplates":
         format_instructions = FORMAT_INSTRUCTIONS.format(tool_names=self.get_tool_names(), ai_prefix=self.ai_prefix)
         formatted_tools = self.get_tools_prompt()
         suffix = ""
@@ -268,46 +467,12 @@ class RuntimeChatbotModule(BaseModel):
                                   self.get_task_prompt().to_text(),
                                   suffix])
 
-        # input_variables = ["input", "history", "agent_scratchpad"]
-        input_variables = ["input", "agent_scratchpad"]
-
         # TODO: Allow passing as parameters the section of the prompt that we want to use
         human_prompt = self.get_human_prompt()
-        variables = human_prompt.variables()
-        input_variables.extend(variables)
-
-        memory_types = self.memory_types()
-        substitutions = {}
-        # The variable is the same as the memory_id... by convention
-        for memory_id in variables:
-            m = state.get_memory(self.module, memory_id)
-            memory_type = memory_types.get(memory_id) or "default"
-            substitutions[memory_id] = m.to_text_messages(memory_type)
-
-        #_memory_prompts = state.get_memory(self.module).buffer_as_messages
-        messages = [
-            SystemMessagePromptTemplate.from_template(template),
-            HumanMessagePromptTemplate.from_template(human_prompt.to_text(prompts_disabled=prompts_disabled)),
-            #HumanMessagePromptTemplate.from_template(HUMAN_MESSAGE_TEMPLATE),
-        ]
-        template = ChatPromptTemplate(input_variables=input_variables, messages=messages)
-
-        llm = self.configuration.new_llm(module_name=self.name())
-
-        if input is None or input.strip() == "":
-            prompt_input = ""
-        else:
-            prompt_input = "New input: " + input
-
-        substitutions['input'] = prompt_input
-        substitutions['agent_scratchpad'] = ""
-
-        formatted_prompt = template.format_messages(**substitutions)
-        # agent_scratchpad="Thought: ")
-        logger.debug_prompt(formatted_prompt)
-
-        result = llm(formatted_prompt, stop=["\nObservation:"])
+        human_template = human_prompt.to_text(prompts_disabled=prompts_disabled)
+        return PromptTemplates(template, human_template, human_prompt.variables())
 
+    def process_result(self, state: ExecutionState, input: str, result):
         # TODO: Handle langchain.schema.output_parser.OutputParserException smoothly
         try:
             parsed_result = self.parser.parse(result.content)
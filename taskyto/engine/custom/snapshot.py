@@ -0,0 +1,194 @@
+"""
+Snapshots of the state of a conversation (i.e., an ExecutionState).
+
+A snapshot is a plain dict which refers to the vertices and modules of the compiled chatbot by their ids, so
+that it can be serialized (see dumps and loads) and restored against the same ChatbotProgram in another
+process. Restoring the same snapshot twice forks the conversation.
+
+Messages are stored once, in a table ordered by creation, and memories refer to them by position. This keeps
+the order of the messages and the fact that several memories share a message.
+"""
+import copy
+import datetime
+import json
+
+from taskyto.engine.common.memory import MemoryPiece, ConversationMemory, message_to_dict, message_from_dict
+from taskyto.engine.custom.events import ActivateModuleEvent, AIResponseEvent, UserInput, TaskInProgressEvent, \
+    TaskFinishEvent
+from taskyto.engine.custom.runtime import ExecutionState
+
+SNAPSHOT_VERSION = 2
+
+
+class _MessageTable:
+    def __init__(self, memories):
+        messages = {m.seq: m for memory in memories if memory is not None for m in memory.messages}
+        self.messages = [messages[seq] for seq in sorted(messages)]
+        self.positions = {m.seq: i for i, m in enumerate(self.messages)}
+
+    def refs(self, memory) -> list:
+        return [self.positions[m.seq] for m in memory.messages]
+
+    def to_list(self) -> list:
+        return [message_to_dict(m) for m in self.messages]
+
+
+def _all_memories(state: ExecutionState):
+    for memories in state.memory.values():
+        yield from memories.values()
+    for event in state.event_stack:
+        if isinstance(event, (TaskInProgressEvent, TaskFinishEvent)):
+            yield from event.memory.values()
+        elif isinstance(event, ActivateModuleEvent):
+            yield event.previous_answer
+
+
+def snapshot_execution_state(state: ExecutionState, program) -> dict:
+    table = _MessageTable(_all_memories(state))
+    return {
+        "version": SNAPSHOT_VERSION,
+        "current": program.vertex_id(state.current),
+        "messages": table.to_list(),
+        "events": [_event_to_dict(e, table) for e in state.event_stack],
+        "memory": {module_id: {memory_id: table.refs(memory) for memory_id, memory in memories.items()}
+                   for module_id, memories in state.memory.items()},
+        "data": copy.deepcopy(state.data)
+    }
+
+
+def restore_execution_state(snapshot: dict, program, channel) -> ExecutionState:
+    version = snapshot.get("version")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {version}, expected {SNAPSHOT_VERSION}")
+
+    # Messages are created in order, so that they get increasing sequence numbers
+    messages = [message_from_dict(m) for m in snapshot["messages"]]
+
+    state = ExecutionState(program.vertex_by_id(snapshot["current"]), channel,
+                           tracer=program.configuration.get_tracer())
+    for m in messages:
+        state.message_log.position(m)
+    state.event_stack = [_event_from_dict(e, program, messages) for e in snapshot["events"]]
+    state.memory = {module_id: {memory_id: ConversationMemory([messages[i] for i in refs], log=state.message_log)
+                                for memory_id, refs in memories.items()}
+                    for module_id, memories in snapshot["memory"].items()}
+    state.data = copy.deepcopy(snapshot["data"])
+    return state
+
+
+def trim_snapshot(snapshot: dict, last_turns: int, pinned=("data", "instruction")) -> dict:
+    """
+    A copy of a snapshot whose memories only keep their pinned messages and their last turns (a turn starts with
+    a human message), as MemoryPolicy does when they are rendered. Messages which are no longer in any memory are
+    removed from the table.
+    """
+    messages = snapshot["messages"]
+
+    def window(refs):
+        rolling = [i for i in refs if messages[i]["type"] not in pinned]
+        starts = [j for j, i in enumerate(rolling) if messages[i]["type"] == "human"]
+        if len(starts) <= last_turns:
+            return refs
+        kept = set(rolling[starts[-last_turns]:]) if last_turns > 0 else set()
+        return [i for i in refs if i in kept or messages[i]["type"] in pinned]
+
+    used = set()
+
+    def collect(refs):
+        used.update(refs)
+        return refs
+
+    trimmed = _map_refs(_map_refs(snapshot, window), collect)
+    positions = {old: new for new, old in enumerate(sorted(used))}
+    trimmed = _map_refs(trimmed, lambda refs: [positions[i] for i in refs])
+    trimmed["messages"] = [messages[i] for i in sorted(used)]
+    return trimmed
+
+
+def _map_refs(snapshot: dict, function) -> dict:
+    """A copy of the snapshot with function applied to each list of references to messages"""
+    def map_memory(memory: dict) -> dict:
+        return {memory_id: function(refs) for memory_id, refs in memory.items()}
+
+    events = []
+    for event in snapshot["events"]:
+        if "memory" in event:
+            event = {**event, "memory": map_memory(event["memory"])}
+        elif event.get("previous_answer") is not None:
+            event = {**event, "previous_answer": function(event["previous_answer"])}
+        events.append(event)
+    return {**snapshot,
+            "events": events,
+            "memory": {module_id: map_memory(memories) for module_id, memories in snapshot["memory"].items()}}
+
+
+def dumps(snapshot: dict) -> str:
+    return json.dumps(snapshot, separators=(",", ":"), default=_encode_value)
+
+
+def loads(serialized: str) -> dict:
+    return json.loads(serialized, object_hook=_decode_value)
+
+
+def _encode_value(value):
+    # Formatters may produce dates, which JSON does not support
+    if isinstance(value, datetime.datetime):
+        return {"$datetime": value.isoformat()}
+    elif isinstance(value, datetime.date):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} cannot be stored in a snapshot")
+
+
+def _decode_value(obj: dict):
+    if len(obj) == 1:
+        if "$datetime" in obj:
+            return datetime.datetime.fromisoformat(obj["$datetime"])
+        elif "$date" in obj:
+            return datetime.date.fromisoformat(obj["$date"])
+    return obj
+
+
+def _memory_to_dict(memory: dict, table: _MessageTable) -> dict:
+    return {memory_id: table.refs(piece) for memory_id, piece in memory.items()}
+
+
+def _memory_from_dict(memory: dict, messages: list) -> dict:
+    return {memory_id: MemoryPiece([messages[i] for i in refs]) for memory_id, refs in memory.items()}
+
+
+def _event_to_dict(event, table: _MessageTable) -> dict:
+    if isinstance(event, UserInput):
+        return {"type": "UserInput", "message": event.message}
+    elif isinstance(event, AIResponseEvent):
+        return {"type": "AIResponseEvent", "message": event.message}
+    elif isinstance(event, TaskInProgressEvent):
+        return {"type": "TaskInProgressEvent", "memory": _memory_to_dict(event.memory, table)}
+    elif isinstance(event, TaskFinishEvent):
+        properties = {k: v for k, v in event.__dict__.items() if k not in ("message", "memory")}
+        return {"type": "TaskFinishEvent", "message": event.message, "memory": _memory_to_dict(event.memory, table),
+                "properties": copy.deepcopy(properties)}
+    elif isinstance(event, ActivateModuleEvent):
+        previous_answer = table.refs(event.previous_answer) if event.previous_answer is not None else None
+        return {"type": "ActivateModuleEvent", "module": event.module.name(), "input": event.input,
+                "previous_answer": previous_answer}
+    raise ValueError(f"Cannot snapshot event {event}")
+
+
+def _event_from_dict(serialized: dict, program, messages: list):
+    event_type = serialized["type"]
+    if event_type == "UserInput":
+        return UserInput(serialized["message"])
+    elif event_type == "AIResponseEvent":
+        return AIResponseEvent(serialized["message"])
+    elif event_type == "TaskInProgressEvent":
+        return TaskInProgressEvent(memory=_memory_from_dict(serialized["memory"], messages))
+    elif event_type == "TaskFinishEvent":
+        return TaskFinishEvent(serialized["message"], memory=_memory_from_dict(serialized["memory"], messages),
+                               **copy.deepcopy(serialized["properties"]))
+    elif event_type == "ActivateModuleEvent":
+        previous_answer = serialized["previous_answer"]
+        if previous_answer is not None:
+            previous_answer = MemoryPiece([messages[i] for i in previous_answer])
+        return ActivateModuleEvent(program.runtime_module(serialized["module"]), serialized["input"],
+                                   previous_answer)
+    raise ValueError(f"Unknown event type in snapshot: {event_type}")
@@ -41,6 +41,10 @@ class Action(abc.ABC):
     def execute(self, execution_state, event):
         pass
 
+    async def aexecute(self, execution_state, event):
+        """Asynchronous version of execute. Actions which do not block can rely on this default."""
+        self.execute(execution_state, event)
+
     def __str__(self):
         return f"{self.__class__.__name__}"
 
@@ -50,6 +54,13 @@ class TriggerEvent(abc.ABC):
     def is_compatible(self, event):
         pass
 
+    def dispatch_key(self):
+        """
+        Returns the (event class, discriminator) pair used to index the transitions triggered by this event.
+        Triggers which return None can only be matched with is_compatible.
+        """
+        return None
+
 
 class TriggerEventMatchByClass(TriggerEvent):
     def __init__(self, cls):
@@ -58,12 +69,18 @@ class TriggerEventMatchByClass(TriggerEvent):
     def is_compatible(self, event):
         return isinstance(event, self.cls)
 
+    def dispatch_key(self):
+        return self.cls, None
+
     def __str__(self):
         return f"{self.cls.__name__}"
 
 
 EMPTY_TRIGGER = Trigger(None, None)
 
+# Dispatch key of the transitions which are fired without an event
+EMPTY_EVENT_KEY = ("empty", None)
+
 
 class Transition:
 
@@ -75,11 +92,69 @@ class Transition:
     def __str__(self):
         return f"{self.source} -> {self.target} [{self.trigger}]"
 
+class VertexDispatch:
+    """
+    The transitions leaving a vertex, indexed by the dispatch key of their trigger event.
+
+    Each transition is stored with its position in the original transition list, so that when several
+    transitions are compatible with an event the first one wins, as in a linear scan.
+    """
+
+    def __init__(self):
+        self.by_key = {}
+        self.generic = []
+        self.resolved = {}
+
+    def add(self, position, transition):
+        trigger_event = transition.trigger.event
+        key = EMPTY_EVENT_KEY if trigger_event is None else trigger_event.dispatch_key()
+        if key is None:
+            self.generic.append((position, transition))
+        elif key not in self.by_key:
+            self.by_key[key] = (position, transition)
+
+    def entries(self):
+        return sorted(list(self.by_key.values()) + self.generic, key=lambda entry: entry[0])
+
+    def lookup(self, event):
+        key = EMPTY_EVENT_KEY if event is None else event.dispatch_key()
+        if key in self.resolved:
+            found = self.resolved[key]
+        else:
+            found = self._resolve(key)
+            self.resolved[key] = found
+
+        if self.generic and event is not None:
+            for position, t in self.generic:
+                if found is not None and position > found[0]:
+                    break
+                if t.trigger.event.is_compatible(event):
+                    return t
+
+        return found[1] if found is not None else None
+
+    def _resolve(self, key):
+        if key == EMPTY_EVENT_KEY:
+            return self.by_key.get(key)
+
+        # Triggers match events by isinstance, so the super-classes of the event are also candidates
+        event_cls, discriminator = key
+        candidates = []
+        for cls in event_cls.__mro__:
+            candidates.append(self.by_key.get((cls, discriminator)))
+            if discriminator is not None:
+                candidates.append(self.by_key.get((cls, None)))
+
+        candidates = [c for c in candidates if c is not None]
+        return min(candidates, key=lambda c: c[0]) if len(candidates) > 0 else None
+
+
 class StateMachine:
 
     def __init__(self):
         self.vertices = []
         self.transitions = []
+        self._dispatch = None
 
     def add_transition(self, src: Vertex, tgt: Vertex, event=None, action=None):
         if event is None and action is None:
@@ -88,9 +163,11 @@ class StateMachine:
             trigger = Trigger(event, action)
 
         self.transitions.append(Transition(src, tgt, trigger))
+        self._dispatch = None
 
     def add_state(self, current_state):
         self.vertices.append(current_state)
+        self._dispatch = None
 
     def initial_state(self):
         return [v for v in self.vertices if isinstance(v, Initial)][0]
@@ -103,21 +180,85 @@ class StateMachine:
         transitions.extend(self.transitions)
         return transitions
 
+    def compile(self):
+        """
+        Builds the dispatch table used by transition_for. This is done lazily on the first lookup, and the
+        table is discarded if the state machine is modified afterwards. Modifying a nested composite state
+        after its parent has been compiled requires calling compile() again on the parent.
+        """
+        dispatch = {}
+        transitions = self.get_all_transitions()
+        for position, t in enumerate(transitions):
+            if t.source not in dispatch:
+                dispatch[t.source] = VertexDispatch()
+            dispatch[t.source].add(position, t)
+
+        # A composite state first tries the transitions of its subgraph (from its initial state), otherwise
+        # it is probably an out-transition. The inner transitions are given priority with negative positions.
+        composites = {t.source for t in transitions if isinstance(t.source, CompositeState)}
+        composites.update(t.target for t in transitions if isinstance(t.target, CompositeState))
+        composites.update(v for v in self.vertices if isinstance(v, CompositeState))
+        for composite in composites:
+            inner_dispatch = dispatch if composite is self else composite.compile()
+            inner = inner_dispatch.get(composite.initial_state())
+            outer = dispatch.get(composite)
+            merged = VertexDispatch()
+            if inner is not None:
+                inner_entries = inner.entries()
+                offset = inner_entries[-1][0] + 1
+                for position, t in inner_entries:
+                    merged.add(position - offset, t)
+            if outer is not None:
+                for position, t in outer.entries():
+                    merged.add(position, t)
+            dispatch[composite] = merged
+
+        self._dispatch = dispatch
+        return dispatch
+
     def transition_for(self, current, event):
-        if isinstance(current, CompositeState):
-            # Try to find a transition in the subgraph, otherwise it is probably an out-transition
-            t = current.transition_for(current.initial_state(), event)
-            if t is not None:
-                return t
-
-        for t in self.get_all_transitions():
-            if t.source == current:
-                if event is None and t.trigger.event is None:
-                    return t
-                elif t.trigger.event.is_compatible(event):
-                    return t
+        dispatch = self._dispatch
+        if dispatch is None:
+            dispatch = self.compile()
+
+        vertex_dispatch = dispatch.get(current)
+        if vertex_dispatch is None:
+            return None
+        return vertex_dispatch.lookup(event)
+
+    def vertex_ids(self, parent: str = None) -> dict:
+        """
+        Assigns a path-like identifier to each vertex of this state machine and of its composite states
+        (e.g., "sequence-a-b/a"), which is stable as long as the specification does not change.
+        """
+        ids = {}
+        used = set()
+
+        def assign(v):
+            if v in ids:
+                return
+            vertex_id = StateMachine.to_node_id(v)
+            if parent is not None:
+                vertex_id = parent + "/" + vertex_id
+            unique_id, n = vertex_id, 1
+            while unique_id in used:
+                n += 1
+                unique_id = f"{vertex_id}#{n}"
+            used.add(unique_id)
+            ids[v] = unique_id
 
-        return None
+        for v in self.vertices:
+            assign(v)
+        for t in self.transitions:
+            assign(t.source)
+            assign(t.target)
+
+        for v, vertex_id in list(ids.items()):
+            if isinstance(v, CompositeState) and v is not self:
+                for inner, inner_id in v.vertex_ids(vertex_id).items():
+                    if inner not in ids:
+                        ids[inner] = inner_id
+        return ids
 
     def to_visualization(self):
         graph = pydot.Dot("my_graph", graph_type="digraph", bgcolor="white", layout="dot")
@@ -1,8 +1,10 @@
+import asyncio
 from typing import Optional
 
 from langchain.prompts import ChatPromptTemplate
 
 from taskyto.engine.common import get_property_value, prompts, logger
+from taskyto.engine.common.llm import ainvoke
 from taskyto.engine.common.memory import MemoryPiece
 from taskyto.engine.common.validator import FallbackFormatter, Formatter
 from taskyto.engine.custom.events import TaskInProgressEvent, TaskFinishEvent, ActivateModuleEvent
@@ -38,6 +40,9 @@ class MenuChatbotModule(RuntimeChatbotModule):
         # TODO: We don't seem to have access to prompt  
         self.run(state, tool_input)
 
+    async def arun_as_tool(self, state: ExecutionState, tool_input: str, activating_event=None):
+        await self.arun(state, tool_input)
+
 
 
 class DataGatheringChatbotModule(RuntimeChatbotModule):
@@ -91,11 +96,13 @@ class DataGatheringChatbotModule(RuntimeChatbotModule):
                     continue
 
                 if value is not None and p.type in validators:
-                    formatted_value = validators[p.type].do_format(value, p, self.configuration)
+                    with state.tracer.span("formatter", module=self.name(), property=p.name, type=p.type):
+                        formatted_value = validators[p.type].do_format(value, p, self.configuration)
                     if formatted_value is not None:
                         data[p.name] = formatted_value
                 else:
-                    formatted_value = FallbackFormatter().do_format(value, p, self.configuration)
+                    with state.tracer.span("formatter", module=self.name(), property=p.name, type=p.type):
+                        formatted_value = FallbackFormatter().do_format(value, p, self.configuration)
                     if formatted_value is not None:
                         data[p.name] = value
                     else:
@@ -224,6 +231,9 @@ class OpenEndedConversationRuntimeModule(RuntimeChatbotModule):
         # This is a simple pass-through module
         #state.push_event(TaskFinishEvent(tool_input))
 
+    async def arun_as_tool(self, state: ExecutionState, tool_input: str, activating_event=None):
+        await self.arun(state, tool_input)
+
 
 class QuestionAnsweringRuntimeModule(RuntimeChatbotModule):
     def __init__(self, **kwargs):
@@ -232,6 +242,18 @@ class QuestionAnsweringRuntimeModule(RuntimeChatbotModule):
 
     def run_as_tool(self, state: ExecutionState, tool_input: str, activating_event=None):
         new_llm = self.configuration.new_llm(module_name=self.name())
+        question, formatted_prompt = self.build_question_prompt(tool_input)
+        result = new_llm(formatted_prompt)
+        self.answer_question(state, question, result)
+
+    async def arun_as_tool(self, state: ExecutionState, tool_input: str, activating_event=None):
+        new_llm = self.configuration.new_llm(module_name=self.name())
+        question, formatted_prompt = self.build_question_prompt(tool_input)
+        result = await ainvoke(new_llm, formatted_prompt)
+        # The on-success action may execute code or rephrase the answer
+        await asyncio.to_thread(self.answer_question, state, question, result)
+
+    def build_question_prompt(self, tool_input: str):
         question = get_question(tool_input)
 
         # prompt_template = ChatPromptTemplate.from_template(self.prompt)
@@ -244,9 +266,9 @@ class QuestionAnsweringRuntimeModule(RuntimeChatbotModule):
 
         formatted_prompt = prompt_template.format_messages()
         logger.debug_prompt(formatted_prompt)
+        return question, formatted_prompt
 
-        result = new_llm(formatted_prompt)
-
+    def answer_question(self, state: ExecutionState, question: str, result):
         response = self.parse_LLM_output(result.content)
         data = {'result': response, 'question': question}
         response = self.execute_action(self.module.on_success, data, response)
@@ -272,6 +294,10 @@ class SequenceChatbotModule(RuntimeChatbotModule):
             # To enter
             state_manager.push_event(ActivateModuleEvent(self.tools[0], tool_input, activating_event.previous_answer))
 
+    async def arun_as_tool(self, state_manager: ExecutionState, tool_input: str, activating_event=None):
+        # This only pushes events, so there is no need to use a worker thread
+        self.run_as_tool(state_manager, tool_input, activating_event=activating_event)
+
 
 class ActionChatbotModule(RuntimeChatbotModule):
     def run(self, state: ExecutionState, input: str):
@@ -13,6 +13,20 @@ class Extension:
         all_arguments = {**self.arguments, **kwargs}
         return self.extension_module.invoke(**all_arguments)
 
+    def has_async(self):
+        return hasattr(self.extension_module, 'ainvoke')
+
+    async def acall(self, **kwargs):
+        all_arguments = {**self.arguments, **kwargs}
+        return await self.extension_module.ainvoke(**all_arguments)
+
+    def has_stream(self):
+        return hasattr(self.extension_module, 'stream')
+
+    def stream(self, **kwargs):
+        all_arguments = {**self.arguments, **kwargs}
+        return self.extension_module.stream(**all_arguments)
+
 class OllamaExtension(Extension):
 
     def __init__(self, name, type, extension_args: dict):
@@ -1,4 +1,6 @@
+import contextlib
 import os.path
+import threading
 from argparse import ArgumentParser
 from typing import Optional, List
 
@@ -7,9 +9,9 @@ from taskyto import utils
 from taskyto.engine.common import Configuration, Engine
 from taskyto.engine.common.configuration import ConfigurationModel, read_configuration
 from taskyto.engine.common.evaluator import Evaluator
-from taskyto.engine.custom.engine import CustomPromptEngine
+from taskyto.engine.custom.engine import CustomPromptEngine, ChatbotProgram
 from taskyto.engine.custom.runtime import CustomRephraser
-from taskyto.recording import dump_test_recording
+from taskyto.recording import JsonlRecordingWriter, convert_jsonl_recording
 from taskyto.testing.reader import load_test_model
 from taskyto.testing.test_engine import TestEngineConfiguration, run_test
 
@@ -22,6 +24,11 @@ class CustomConfiguration(Configuration):
         self.chatbot_model = spec.load_chatbot_model(root_folder)
         self.root_folder = root_folder
         self.model = model
+        self.model.resolve_llms([module.name for module in self.chatbot_model.modules])
+
+        self._program = None
+        self._program_lock = threading.Lock()
+        self.evaluator = Evaluator(load_path=[self.root_folder])
 
     @property
     def initial_greeting(self):
@@ -38,11 +45,21 @@ class CustomConfiguration(Configuration):
         from taskyto.engine.custom.runtime import ConsoleChannel
         return ConsoleChannel()
 
+    @property
+    def program(self) -> ChatbotProgram:
+        """The compiled chatbot, which is built on first use and shared by all the engines."""
+        if self._program is None:
+            with self._program_lock:
+                if self._program is None:
+                    self._program = ChatbotProgram(self.chatbot_model, configuration=self)
+        return self._program
+
     def new_engine(self) -> Engine:
-        return CustomPromptEngine(self.chatbot_model, configuration=self)
+        return CustomPromptEngine(self.chatbot_model, configuration=self, program=self.program)
 
     def new_evaluator(self):
-        return Evaluator(load_path=[self.root_folder])
+        # The evaluator does not keep state of the conversation, so it can be shared
+        return self.evaluator
 
     def new_llm(self, module_name: Optional[str] = None):
         return self.model.get_llm_for_module_or_default(module_name)
@@ -50,6 +67,23 @@ class CustomConfiguration(Configuration):
     def new_rephraser(self):
         return CustomRephraser(self)
 
+    def get_memory_policy(self, module_name: Optional[str] = None):
+        return self.model.get_memory_policy(module_name)
+
+    def new_recording(self):
+        if self.model.tracing is None:
+            return super().new_recording()
+        return self.model.tracing.new_recording()
+
+    def get_tracer(self):
+        return self.model.get_tracer()
+
+    def add_span_sink(self, sink):
+        self.model.add_span_sink(sink)
+
+    def remove_span_sink(self, sink):
+        self.model.remove_span_sink(sink)
+
 
 def load_configuration_model(chatbot_folder, configuration_file: Optional[str] = None, module_path: List[str] = []) -> ConfigurationModel:
     if configuration_file is None:
@@ -72,13 +106,33 @@ def initialize_engine(chatbot_folder, configuration):
     return engine
 
 
+@contextlib.contextmanager
+def recording_dump(engine, recording_file_dump: Optional[str], trace=False):
+    """
+    Writes the recording of the engine to a JSONL file while the conversation runs. Unless recording_file_dump
+    is itself a .jsonl file, the JSONL file is converted to the test format at the end, and then removed.
+    """
+    if recording_file_dump is None:
+        yield
+        return
+
+    is_jsonl = recording_file_dump.endswith(".jsonl")
+    jsonl_file = recording_file_dump if is_jsonl else recording_file_dump + ".jsonl"
+    with JsonlRecordingWriter(jsonl_file) as writer:
+        engine.recorded_interaction.writer = writer
+        yield
+
+    if not is_jsonl:
+        convert_jsonl_recording(jsonl_file, recording_file_dump, trace=trace)
+        os.remove(jsonl_file)
+
+
 def execute_chatbot(chatbot_folder: str, configuration, recording_file_dump: str = None, module_path=None):
     engine = initialize_engine(chatbot_folder, configuration)
 
     channel = configuration.new_channel()
-    engine.run_all(channel)
-
-    dump_test_recording(engine.recorded_interaction, file=recording_file_dump, trace=True)
+    with recording_dump(engine, recording_file_dump, trace=True):
+        engine.run_all(channel)
 
     print()
     print("Bye!")
@@ -113,14 +167,12 @@ def test(chatbot, test_file, configuration, dry_run, replay=None, recording_file
         config = TestEngineConfiguration(dry_run=dry_run)
         if replay:
             config.replay = replay
-        completed_steps = run_test(test_model, engine, config)
-        if not completed_steps:
-            from taskyto.engine.custom.runtime import ConsoleChannel
-            channel = ConsoleChannel()
-            engine.run_all(channel)
-
-        if recording_file_dump is not None:
-            dump_test_recording(engine.recorded_interaction, file=recording_file_dump)
+        with recording_dump(engine, recording_file_dump):
+            completed_steps = run_test(test_model, engine, config)
+            if not completed_steps:
+                from taskyto.engine.custom.runtime import ConsoleChannel
+                channel = ConsoleChannel()
+                engine.run_all(channel)
 
 
 def setup_debugging_capabilities(args):
@@ -167,7 +219,7 @@ def main():
     parser.add_argument('--replay', default=False, type=int,
                         help='Replay a test case up to n user steps')
     parser.add_argument('--dump', default=None, type=str,
-                        help='A file to dump the interaction in a test case format')
+                        help='A file to dump the interaction in a test case format (or as JSONL, if it ends with .jsonl)')
     parser.add_argument('--config', default=None, type=str,
                         help='The configuration file to use for the chatbot')
 
@@ -1,42 +1,162 @@
-from typing import List
+import json
+import random
+from collections import deque
+from typing import List, Optional, Iterator
 
 from pydantic import BaseModel
 
 
-class InteractionItem(BaseModel):
-    type: str
-    message: str
+class InteractionItem:
+    __slots__ = ("type", "message")
+
+    def __init__(self, type: str, message: str):
+        self.type = type
+        self.message = message
+
+    def __repr__(self):
+        return f"InteractionItem(type={self.type!r}, message={self.message!r})"
 
 class InternalTraceItem(BaseModel):
     type: str
     event: object
     #transition: str
 
-class RecordedInteraction(BaseModel):
-    interactions: List[InteractionItem] = []
-    trace: List[InternalTraceItem] = []
-    response_times: List[float] = []
+class RecordedInteraction:
+    """
+    The interactions, the events and the response times of a conversation.
+
+    Events are serialized as they are traced, so that the trace does not keep alive the memories which they refer
+    to, but they are only turned into InternalTraceItems (see trace_items) when the trace is dumped. Tracing can be
+    disabled, and max_items turns the records into ring buffers which keep only the last items, so that long
+    conversations (e.g., in a server) do not grow without bound. The average response time is always computed
+    over the whole conversation.
+    """
+
+    def __init__(self, tracing: bool = True, max_items: Optional[int] = None,
+                 writer: Optional["JsonlRecordingWriter"] = None):
+        self.tracing = tracing
+        self.writer = writer
+        """If given, every item is also written to it as soon as it is recorded"""
+        self.interactions = deque(maxlen=max_items)
+        self.trace = deque(maxlen=max_items)
+        self.response_times = deque(maxlen=max_items)
+        self._total_response_time = 0.0
+        self._responses = 0
 
     def append(self, type, message):
-        self.interactions.append(InteractionItem(type=type, message=message))
+        self.interactions.append(InteractionItem(type, message))
+        if self.writer is not None:
+            self.writer.write({"type": type, "message": message})
 
     #def append_trace(self, event, transition: Optional[Transition]):
     def append_trace(self, event):
-        self.trace.append(InternalTraceItem(type='event-transition',
-                                            event=event.to_dict()))
-                                            #transition=transition.to_dict() if transition else None))
+        if self.tracing:
+            event = event.to_dict()
+            self.trace.append(event)
+            if self.writer is not None:
+                self.writer.write({"type": "event-transition", "event": event})
+
+    def trace_items(self) -> List[InternalTraceItem]:
+        return [InternalTraceItem(type='event-transition', event=event) for event in self.trace]
 
     def record_response_time(self, time):
         self.response_times.append(time)
+        self._total_response_time += time
+        self._responses += 1
+        if self.writer is not None:
+            self.writer.write({"type": "response_time", "time": time})
+            # A turn has finished, so it is not lost if the process crashes
+            self.writer.flush()
 
     def average_response_time(self):
-        if len(self.response_times) ==0: return 0
-        return sum(self.response_times) / len(self.response_times)
+        if self._responses == 0: return 0
+        return self._total_response_time / self._responses
+
+
+def new_recording(mode: str = "full", sample_rate: float = 1.0, max_items: Optional[int] = None) -> RecordedInteraction:
+    """A recording for a new conversation. In sampled mode, only a sample_rate fraction of them is traced."""
+    if mode == "off":
+        tracing = False
+    elif mode == "sampled":
+        tracing = random.random() < sample_rate
+    else:
+        tracing = True
+    return RecordedInteraction(tracing=tracing, max_items=max_items)
+
+
+class JsonlRecordingWriter:
+    """
+    Writes a recording to a file while the conversation runs, one JSON object per line: the interactions
+    ({"type": "user" | "chatbot", "message": ...}), the trace events ({"type": "event-transition", "event": ...})
+    and the response times ({"type": "response_time", "time": ...}). See convert_jsonl_recording.
+    """
+
+    def __init__(self, file: str):
+        self.file = file
+        self._stream = open(file, "w", encoding="utf-8")
+
+    def write(self, item: dict):
+        # Values which are not JSON types (e.g., dates of the collected data) are written as strings
+        self._stream.write(json.dumps(item, ensure_ascii=False, default=str))
+        self._stream.write("\n")
+
+    def flush(self):
+        self._stream.flush()
+
+    def close(self):
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_jsonl_recording(file: str) -> Iterator[dict]:
+    with open(file, encoding="utf-8") as stream:
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def convert_jsonl_recording(jsonl_file: str, file: str, trace=False):
+    """Converts a recording written by JsonlRecordingWriter to the test format written by dump_test_recording"""
+    data = dict()
+    data["interaction"] = []
+    if trace:
+        data["trace"] = []
+    for item in read_jsonl_recording(jsonl_file):
+        if item["type"] in ("user", "chatbot"):
+            data["interaction"].append(_interaction_to_dict(item["type"], item["message"]))
+        elif item["type"] == "event-transition":
+            if trace:
+                data["trace"].append(item)
+        elif item["type"] != "response_time":
+            raise ValueError("Unknown recording item type", item["type"])
+
+    _write_yaml(data, file)
+
+
+def _interaction_to_dict(type, message):
+    if type == "user":
+        return dict(user=message)
+    elif type == "chatbot":
+        return dict(chatbot=[message])
+    else:
+        raise ValueError("Unknown interaction type", type)
+
+
+def _write_yaml(data, file):
+    import yaml
+    with open(file, "w") as f:
+        yaml.dump(data, f)
 
 
 def _dump_trace(recording, data):
     data["trace"] = []
-    for i in recording.trace:
+    for i in recording.trace_items():
         data["trace"].append(dict(i))
 
 def dump_test_recording(recording: RecordedInteraction, file: str, trace=False):
@@ -46,16 +166,20 @@ def dump_test_recording(recording: RecordedInteraction, file: str, trace=False):
     data = dict()
     data["interaction"] = []
     for i in recording.interactions:
-        if i.type == "user":
-            data["interaction"].append(dict(user=i.message))
-        elif i.type == "chatbot":
-            data["interaction"].append(dict(chatbot=[i.message]))
-        else:
-            raise ValueError("Unknown interaction type", i.type)
+        data["interaction"].append(_interaction_to_dict(i.type, i.message))
 
     if trace:
         _dump_trace(recording, data)
 
-    import yaml
-    with open(file, "w") as f:
-        yaml.dump(data, f)
+    _write_yaml(data, file)
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description='Converts a JSONL recording to the test format')
+    parser.add_argument('jsonl_file', help='The recording written while the conversation was running')
+    parser.add_argument('file', help='The YAML file to write')
+    parser.add_argument('--trace', default=False, action='store_true', help='Include the trace of events')
+    args = parser.parse_args()
+    convert_jsonl_recording(args.jsonl_file, args.file, trace=args.trace)
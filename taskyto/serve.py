@@ -1,6 +1,23 @@
+import functools
 from argparse import ArgumentParser
 
 from taskyto import main, utils
+from taskyto.engine.common.configuration import TracingConfiguration
+
+
+def new_server_configuration(args):
+    configuration = main.setup_configuration(args)
+    if configuration.model.tracing is None:
+        # The recordings of the conversations are not dumped by the server, so only the last items are kept
+        configuration.model.tracing = TracingConfiguration(mode="off", max_items=100)
+    return configuration
+
+
+def new_worker_configuration(args):
+    # Called in each worker process
+    main.setup_debugging_capabilities(args)
+    return new_server_configuration(args)
+
 
 def execute_server():
     parser = ArgumentParser(description='Runner for a chatbot')
@@ -16,6 +33,10 @@ def execute_server():
                         help='Show all intermediate processing information')
     parser.add_argument('--config', default=None, type=str,
                         help='The configuration file to use for the chatbot')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='Number of worker processes running the conversations')
+    parser.add_argument('--metrics', default=False, action='store_true',
+                        help='Measure the requests, turns and LLM calls, and serve them in /metrics')
 
     args = parser.parse_args()
 
@@ -23,11 +44,17 @@ def execute_server():
 
     utils.check_keys(["OPENAI_API_KEY"])
 
-    configuration = main.setup_configuration(args)
+    configuration = new_server_configuration(args)
 
-    from taskyto.server import FlaskChatbotApp
-    chatbot_app = FlaskChatbotApp(configuration)
+    if args.workers > 1:
+        from taskyto.server.pool import WorkerPool, PooledChatbotApp
+        pool = WorkerPool(functools.partial(new_worker_configuration, args), args.workers,
+                          sessions=configuration.model.sessions, metrics=args.metrics)
+        chatbot_app = PooledChatbotApp(pool)
+    else:
+        from taskyto.server import FlaskChatbotApp
+        chatbot_app = FlaskChatbotApp(configuration, metrics=args.metrics)
     chatbot_app.run()
 
 if __name__ == '__main__':
-    execute_server()
\ No newline at end of file
+    execute_server()
@@ -1,23 +1,49 @@
+import json
+import queue
+import threading
 import uuid
 import os
+from typing import Optional, Callable
 
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify
 from flask import request
-from werkzeug.exceptions import BadRequest, NotFound, InternalServerError
+from werkzeug.exceptions import BadRequest, NotFound, InternalServerError, Conflict, RequestEntityTooLarge
 
+from taskyto.engine.common.configuration import SessionConfiguration
 from taskyto.engine.custom.runtime import Channel
+from taskyto.server.conversations import ConversationRegistry, HibernationStore, SharedConversationRegistry, \
+    StatelessRegistry
+from taskyto.server.metrics import ServerMetrics
+from taskyto.server.state import StateCodec, InvalidState, StateTooLarge
+from taskyto.server.store import SQLiteConversationStore, VersionConflict
+
+MAX_ATTEMPTS = 3
+"""Times that a message is processed when another worker changes its conversation at the same time"""
 
 
 class Conversation:
     def __init__(self, engine):
         self.engine = engine
         self.channel = FlaskChannel()
+        self.lock = threading.Lock()
+        """Held while a message of the conversation is processed (see ConversationRegistry)"""
+        self.hibernated = False
+        """Whether the conversation has been removed from memory, so this object is no longer used"""
+
+    def snapshot(self) -> dict:
+        return self.engine.snapshot()
 
 
 class FlaskChannel(Channel):
 
     def __init__(self):
         self.responses = []
+        self.events = None
+        """Queue which receives the chunks and outputs while a message is being streamed"""
+
+    @property
+    def streaming(self):
+        return self.events is not None
 
     def clear(self):
         self.responses.clear()
@@ -27,6 +53,16 @@ class FlaskChannel(Channel):
 
     def output(self, msg, who=None):
         self.responses.append(msg)
+        if self.events is not None:
+            self.events.put(("output", msg))
+
+    def output_chunk(self, chunk, who=None):
+        if self.events is not None:
+            self.events.put(("chunk", chunk))
+
+    def discard_chunks(self, who=None):
+        if self.events is not None:
+            self.events.put(("reset", None))
 
     def thinking(self, text: str):
         pass
@@ -35,7 +71,9 @@ class FlaskChannel(Channel):
         pass
 
 class FlaskChatbotApp:
-    def __init__(self, configuration, app: Flask = None):
+    def __init__(self, configuration, app: Flask = None, metrics: bool = False,
+                 sessions: Optional[SessionConfiguration] = None,
+                 conversation_ids: Optional[Callable[[], str]] = None):
         if app is None:
             app = Flask(__name__)
 
@@ -46,41 +84,92 @@ class FlaskChatbotApp:
 
         self.configuration = configuration
         self.app = app
+        self.conversation_ids = conversation_ids if conversation_ids is not None else lambda: str(uuid.uuid4())
+        """Generates the ids of the new conversations"""
 
-        self.data = {}
+        if sessions is None and getattr(configuration, "model", None) is not None:
+            sessions = configuration.model.sessions
+        self.state_codec = self.new_state_codec(sessions)
+        """Encodes the state of the conversations for the clients, in stateless mode"""
+        self.conversations = self.new_registry(sessions)
 
-        def get_data():
-            # I don't know if this is fully correct, it assumes that data is accessed by only one thread.
-            # Session can't be used easily since we can't currently serialize a Conversation object.
-            # Alternative, check: multiprocessing.Manager, memcached, redis, etc.
-            return self.data
+        self.metrics = None
+        if metrics:
+            # The turns and LLM calls are measured by the spans of the engines
+            self.metrics = ServerMetrics(configuration, conversations=self.conversations)
+            configuration.add_span_sink(self.metrics)
 
         @app.post("/conversation/new")
         def init_conversation():
             engine = configuration.new_engine()
-
-            # Generate an unique uuid
-            id = str(uuid.uuid4())
             conversation = Conversation(engine)
-            get_data()[id] = conversation
-
             engine.start(conversation.channel)
 
-            return jsonify({"id": id})
+            id = self.conversations.add(conversation, id=self.conversation_ids())
+            return jsonify({"id": id, **_state_of(id, conversation)})
 
         @app.post('/conversation/user_message')
         def user_message():
             try:
                 return _handle_user_message()
             except BadRequest as e:
+                _record_error(e)
                 return jsonify({"error": str(e)}), 400
             except NotFound as e:
+                _record_error(e)
                 return jsonify({"error": str(e)}), 404
+            except RequestEntityTooLarge as e:
+                _record_error(e)
+                return jsonify({"error": str(e)}), 413
+            except Conflict as e:
+                _record_error(e)
+                return jsonify({"error": str(e)}), 409
             except InternalServerError as e:
+                # The exception of the engine has already been counted by the metrics (see ServerMetrics.emit)
                 return jsonify({"error": str(e)}), 500
             except Exception as e:
+                _record_error(e)
                 return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
 
+        @app.get("/metrics")
+        def get_metrics():
+            if self.metrics is None:
+                raise NotFound("Metrics are disabled")
+            return Response(self.metrics.render(), mimetype="text/plain; version=0.0.4")
+
+        def _record_error(e):
+            if self.metrics is not None:
+                self.metrics.record_error(e)
+
+        def _acquire(id):
+            if self.state_codec is None:
+                try:
+                    return self.conversations.acquire(id)
+                except KeyError:
+                    raise NotFound(f"Conversation with id {id} not found")
+
+            # Stateless mode: the conversation is restored from the state sent by the client
+            if 'state' not in request.json:
+                raise BadRequest("Missing 'state' in request")
+            try:
+                snapshot = self.state_codec.decode(id, request.json['state'])
+            except StateTooLarge as e:
+                raise RequestEntityTooLarge(str(e))
+            except InvalidState as e:
+                raise BadRequest(str(e))
+            try:
+                conversation = self.restore_conversation(snapshot)
+            except (ValueError, KeyError) as e:
+                # E.g., the chatbot has changed since the state was produced
+                raise BadRequest(f"The state of conversation {id} cannot be restored: {str(e)}")
+            conversation.lock.acquire()
+            return conversation
+
+        def _state_of(id, conversation) -> dict:
+            if self.state_codec is None:
+                return {}
+            return {"state": self.state_codec.encode(id, conversation.snapshot())}
+
         def _handle_user_message():
             if not request.json or 'id' not in request.json or 'message' not in request.json:
                 raise BadRequest("Missing 'id' or 'message' in request")
@@ -88,22 +177,137 @@ class FlaskChatbotApp:
             id = request.json['id']
             message = request.json['message']
 
-            try:
-                conversation = get_data()[id]
-            except KeyError:
-                raise NotFound(f"Conversation with id {id} not found")
+            streaming = request.accept_mimetypes.best == "text/event-stream"
+            for _ in range(MAX_ATTEMPTS):
+                conversation = _acquire(id)
+
+                if streaming:
+                    # The conversation is released by the thread which runs the engine, once the message has
+                    # been processed
+                    return _stream_user_message(id, conversation, message)
+
+                try:
+                    conversation.channel.clear()
+                    try:
+                        conversation.engine.execute_with_input(message)
+                    except Exception as e:
+                        import traceback
+                        traceback.print_exc()
+                        raise InternalServerError(f"Error executing the engine: {str(e)}")
+
+                    chatbot_response = "\n".join(conversation.channel.responses)
+                    state = _state_of(id, conversation)
+                except BaseException:
+                    self.conversations.release(id, conversation, failed=True)
+                    raise
+
+                try:
+                    self.conversations.release(id, conversation)
+                except VersionConflict:
+                    # Processed again on the latest version of the conversation
+                    continue
+                return jsonify({"id": id, "type": "chatbot_response", "message": chatbot_response, **state})
+
+            raise Conflict(f"Conversation with id {id} is being changed by other requests")
+
+        def _stream_user_message(id, conversation, message):
+            # Server-Sent Events variant of user_message. The engine runs in a separate thread and
+            # the generated chunks are sent as "chunk" events. A "reset" event tells the client to discard
+            # the chunks received since the last output, since the response is streamed again. Each complete
+            # output is sent as an "output" event and the final response is sent as a "chatbot_response" event.
+            events = queue.Queue()
+            channel = conversation.channel
+            channel.clear()
+            channel.events = events
 
-            conversation.channel.clear()
+            def run_engine():
+                error = None
+                failed = True
+                try:
+                    conversation.engine.execute_with_input(message)
+                    response = {"message": "\n".join(channel.responses), **_state_of(id, conversation)}
+                    failed = False
+                except Exception as e:
+                    import traceback
+                    traceback.print_exc()
+                    error = f"Error executing the engine: {str(e)}"
+                finally:
+                    channel.events = None
+                    try:
+                        self.conversations.release(id, conversation, failed=failed)
+                    except VersionConflict:
+                        # The chunks have already been sent, so the message is not processed again
+                        error = error or f"Conversation with id {id} was changed by another request"
+                    except Exception as e:
+                        error = error or f"Error storing the conversation: {str(e)}"
+                events.put(("error", error) if error is not None else ("done", response))
+
+            def to_sse(event, data):
+                return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+            def generate():
+                while True:
+                    kind, payload = events.get()
+                    if kind == "chunk":
+                        yield to_sse("chunk", {"id": id, "text": payload})
+                    elif kind == "reset":
+                        yield to_sse("reset", {"id": id})
+                    elif kind == "output":
+                        yield to_sse("output", {"id": id, "message": payload})
+                    elif kind == "done":
+                        yield to_sse("chatbot_response", {"id": id, "type": "chatbot_response", **payload})
+                        return
+                    else:
+                        yield to_sse("error", {"id": id, "error": payload})
+                        return
 
             try:
-                conversation.engine.execute_with_input(message)
-            except Exception as e:
-                import traceback
-                traceback.print_exc()
-                raise InternalServerError(f"Error executing the engine: {str(e)}")
+                threading.Thread(target=run_engine, daemon=True).start()
+            except BaseException:
+                channel.events = None
+                self.conversations.release(id, conversation, failed=True)
+                raise
+            return Response(generate(), mimetype="text/event-stream",
+                            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-            chatbot_response = "\n".join(conversation.channel.responses)
-            return jsonify({"id": id, "type": "chatbot_response", "message": chatbot_response})
+    def new_registry(self, sessions: Optional[SessionConfiguration]):
+        if sessions is None:
+            return ConversationRegistry()
+        if sessions.stateless is not None:
+            return StatelessRegistry()
+        if sessions.store is not None:
+            return SharedConversationRegistry(SQLiteConversationStore(sessions.store), self.restore_conversation,
+                                              max_live=sessions.max_live, idle_ttl=sessions.idle_ttl,
+                                              expire_after=sessions.expire_after)
+        store = HibernationStore(sessions.hibernation_folder) if sessions.hibernation_folder is not None else None
+        return ConversationRegistry(max_live=sessions.max_live, idle_ttl=sessions.idle_ttl,
+                                    expire_after=sessions.expire_after, store=store,
+                                    restore=self.restore_conversation if store is not None else None)
+
+    def new_state_codec(self, sessions: Optional[SessionConfiguration]) -> Optional[StateCodec]:
+        if sessions is None or sessions.stateless is None:
+            return None
+        stateless = sessions.stateless
+        secret = os.environ.get(stateless.secret_env)
+        if not secret:
+            raise ValueError(f"The stateless mode needs a secret in the environment variable {stateless.secret_env}")
+        return StateCodec(secret.encode("utf-8"), max_size=stateless.max_size, last_turns=stateless.last_turns)
+
+    def restore_conversation(self, snapshot: dict) -> Conversation:
+        """Restores a conversation from a snapshot taken with Conversation.snapshot"""
+        engine = self.configuration.new_engine()
+        conversation = Conversation(engine)
+        engine.restore(snapshot, conversation.channel)
+        return conversation
 
     def run(self):
-        self.app.run()
+        try:
+            self.app.run()
+        finally:
+            self.close()
+
+    def close(self):
+        """Detaches the app from the configuration, which may be shared by other apps"""
+        if self.metrics is not None:
+            self.configuration.remove_span_sink(self.metrics)
+            self.metrics = None
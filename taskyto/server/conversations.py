@@ -0,0 +1,474 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from typing import Optional, Callable, Dict
+
+from taskyto.engine.custom.snapshot import dumps, loads
+from taskyto.server.store import ConversationStore, VersionConflict
+
+
+class HibernationStore:
+    """
+    The snapshots of the hibernated conversations (see taskyto.engine.custom.snapshot), a JSON file per
+    conversation in a folder. The modification time of each file is the last time that the conversation was used.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, id: str) -> str:
+        return os.path.join(self.folder, id + ".json")
+
+    def save(self, id: str, snapshot: dict, last_used: float):
+        path = self.path(id)
+        # Written to a temporary file first, so that a crash does not leave a partial snapshot
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(dumps(snapshot))
+        os.replace(path + ".tmp", path)
+        os.utime(path, (last_used, last_used))
+
+    def load(self, id: str) -> dict:
+        """Raises KeyError if the conversation is not stored"""
+        try:
+            with open(self.path(id), encoding="utf-8") as f:
+                return loads(f.read())
+        except FileNotFoundError:
+            raise KeyError(id)
+
+    def delete(self, id: str):
+        try:
+            os.remove(self.path(id))
+        except FileNotFoundError:
+            pass
+
+    def last_used(self) -> Dict[str, float]:
+        """The stored conversations, with the last time they were used"""
+        return {entry.name[:-len(".json")]: entry.stat().st_mtime
+                for entry in os.scandir(self.folder) if entry.name.endswith(".json")}
+
+
+class RegistryStats:
+    def __init__(self):
+        self.hibernations = 0
+        self.rehydrations = 0
+        self.evictions = 0
+        """Conversations removed because of the limits, when there is no hibernation store"""
+        self.expirations = 0
+        """Conversations removed because they were not used for expire_after seconds"""
+        self.conflicts = 0
+        """Messages whose changes were discarded because another worker changed the conversation first"""
+
+    def __repr__(self):
+        return (f"RegistryStats(hibernations={self.hibernations}, rehydrations={self.rehydrations}, "
+                f"evictions={self.evictions}, expirations={self.expirations}, conflicts={self.conflicts})")
+
+
+class ConversationRegistry:
+    """
+    The conversations of a server, shared by the request threads. The registry is only locked to add and
+    find conversations. Each conversation has its own lock, held while one of its messages is processed, so
+    different conversations run in parallel while the messages of a conversation are processed one at a time
+    (see Conversation.lock).
+
+    The conversations kept in memory (live) can be limited:
+      * max_live: when there are more, the least recently used ones are hibernated.
+      * idle_ttl: conversations which have not been used for these seconds are hibernated.
+      * expire_after: conversations which have not been used for these seconds are removed, even if hibernated.
+    Hibernated conversations are written to the store with conversation.snapshot() and restored with
+    restore(snapshot) when they receive a message. Without a store, they are removed instead. Conversations
+    which are processing a message are never hibernated.
+
+    The registry is only locked to choose the conversations to be hibernated, which are held by their own lock
+    until they are written, and to move conversations between the live and the hibernated ones. Snapshots are
+    taken, written, read and restored without holding it, so the other conversations are not delayed by them.
+    """
+
+    def __init__(self, max_live: Optional[int] = None, idle_ttl: Optional[float] = None,
+                 expire_after: Optional[float] = None, store: Optional[HibernationStore] = None,
+                 restore: Optional[Callable[[dict], object]] = None, clock: Callable[[], float] = time.time,
+                 sweep_interval: float = 60):
+        if store is not None and restore is None:
+            raise ValueError("A hibernation store needs a function to restore the conversations")
+        self.max_live = max_live
+        self.idle_ttl = idle_ttl
+        self.expire_after = expire_after
+        self.store = store
+        self.restore = restore
+        self.clock = clock
+        self.sweep_interval = sweep_interval
+        self.stats = RegistryStats()
+
+        self._live = OrderedDict()
+        """Conversation id -> [conversation, last used], from the least to the most recently used"""
+        self._hibernating = {}
+        """Conversation id -> conversation, for those which are being written to the store"""
+        self._hibernated = store.last_used() if store is not None else {}
+        self._rehydrating = {}
+        """Conversation id -> event set once the thread which restores it has finished"""
+        self._next_sweep = 0
+        self._lock = threading.Lock()
+
+    def add(self, conversation, id: Optional[str] = None) -> str:
+        if id is None:
+            id = str(uuid.uuid4())
+        with self._lock:
+            now = self.clock()
+            self._live[id] = [conversation, now]
+            victims, expired = self._maintain(now)
+        self._hibernate(victims, expired)
+        return id
+
+    def get(self, id: str):
+        """Raises KeyError if the conversation does not exist"""
+        while True:
+            rehydrating, restorer = None, False
+            with self._lock:
+                now = self.clock()
+                victims, expired = self._maintain(now)
+                entry = self._live.get(id)
+                if entry is not None:
+                    entry[1] = now
+                    self._live.move_to_end(id)
+                    conversation = entry[0]
+                else:
+                    # A conversation being hibernated is returned, and acquire waits until it is hibernated
+                    conversation = self._hibernating.get(id)
+                if conversation is None and id in self._hibernated:
+                    # Only one thread restores it, and the rest wait for it
+                    rehydrating = self._rehydrating.get(id)
+                    if rehydrating is None:
+                        rehydrating = self._rehydrating[id] = threading.Event()
+                        restorer = True
+            self._hibernate(victims, expired)
+
+            if conversation is not None:
+                return conversation
+            if rehydrating is None:
+                raise KeyError(id)
+            if not restorer:
+                rehydrating.wait()
+                continue
+            try:
+                restored = self._rehydrate(id)
+            finally:
+                with self._lock:
+                    del self._rehydrating[id]
+                rehydrating.set()
+            if not restored:
+                raise KeyError(id)
+
+    def acquire(self, id: str):
+        """
+        Returns the conversation with its lock held, to process a message. The caller must release it.
+        Raises KeyError if the conversation does not exist.
+        """
+        while True:
+            conversation = self.get(id)
+            conversation.lock.acquire()
+            if not conversation.hibernated:
+                return conversation
+            # It was hibernated while waiting for the lock, so it is restored again
+            conversation.lock.release()
+
+    def release(self, id: str, conversation, failed: bool = False):
+        """Releases a conversation obtained with acquire, once its message has been processed"""
+        conversation.lock.release()
+
+    def _maintain(self, now: float):
+        """
+        Chooses the conversations to be hibernated, with the registry locked, and returns them with their locks
+        held, together with the expired hibernated ones. Both are then removed with _hibernate.
+        """
+        victims = []
+        if self.expire_after is not None or self.idle_ttl is not None:
+            # Only the least recently used conversations are visited
+            for id, (conversation, last_used) in self._live.items():
+                idle = now - last_used
+                if self.expire_after is not None and idle > self.expire_after:
+                    victims.append((id, conversation, last_used, True))
+                elif self.idle_ttl is not None and idle > self.idle_ttl:
+                    victims.append((id, conversation, last_used, False))
+                else:
+                    # The rest have been used more recently
+                    break
+
+        if self.max_live is not None and len(self._live) - len(victims) > self.max_live:
+            excess = len(self._live) - len(victims) - self.max_live
+            chosen = {id for id, *_ in victims}
+            for id, (conversation, last_used) in self._live.items():
+                if excess == 0:
+                    break
+                if id not in chosen and not conversation.lock.locked():
+                    victims.append((id, conversation, last_used, False))
+                    excess -= 1
+
+        # Conversations which are processing a message are skipped
+        victims = [victim for victim in victims if victim[1].lock.acquire(blocking=False)]
+        for id, conversation, _, _ in victims:
+            del self._live[id]
+            self._hibernating[id] = conversation
+
+        expired = []
+        if self.expire_after is not None and self._hibernated and now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            for id, last_used in list(self._hibernated.items()):
+                if now - last_used > self.expire_after:
+                    del self._hibernated[id]
+                    expired.append(id)
+            self.stats.expirations += len(expired)
+        return victims, expired
+
+    def _hibernate(self, victims: list, expired: list):
+        # Called without the registry lock. The victims are locked, so no message is processed meanwhile.
+        for id, conversation, last_used, is_expired in victims:
+            try:
+                hibernated = False
+                if not is_expired and self.store is not None:
+                    try:
+                        self.store.save(id, conversation.snapshot(), last_used)
+                        hibernated = True
+                    except Exception:
+                        # E.g., data which cannot be serialized. The conversation is kept in memory.
+                        traceback.print_exc()
+                        with self._lock:
+                            del self._hibernating[id]
+                            self._live[id] = [conversation, last_used]
+                            self._live.move_to_end(id, last=False)
+                        continue
+                with self._lock:
+                    del self._hibernating[id]
+                    if hibernated:
+                        self._hibernated[id] = last_used
+                        self.stats.hibernations += 1
+                    elif is_expired:
+                        self.stats.expirations += 1
+                    else:
+                        self.stats.evictions += 1
+                    conversation.hibernated = True
+            finally:
+                conversation.lock.release()
+        for id in expired:
+            self.store.delete(id)
+
+    def _rehydrate(self, id: str) -> bool:
+        """Restores a hibernated conversation, without the registry lock. Returns False if it no longer exists."""
+        try:
+            conversation = self.restore(self.store.load(id))
+        except KeyError:
+            conversation = None
+        with self._lock:
+            if id not in self._hibernated:
+                # It expired meanwhile
+                return False
+            if conversation is None:
+                # Its snapshot has been removed
+                del self._hibernated[id]
+                return False
+            # Held until the snapshot is deleted, so that it cannot be hibernated again before
+            conversation.lock.acquire()
+            del self._hibernated[id]
+            self._live[id] = [conversation, self.clock()]
+            self.stats.rehydrations += 1
+        try:
+            self.store.delete(id)
+        finally:
+            conversation.lock.release()
+        return True
+
+    def __len__(self):
+        """The number of live conversations"""
+        return len(self._live)
+
+    @property
+    def hibernated_count(self) -> int:
+        return len(self._hibernated)
+
+    def __contains__(self, id: str):
+        return id in self._live or id in self._hibernating or id in self._hibernated
+
+
+class SharedConversationRegistry:
+    """
+    The conversations of a server kept in a ConversationStore shared by several worker processes, so that any
+    worker can serve any conversation. The store has the latest state of each conversation: a worker keeps
+    the conversations it has served (up to max_live, the least recently used are dropped, as well as those not
+    used for idle_ttl seconds), and reloads them when another worker has changed them since. Conversations
+    which have not been used for expire_after seconds are removed from the store, in a sweep done at most
+    every sweep_interval seconds by each worker.
+
+    Each message is processed on the version of the conversation which was acquired, and the changes are
+    written when it is released. If another worker changed the conversation in the meantime (i.e., two
+    messages of the same conversation were processed at once by different workers), release raises
+    VersionConflict and the changes are discarded, so the message can be processed again.
+    """
+
+    def __init__(self, store: ConversationStore, restore: Callable[[dict], object], max_live: Optional[int] = None,
+                 idle_ttl: Optional[float] = None, expire_after: Optional[float] = None,
+                 clock: Callable[[], float] = time.time, sweep_interval: float = 60):
+        self.store = store
+        self.restore = restore
+        self.max_live = max_live
+        self.idle_ttl = idle_ttl
+        self.expire_after = expire_after
+        self.clock = clock
+        self.sweep_interval = sweep_interval
+        self.stats = RegistryStats()
+
+        self._cached = OrderedDict()
+        """Conversation id -> [conversation, stored version, last used], from the least to the most recently used"""
+        self._next_sweep = 0
+        self._lock = threading.Lock()
+
+    def add(self, conversation, id: Optional[str] = None) -> str:
+        if id is None:
+            id = str(uuid.uuid4())
+        self._sweep()
+        version = self.store.create(id, conversation.snapshot())
+        with self._lock:
+            self._cached[id] = [conversation, version, self.clock()]
+            self._evict()
+        return id
+
+    def acquire(self, id: str):
+        """
+        Returns the latest version of the conversation with its lock held, to process a message. The caller
+        must release it with release. Raises KeyError if the conversation does not exist.
+        """
+        self._sweep()
+        while True:
+            with self._lock:
+                entry = self._cached.get(id)
+                if entry is not None:
+                    entry[2] = self.clock()
+                    self._cached.move_to_end(id)
+                    self._evict()
+
+            if entry is None:
+                version, snapshot = self.store.load(id)
+                conversation = self.restore(snapshot)
+                conversation.lock.acquire()
+                with self._lock:
+                    if id in self._cached:
+                        # Loaded at the same time by another thread, whose copy is used
+                        conversation.lock.release()
+                        continue
+                    self._cached[id] = [conversation, version, self.clock()]
+                    self.stats.rehydrations += 1
+                    self._evict()
+                return conversation
+
+            conversation = entry[0]
+            conversation.lock.acquire()
+            if not conversation.hibernated:
+                if self.store.version(id) == entry[1]:
+                    return conversation
+                # Changed by another worker, so it is loaded again
+                self._drop(id, conversation)
+            conversation.lock.release()
+
+    def release(self, id: str, conversation, failed: bool = False):
+        """
+        Writes the changes of the conversation to the store and releases its lock. If the message failed,
+        the changes are discarded instead, and the conversation is loaded again from the store.
+        Raises VersionConflict if another worker changed the conversation since it was acquired.
+        """
+        try:
+            with self._lock:
+                entry = self._cached.get(id)
+            if failed or entry is None or entry[0] is not conversation:
+                self._drop(id, conversation)
+                return
+            try:
+                entry[1] = self.store.save(id, conversation.snapshot(), entry[1])
+            except VersionConflict:
+                self.stats.conflicts += 1
+                self._drop(id, conversation)
+                raise
+            except Exception:
+                self._drop(id, conversation)
+                raise
+        finally:
+            conversation.lock.release()
+
+    def _drop(self, id: str, conversation):
+        conversation.hibernated = True
+        with self._lock:
+            entry = self._cached.get(id)
+            if entry is not None and entry[0] is conversation:
+                del self._cached[id]
+        self.store.forget([id])
+
+    def _sweep(self):
+        # Expiring takes a write to the store, so it is done without holding the registry lock
+        if self.expire_after is None:
+            return
+        now = self.clock()
+        with self._lock:
+            if now < self._next_sweep:
+                return
+            self._next_sweep = now + self.sweep_interval
+        expired = self.store.expire(now - self.expire_after)
+        with self._lock:
+            self.stats.expirations += expired
+
+    def _evict(self):
+        # Only drops conversations from memory, since the store has their latest state
+        now = self.clock()
+        evicted = []
+        for id, (conversation, _, last_used) in self._cached.items():
+            excess = self.max_live is not None and len(self._cached) - len(evicted) > self.max_live
+            idle = self.idle_ttl is not None and now - last_used > self.idle_ttl
+            if not excess and not idle:
+                # The rest have been used more recently
+                break
+            if not conversation.lock.locked():
+                evicted.append(id)
+        for id in evicted:
+            self._cached.pop(id)[0].hibernated = True
+            self.stats.evictions += 1
+        self.store.forget(evicted)
+
+    def __len__(self):
+        """The number of conversations kept in memory by this worker"""
+        return len(self._cached)
+
+    @property
+    def hibernated_count(self) -> int:
+        """The number of stored conversations which are not in memory in this worker"""
+        return max(self.store.count() - len(self._cached), 0)
+
+    def __contains__(self, id: str):
+        return id in self._cached or self.store.version(id) is not None
+
+
+class StatelessRegistry:
+    """
+    Keeps no conversations, for a server whose clients send the state of their conversations with each
+    message (see taskyto.server.state)
+    """
+
+    def __init__(self):
+        self.stats = RegistryStats()
+
+    def add(self, conversation, id: Optional[str] = None) -> str:
+        return id if id is not None else str(uuid.uuid4())
+
+    def acquire(self, id: str):
+        raise KeyError(id)
+
+    def release(self, id: str, conversation, failed: bool = False):
+        conversation.lock.release()
+
+    def __len__(self):
+        return 0
+
+    @property
+    def hibernated_count(self) -> int:
+        return 0
+
+    def __contains__(self, id: str):
+        return False
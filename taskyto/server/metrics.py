@@ -0,0 +1,262 @@
+import bisect
+import threading
+from typing import List, Callable, Dict, Tuple
+
+from taskyto.engine.common.spans import SpanSink, Span
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """
+    A metric family in the Prometheus text format. Updates only hold the lock of the family to change a dict
+    entry, and rendering copies the values under the lock and formats them outside.
+    """
+
+    type = None
+
+    def __init__(self, name: str, help: str, labels: List[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        lines = self.header()
+        for label_values, value in sorted(values):
+            lines.extend(self.samples(label_values, value))
+        return lines
+
+    def samples(self, label_values, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+
+class CollectedMetric(Metric):
+    """
+    A metric whose values are taken from elsewhere when the metrics are rendered, by a function returning
+    {label_values: value}. The type is "gauge" or "counter" (for counters kept by other components).
+    """
+
+    def __init__(self, name: str, help: str, type: str, function: Callable[[], Dict[tuple, float]],
+                 labels: List[str] = ()):
+        super().__init__(name, help, labels)
+        self.type = type
+        self.function = function
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for label_values, value in sorted(self.function().items()):
+            lines.extend(self.samples(label_values, value))
+        return lines
+
+
+class Histogram(Metric):
+    """Counts the observations per bucket (not cumulatively, the buckets are accumulated when rendered)"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: List[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = [(label_values, (list(counts), total, count))
+                      for label_values, (counts, total, count) in self._values.items()]
+        lines = self.header()
+        for label_values, value in sorted(values):
+            lines.extend(self.samples(label_values, value))
+        return lines
+
+    def samples(self, label_values, value) -> List[str]:
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}")
+        labels = _format_labels(self.labels, label_values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class ServerMetrics(SpanSink):
+    """
+    The metrics of a chatbot server, in the Prometheus text format. The latencies of the turns, the LLM calls
+    and the errors of the engine are taken from the spans (see taskyto.engine.common.spans), so this is a sink
+    which must be added to the tracer of the configuration.
+    """
+
+    names = ("turn", "llm")
+
+    def __init__(self, configuration, conversations=None):
+        self.configuration = configuration
+        self.registry = MetricsRegistry()
+        self.turn_duration = self.registry.register(
+            Histogram("taskyto_turn_duration_seconds", "Time to answer a user message", ["module"]))
+        self.llm_calls = self.registry.register(
+            Counter("taskyto_llm_calls_total", "Calls to the LLM", ["model", "module"]))
+        self.llm_duration = self.registry.register(
+            Histogram("taskyto_llm_call_duration_seconds", "Duration of the calls to the LLM", ["model"]))
+        self.llm_tokens = self.registry.register(
+            Counter("taskyto_llm_tokens_total", "Tokens sent to and received from the LLM", ["model", "kind"]))
+        self.errors = self.registry.register(
+            Counter("taskyto_errors_total", "Errors, by type of exception", ["type"]))
+        if conversations is not None:
+            self._register_conversation_metrics(conversations)
+        self.registry.register(
+            CollectedMetric("taskyto_llm_cache_hits_total", "Completions taken from the cache", "counter",
+                            lambda: self._cache_values(lambda stats: {"memory": stats.memory_hits,
+                                                                      "disk": stats.disk_hits}),
+                            ["cache", "tier"]))
+        self.registry.register(
+            CollectedMetric("taskyto_llm_cache_misses_total", "Completions not found in the cache", "counter",
+                            lambda: self._cache_values(lambda stats: {"": stats.misses}), ["cache"]))
+        self.registry.register(
+            CollectedMetric("taskyto_llm_cache_hit_ratio", "Fraction of the requests answered by the cache",
+                            "gauge", lambda: self._cache_values(lambda stats: {"": stats.hit_rate}), ["cache"]))
+
+    def _register_conversation_metrics(self, conversations):
+        """Metrics of a ConversationRegistry (see taskyto.server.conversations)"""
+        stats = conversations.stats
+        self.registry.register(
+            CollectedMetric("taskyto_active_conversations", "Conversations kept in memory by the server", "gauge",
+                            lambda: {(): len(conversations)}))
+        self.registry.register(
+            CollectedMetric("taskyto_hibernated_conversations", "Conversations hibernated on disk", "gauge",
+                            lambda: {(): conversations.hibernated_count}))
+        self.registry.register(
+            CollectedMetric("taskyto_conversation_hibernations_total", "Conversations moved from memory to disk",
+                            "counter", lambda: {(): stats.hibernations}))
+        self.registry.register(
+            CollectedMetric("taskyto_conversation_rehydrations_total", "Conversations restored from disk",
+                            "counter", lambda: {(): stats.rehydrations}))
+        self.registry.register(
+            CollectedMetric("taskyto_conversations_removed_total", "Conversations removed, by reason", "counter",
+                            lambda: {("evicted",): stats.evictions, ("expired",): stats.expirations}, ["reason"]))
+
+    def _cache_values(self, values_of) -> dict:
+        model = getattr(self.configuration, "model", None)
+        cache_stats = getattr(model, "cache_stats", {})
+        values = {}
+        for cache, stats in cache_stats.items():
+            for tier, value in values_of(stats).items():
+                values[(cache, tier) if tier else (cache,)] = value
+        return values
+
+    def emit(self, span: Span):
+        attributes = span.attributes
+        if span.name == "turn":
+            self.turn_duration.observe(span.duration, attributes.get("module") or "")
+            if "error" in attributes:
+                self.errors.inc(attributes["error"])
+        elif span.name == "llm":
+            model = attributes.get("model") or ""
+            self.llm_calls.inc(model, attributes.get("module") or "")
+            self.llm_duration.observe(span.duration, model)
+            self.llm_tokens.inc(model, "prompt", amount=attributes.get("prompt_tokens", 0))
+            self.llm_tokens.inc(model, "completion", amount=attributes.get("completion_tokens", 0))
+
+    def record_error(self, error: BaseException):
+        """Errors of the server which do not happen while running the engine (e.g., a bad request)"""
+        self.errors.inc(type(error).__name__)
+
+    def render(self) -> str:
+        return self.registry.render()
+
+
+def merge_metrics(rendered: Dict[str, str], label: str) -> str:
+    """
+    Merges the metrics rendered by several processes (e.g., the workers of a WorkerPool) into one exposition,
+    telling apart their samples with a label. rendered maps the value of the label to the metrics of a process.
+    """
+    families = {}
+    """Family name -> [header lines, sample lines], in the order in which they are found"""
+    for value, text in rendered.items():
+        extra = f'{label}="{_escape(value)}"'
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# "):
+                parts = line.split(" ", 3)
+                if len(parts) < 3:
+                    continue
+                family = families.get(parts[2])
+                if family is None:
+                    family = families[parts[2]] = [[], []]
+                if len(family[0]) < 2 and line not in family[0]:
+                    family[0].append(line)
+            elif line and family is not None:
+                name, sample_value = line.rsplit(" ", 1)
+                if name.endswith("}"):
+                    name = f"{name[:-1]},{extra}}}"
+                else:
+                    name = f"{name}{{{extra}}}"
+                family[1].append(f"{name} {sample_value}")
+    lines = []
+    for header, samples in families.values():
+        lines.extend(header)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
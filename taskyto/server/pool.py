@@ -0,0 +1,381 @@
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Dict, List
+
+from flask import Flask, Response, jsonify, request
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+from taskyto.engine.common.configuration import SessionConfiguration
+from taskyto.server.metrics import merge_metrics
+
+logger = logging.getLogger(__name__)
+
+WORKER_THREADS = 32
+"""Requests processed at once by each worker (as the request threads of a single process server)"""
+
+
+def shard(id: str, workers: int) -> int:
+    """The worker which serves a conversation. It must be the same in every process, so hash() is not used."""
+    digest = hashlib.blake2b(id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % workers
+
+
+class ShardIds:
+    """Generates conversation ids which belong to the shard of a worker"""
+
+    def __init__(self, index: int, workers: int):
+        self.index = index
+        self.workers = workers
+
+    def __call__(self) -> str:
+        # Each attempt hits the shard with probability 1/workers
+        while True:
+            id = str(uuid.uuid4())
+            if shard(id, self.workers) == self.index:
+                return id
+
+
+def worker_sessions(sessions: Optional[SessionConfiguration], index: int) -> Optional[SessionConfiguration]:
+    """Each worker hibernates its conversations in its own folder, so that they are found when it restarts"""
+    if sessions is None or sessions.hibernation_folder is None:
+        return sessions
+    folder = os.path.join(sessions.hibernation_folder, f"worker-{index}")
+    return sessions.model_copy(update={"hibernation_folder": folder})
+
+
+def rebalance_hibernated(folder: str, workers: int) -> int:
+    """
+    Moves the hibernated conversations to the folder of the worker which serves them, e.g., when the server is
+    restarted with a different number of workers, or after running as a single process. Returns the number of
+    conversations moved.
+    """
+    for index in range(workers):
+        os.makedirs(os.path.join(folder, f"worker-{index}"), exist_ok=True)
+    folders = [folder] + [entry.path for entry in os.scandir(folder)
+                          if entry.is_dir() and entry.name.startswith("worker-")]
+    moved = 0
+    for source in folders:
+        for entry in os.scandir(source):
+            if not entry.is_file() or not entry.name.endswith(".json"):
+                continue
+            id = entry.name[:-len(".json")]
+            target = os.path.join(folder, f"worker-{shard(id, workers)}", entry.name)
+            if entry.path != target:
+                # os.replace keeps the modification time, which is the last time the conversation was used
+                os.replace(entry.path, target)
+                moved += 1
+    return moved
+
+
+def _run_worker(index: int, workers: int, new_configuration: Callable, sessions, metrics: bool, connection):
+    """Main loop of a worker process: a FlaskChatbotApp which receives the requests through a pipe"""
+    from taskyto.server import FlaskChatbotApp
+
+    chatbot_app = FlaskChatbotApp(new_configuration(), metrics=metrics, sessions=worker_sessions(sessions, index),
+                                  conversation_ids=ShardIds(index, workers))
+    send_lock = threading.Lock()
+
+    def send(*message):
+        with send_lock:
+            connection.send(message)
+
+    def handle(request_id, method, path, body, headers):
+        try:
+            environ = EnvironBuilder(path=path, method=method, data=body, headers=headers).get_environ()
+            app_iter, status, response_headers = run_wsgi_app(chatbot_app.app.wsgi_app, environ, buffered=False)
+            send(request_id, "start", (int(status.split(" ", 1)[0]), list(response_headers.items())))
+            try:
+                for data in app_iter:
+                    if data:
+                        send(request_id, "data", data)
+            finally:
+                if hasattr(app_iter, "close"):
+                    app_iter.close()
+            send(request_id, "end", None)
+        except Exception as e:
+            traceback.print_exc()
+            send(request_id, "error", f"Error in worker {index}: {str(e)}")
+
+    send(None, "ready", os.getpid())
+    with ThreadPoolExecutor(max_workers=WORKER_THREADS) as executor:
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, OSError):
+                # The front process has stopped
+                return
+            if message is None:
+                return
+            executor.submit(handle, *message)
+
+
+class _Worker:
+    """The state of a worker process in the front process"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.connection = None
+        self.ready = threading.Event()
+        self.pending: Dict[int, queue.Queue] = {}
+        """Request id -> queue receiving the messages of its response"""
+        self.lock = threading.Lock()
+        """Protects the connection and pending"""
+
+
+class WorkerError(Exception):
+    """A request could not be processed because its worker is not running"""
+
+
+class WorkerPool:
+    """
+    A fixed number of processes, each one running its own engines, which serve the conversations of a server.
+    Each conversation belongs to a worker (see shard) and its messages are forwarded to that worker through a
+    pipe, so the conversations never leave their process and several of them can use the CPU at once.
+
+    A worker which stops (e.g., it crashes) is restarted after restart_delay seconds. The requests which it was
+    processing fail, and the conversations which it had in memory are lost, unless they are hibernated (see
+    SessionConfiguration) or kept in a shared store. Requests for its conversations wait for it to be running.
+    """
+
+    def __init__(self, new_configuration: Callable, workers: int, sessions: Optional[SessionConfiguration] = None,
+                 restart_delay: float = 1.0, start_timeout: float = 120.0, metrics: bool = False):
+        """new_configuration is called in each worker to build its configuration, so it must be picklable"""
+        if workers < 1:
+            raise ValueError("A worker pool needs at least one worker")
+        self.new_configuration = new_configuration
+        self.sessions = sessions
+        self.metrics = metrics
+        """Whether the workers measure their requests (see FlaskChatbotApp)"""
+        self.restart_delay = restart_delay
+        self.start_timeout = start_timeout
+        self.restarts = 0
+        self.workers = [_Worker(i) for i in range(workers)]
+        self._context = multiprocessing.get_context("spawn")
+        self._request_ids = itertools.count()
+        self._next_worker = itertools.count()
+        self._stopped = False
+
+    def start(self):
+        if self.sessions is not None and self.sessions.hibernation_folder is not None:
+            rebalance_hibernated(self.sessions.hibernation_folder, len(self.workers))
+        for worker in self.workers:
+            self._start_worker(worker)
+        for worker in self.workers:
+            if not worker.ready.wait(self.start_timeout):
+                raise WorkerError(f"Worker {worker.index} did not start")
+
+    def stop(self):
+        self._stopped = True
+        for worker in self.workers:
+            with worker.lock:
+                if worker.connection is not None:
+                    try:
+                        worker.connection.send(None)
+                    except (OSError, ValueError):
+                        pass
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.kill()
+
+    def _start_worker(self, worker: _Worker):
+        front, back = self._context.Pipe()
+        process = self._context.Process(target=_run_worker, daemon=True, name=f"taskyto-worker-{worker.index}",
+                                        args=(worker.index, len(self.workers), self.new_configuration,
+                                              self.sessions, self.metrics, back))
+        process.start()
+        back.close()
+        with worker.lock:
+            worker.process = process
+            worker.connection = front
+        threading.Thread(target=self._receive, args=(worker, front), daemon=True).start()
+
+    def _receive(self, worker: _Worker, connection):
+        # Routes the responses of a worker to the requests waiting for them, until the worker stops
+        while True:
+            try:
+                request_id, kind, payload = connection.recv()
+            except (EOFError, OSError):
+                break
+            if kind == "ready":
+                worker.ready.set()
+                continue
+            with worker.lock:
+                replies = worker.pending.get(request_id)
+            if replies is not None:
+                replies.put((kind, payload))
+
+        with worker.lock:
+            worker.ready.clear()
+            pending, worker.pending = worker.pending, {}
+            worker.connection = None
+        connection.close()
+        for replies in pending.values():
+            replies.put(("error", f"Worker {worker.index} stopped"))
+        if self._stopped:
+            return
+
+        worker.process.join(timeout=5)
+        logger.warning("Worker %d stopped (exit code %s), restarting it", worker.index, worker.process.exitcode)
+        self.restarts += 1
+        time.sleep(self.restart_delay)
+        if not self._stopped:
+            self._start_worker(worker)
+
+    def worker_of(self, id: str) -> int:
+        return shard(id, len(self.workers))
+
+    def next_worker(self) -> int:
+        """A worker for a new conversation, in turns"""
+        return next(self._next_worker) % len(self.workers)
+
+    def forward(self, index: int, method: str, path: str, body: bytes = b"",
+                headers: Optional[List] = None) -> "queue.Queue":
+        """
+        Sends a request to a worker, and returns the queue which receives the messages of its response:
+        ("start", (status, headers)), ("data", bytes) for each part of the body and ("end", None), or
+        ("error", message) if the worker fails. Raises WorkerError if the worker is not running.
+        """
+        worker = self.workers[index]
+        if not worker.ready.wait(self.start_timeout):
+            raise WorkerError(f"Worker {index} is not running")
+        request_id = next(self._request_ids)
+        replies = queue.Queue()
+        with worker.lock:
+            if worker.connection is None:
+                raise WorkerError(f"Worker {index} is not running")
+            worker.pending[request_id] = replies
+            try:
+                worker.connection.send((request_id, method, path, body, headers or []))
+            except (OSError, ValueError) as e:
+                del worker.pending[request_id]
+                raise WorkerError(f"Worker {index} is not running: {str(e)}")
+        return _Replies(worker, request_id, replies)
+
+    def request(self, index: int, method: str, path: str, body: bytes = b"", headers: Optional[List] = None):
+        """Sends a request to a worker and waits for the whole response. Returns the status and the body."""
+        replies = self.forward(index, method, path, body, headers)
+        status, chunks = None, []
+        for kind, payload in replies:
+            if kind == "start":
+                status = payload[0]
+            elif kind == "data":
+                chunks.append(payload)
+            else:
+                raise WorkerError(payload)
+        return status, b"".join(chunks)
+
+
+class _Replies:
+    """Iterates the messages of a response until it ends, and then stops waiting for it"""
+
+    def __init__(self, worker: _Worker, request_id: int, replies: queue.Queue):
+        self.worker = worker
+        self.request_id = request_id
+        self.replies = replies
+
+    def __iter__(self):
+        try:
+            while True:
+                kind, payload = self.replies.get()
+                if kind == "end":
+                    return
+                yield kind, payload
+                if kind == "error":
+                    return
+        finally:
+            with self.worker.lock:
+                self.worker.pending.pop(self.request_id, None)
+
+
+class PooledChatbotApp:
+    """
+    The HTTP front of a WorkerPool, with the same API as FlaskChatbotApp. It keeps no conversations: each
+    request is forwarded to the worker of its conversation, and new conversations are created in turns.
+    """
+
+    def __init__(self, pool: WorkerPool, app: Flask = None):
+        if app is None:
+            app = Flask(__name__)
+        self.pool = pool
+        self.app = app
+
+        @app.post("/conversation/new")
+        def init_conversation():
+            return _forward(self.pool.next_worker())
+
+        @app.post('/conversation/user_message')
+        def user_message():
+            body = request.get_json(silent=True)
+            if not body or 'id' not in body or 'message' not in body:
+                return jsonify({"error": "Missing 'id' or 'message' in request"}), 400
+            return _forward(self.pool.worker_of(str(body['id'])))
+
+        @app.get("/metrics")
+        def get_metrics():
+            rendered = {}
+            for index in range(len(self.pool.workers)):
+                try:
+                    status, body = self.pool.request(index, "GET", "/metrics")
+                except WorkerError:
+                    continue
+                if status == 200:
+                    rendered[str(index)] = body.decode("utf-8")
+            if not rendered:
+                return jsonify({"error": "Metrics are disabled"}), 404
+            text = merge_metrics(rendered, "worker")
+            text += ("# HELP taskyto_worker_restarts_total Worker processes restarted after stopping\n"
+                     "# TYPE taskyto_worker_restarts_total counter\n"
+                     f"taskyto_worker_restarts_total {self.pool.restarts}\n")
+            return Response(text, mimetype="text/plain; version=0.0.4")
+
+        def _forward(index: int):
+            headers = [(name, value) for name, value in request.headers.items()
+                       if name.lower() in ("content-type", "accept")]
+            try:
+                replies = iter(self.pool.forward(index, request.method, request.path, request.get_data(), headers))
+                kind, payload = next(replies)
+            except WorkerError as e:
+                return jsonify({"error": str(e)}), 503
+            if kind != "start":
+                return jsonify({"error": payload}), 503
+
+            status, response_headers = payload
+            mimetype = dict((name.lower(), value) for name, value in response_headers).get("content-type")
+            if mimetype is not None and mimetype.startswith("text/event-stream"):
+                # Server-Sent Events are relayed as they arrive from the worker
+                def relay():
+                    for kind, payload in replies:
+                        if kind != "data":
+                            if kind == "error":
+                                yield f"event: error\ndata: {json.dumps({'error': payload})}\n\n".encode("utf-8")
+                            return
+                        yield payload
+
+                return Response(relay(), status=status, headers=response_headers)
+
+            chunks = []
+            for kind, payload in replies:
+                if kind == "error":
+                    return jsonify({"error": payload}), 503
+                chunks.append(payload)
+            return Response(b"".join(chunks), status=status, headers=response_headers)
+
+    def run(self):
+        self.pool.start()
+        try:
+            self.app.run(threaded=True)
+        finally:
+            self.pool.stop()
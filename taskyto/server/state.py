@@ -0,0 +1,90 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import zlib
+from typing import Optional
+
+from taskyto.engine.custom.snapshot import dumps, loads, trim_snapshot
+
+STATE_FORMAT = 1
+MAC_SIZE = 32
+MAX_DECOMPRESSED = 16 * 1024 * 1024
+
+
+class InvalidState(Exception):
+    """The state sent by a client was not produced by a server with the same secret, or it was modified"""
+
+
+class StateTooLarge(Exception):
+    pass
+
+
+class StateCodec:
+    """
+    Encodes the state of a conversation (its snapshot, see taskyto.engine.custom.snapshot) into a blob which is
+    kept by the client and sent back with each message, so that the server keeps nothing in memory. The blob is
+    the URL-safe base64 of a format byte, an HMAC-SHA256 of the rest with the secret of the server, and the
+    compressed snapshot.
+
+    Blobs are limited to max_size characters. The memories are trimmed to their last_turns (as MemoryPolicy), and
+    if the blob is still too large, to half the turns each time until it fits.
+    """
+
+    def __init__(self, secret: bytes, max_size: int = 32768, last_turns: Optional[int] = 10,
+                 pinned=("data", "instruction"), level: int = 6):
+        if not secret:
+            raise ValueError("The state of the conversations needs a secret to be signed")
+        self.secret = secret
+        self.max_size = max_size
+        self.last_turns = last_turns
+        self.pinned = tuple(pinned)
+        self.level = level
+
+    def encode(self, id: str, snapshot: dict) -> str:
+        last_turns = self.last_turns
+        while True:
+            if last_turns is not None:
+                snapshot = trim_snapshot(snapshot, last_turns, self.pinned)
+            blob = self._seal(dumps({"id": id, "snapshot": snapshot}).encode("utf-8"))
+            if len(blob) <= self.max_size:
+                return blob
+            if last_turns == 0:
+                raise StateTooLarge(f"The state of conversation {id} takes {len(blob)} bytes, "
+                                    f"the limit is {self.max_size}")
+            if last_turns is None:
+                last_turns = sum(1 for m in snapshot["messages"] if m["type"] == "human")
+            last_turns //= 2
+
+    def decode(self, id: str, blob: str) -> dict:
+        """The snapshot of the conversation with the given id. Raises InvalidState or StateTooLarge."""
+        if len(blob) > self.max_size:
+            raise StateTooLarge(f"The state takes {len(blob)} bytes, the limit is {self.max_size}")
+        try:
+            raw = base64.urlsafe_b64decode(blob.encode("ascii"))
+        except (binascii.Error, ValueError, UnicodeEncodeError):
+            raise InvalidState("The state is not valid base64")
+        if len(raw) <= 1 + MAC_SIZE or raw[0] != STATE_FORMAT:
+            raise InvalidState("Unknown state format")
+
+        mac, payload = raw[1:1 + MAC_SIZE], raw[1 + MAC_SIZE:]
+        if not hmac.compare_digest(mac, self._mac(payload)):
+            raise InvalidState("The signature of the state is not valid")
+
+        decompressor = zlib.decompressobj()
+        serialized = decompressor.decompress(payload, MAX_DECOMPRESSED)
+        if decompressor.unconsumed_tail:
+            raise StateTooLarge("The state is too large once decompressed")
+        state = loads(serialized.decode("utf-8"))
+        if state["id"] != id:
+            raise InvalidState("The state belongs to another conversation")
+        return state["snapshot"]
+
+    def _seal(self, serialized: bytes) -> str:
+        payload = zlib.compress(serialized, self.level)
+        raw = bytes([STATE_FORMAT]) + self._mac(payload) + payload
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    def _mac(self, payload: bytes) -> bytes:
+        # The format byte is signed too
+        return hmac.new(self.secret, bytes([STATE_FORMAT]) + payload, hashlib.sha256).digest()
@@ -0,0 +1,205 @@
+import abc
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple, Dict, List, Callable
+
+from taskyto.engine.custom.snapshot import dumps, loads
+
+MESSAGES_PER_SEGMENT = 32
+
+
+class VersionConflict(Exception):
+    """The conversation was changed by someone else (e.g., another worker) since it was loaded"""
+
+
+class ConversationStore(abc.ABC):
+    """
+    Snapshots of conversations (see taskyto.engine.custom.snapshot) shared by several processes. Each stored
+    conversation has a version, which increases with each save. Saves are optimistic: they fail with
+    VersionConflict if the conversation is no longer at the version which was loaded.
+    """
+
+    @abc.abstractmethod
+    def create(self, id: str, snapshot: dict) -> int:
+        """Stores a new conversation and returns its version"""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def load(self, id: str) -> Tuple[int, dict]:
+        """Returns the version and the snapshot of a conversation. Raises KeyError if it is not stored."""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def version(self, id: str) -> Optional[int]:
+        """The current version of a conversation, or None if it is not stored"""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def save(self, id: str, snapshot: dict, version: int) -> int:
+        """Replaces the snapshot of a conversation at the given version and returns the new version"""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def delete(self, id: str):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def expire(self, before: float) -> int:
+        """Removes the conversations which have not been saved since the given time, and returns how many"""
+        raise NotImplementedError()
+
+    def forget(self, ids: List[str]):
+        """Called when the given conversations are no longer kept in memory by this process"""
+        pass
+
+    @abc.abstractmethod
+    def count(self) -> int:
+        raise NotImplementedError()
+
+
+def _segments(snapshot: dict) -> Dict[str, str]:
+    # The messages are split in segments of consecutive messages. Since messages are mostly appended, saving a
+    # conversation usually changes the last segment and the header (the rest of the snapshot).
+    header = {key: value for key, value in snapshot.items() if key != "messages"}
+    messages = snapshot["messages"]
+    segments = {"header": dumps(header)}
+    for i in range(0, len(messages), MESSAGES_PER_SEGMENT):
+        segments[f"messages:{i // MESSAGES_PER_SEGMENT:06d}"] = dumps(messages[i:i + MESSAGES_PER_SEGMENT])
+    return segments
+
+
+def _digest(content: str) -> bytes:
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    A ConversationStore in a SQLite file in WAL mode, which can be shared by the worker processes of a server
+    in the same machine. Snapshots are stored in segments, and a save only writes the segments which changed
+    since the conversation was loaded or saved by this process.
+    """
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.clock = clock
+        self._local = threading.local()
+        self._digests = {}
+        """Conversation id -> (version, {segment key: digest}) of what this process last read or wrote"""
+        self._digests_lock = threading.Lock()
+        connection = self.connection
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS conversations ("
+                           "id TEXT PRIMARY KEY, version INTEGER NOT NULL, updated REAL NOT NULL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS conversation_segments ("
+                           "id TEXT NOT NULL, key TEXT NOT NULL, content TEXT NOT NULL, PRIMARY KEY (id, key))")
+        connection.execute("CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated)")
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # SQLite connections cannot be shared by threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def create(self, id: str, snapshot: dict) -> int:
+        segments = _segments(snapshot)
+        connection = self.connection
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("INSERT INTO conversations (id, version, updated) VALUES (?, 1, ?)", (id, self.clock()))
+            connection.executemany("INSERT INTO conversation_segments (id, key, content) VALUES (?, ?, ?)",
+                                   [(id, key, content) for key, content in segments.items()])
+        self._remember(id, 1, segments)
+        return 1
+
+    def load(self, id: str) -> Tuple[int, dict]:
+        connection = self.connection
+        with connection:
+            # A read transaction, so that the version and the segments are consistent
+            connection.execute("BEGIN")
+            row = connection.execute("SELECT version FROM conversations WHERE id = ?", (id,)).fetchone()
+            if row is None:
+                raise KeyError(id)
+            segments = dict(connection.execute(
+                "SELECT key, content FROM conversation_segments WHERE id = ? ORDER BY key", (id,)).fetchall())
+        version = row[0]
+        self._remember(id, version, segments)
+
+        snapshot = loads(segments.pop("header"))
+        messages = []
+        for key in sorted(segments):
+            messages.extend(loads(segments[key]))
+        snapshot["messages"] = messages
+        return version, snapshot
+
+    def version(self, id: str) -> Optional[int]:
+        row = self.connection.execute("SELECT version FROM conversations WHERE id = ?", (id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def save(self, id: str, snapshot: dict, version: int) -> int:
+        segments = _segments(snapshot)
+        digests = {key: _digest(content) for key, content in segments.items()}
+        with self._digests_lock:
+            known_version, known = self._digests.get(id, (None, {}))
+        if known_version != version:
+            # What is stored is not known, so everything is written
+            known = {}
+
+        changed = [(id, key, segments[key]) for key, digest in digests.items() if known.get(key) != digest]
+        removed = [(id, key) for key in known if key not in digests]
+
+        connection = self.connection
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            cursor = connection.execute("UPDATE conversations SET version = version + 1, updated = ? "
+                                        "WHERE id = ? AND version = ?", (self.clock(), id, version))
+            if cursor.rowcount == 0:
+                connection.execute("ROLLBACK")
+                raise VersionConflict(f"Conversation {id} is no longer at version {version}")
+            connection.executemany("INSERT OR REPLACE INTO conversation_segments (id, key, content) VALUES (?, ?, ?)",
+                                   changed)
+            if not known:
+                connection.execute(f"DELETE FROM conversation_segments WHERE id = ? AND key NOT IN "
+                                   f"({','.join('?' * len(segments))})", (id, *segments))
+            else:
+                connection.executemany("DELETE FROM conversation_segments WHERE id = ? AND key = ?", removed)
+
+        with self._digests_lock:
+            self._digests[id] = (version + 1, digests)
+        return version + 1
+
+    def _remember(self, id: str, version: int, segments: Dict[str, str]):
+        digests = {key: _digest(content) for key, content in segments.items()}
+        with self._digests_lock:
+            self._digests[id] = (version, digests)
+
+    def forget(self, ids: List[str]):
+        with self._digests_lock:
+            for id in ids:
+                self._digests.pop(id, None)
+
+    def delete(self, id: str):
+        connection = self.connection
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM conversations WHERE id = ?", (id,))
+            connection.execute("DELETE FROM conversation_segments WHERE id = ?", (id,))
+        self.forget([id])
+
+    def expire(self, before: float) -> int:
+        connection = self.connection
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            ids = [row[0] for row in connection.execute("SELECT id FROM conversations WHERE updated < ?", (before,))]
+            connection.executemany("DELETE FROM conversations WHERE id = ?", [(id,) for id in ids])
+            connection.executemany("DELETE FROM conversation_segments WHERE id = ?", [(id,) for id in ids])
+        self.forget(ids)
+        return len(ids)
+
+    def count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
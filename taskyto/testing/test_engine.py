@@ -15,6 +15,12 @@ class TestChannel(Channel):
     def output(self, msg, who=None):
         self.last_response = ChatbotResult(msg, DebugInfo(who))
 
+    def thinking(self, text: str):
+        pass
+
+    def stop_thinking(self):
+        pass
+
 class ChatbotResult:
     def __init__(self, chatbot_msg: str, debug_info: DebugInfo):
         self.chatbot_msg = chatbot_msg
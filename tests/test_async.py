@@ -0,0 +1,47 @@
+import asyncio
+
+from test_utils import MockedLLM, TestConfiguration
+from taskyto.testing.test_engine import TestChannel
+
+
+def new_configuration():
+    mock = MockedLLM()
+    mock.ai_answer(input="Hi", output="Welcome to my bike shop", prefix="New input:")
+    mock.module_activation(input="I need a repair", module="make_appointment", query="{'service': 'repair'}")
+    mock.ai_answer(input="Check in the previous conversation history, and if the data is not present, ask the Human to provide the missing data: date, time, service",
+                   output="Tell me the data!",
+                   prefix="Instruction:")
+    return TestConfiguration("examples/yaml/bike-shop", mock)
+
+
+def test_async_conversation():
+    configuration = new_configuration()
+    engine, channel = configuration.new_engine(), TestChannel()
+
+    async def converse():
+        await engine.astart(channel)
+        await engine.aexecute_with_input("I need a repair")
+
+    asyncio.run(converse())
+
+    assert channel.last_response.chatbot_msg == "Tell me the data!"
+    assert engine.execution_state.current.module.name == "make_appointment"
+
+
+def test_concurrent_async_conversations():
+    configuration = new_configuration()
+    conversations = [(configuration.new_engine(), TestChannel()) for _ in range(10)]
+
+    async def converse(engine, channel, message):
+        await engine.astart(channel)
+        await engine.aexecute_with_input(message)
+
+    async def run_all():
+        await asyncio.gather(*[converse(engine, channel, "Hi" if i % 2 == 0 else "I need a repair")
+                               for i, (engine, channel) in enumerate(conversations)])
+
+    asyncio.run(run_all())
+
+    for i, (engine, channel) in enumerate(conversations):
+        expected = "Welcome to my bike shop" if i % 2 == 0 else "Tell me the data!"
+        assert channel.last_response.chatbot_msg == expected
@@ -1,4 +1,5 @@
 from taskyto.engine.common import replace_values
+from taskyto.engine.common.template import compile_template
 
 
 def test_replace_values():
@@ -6,4 +7,21 @@ def test_replace_values():
     assert replace_values("{test}", {"test": "a test value"}) == "a test value"
 
     multiline = "This is a {{test}}\nAnd this is a {test}"
-    assert replace_values(multiline, {"test": "test value"}) == "This is a test value\nAnd this is a test value"
\ No newline at end of file
+    assert replace_values(multiline, {"test": "test value"}) == "This is a test value\nAnd this is a test value"
+
+def test_replace_expressions():
+    assert replace_values("Total: {price:.2f}$", {"price": 10}) == "Total: 10.00$"
+    assert replace_values("{len(items)} items", {"items": ["a", "b"]}) == "2 items"
+    assert replace_values("{{unknown}} and {{x}}", {"x": 1}) == "{unknown} and 1"
+    assert replace_values("Say \"{x}\"", {"x": "hi"}) == "Say \"hi\""
+
+
+def test_replace_values_does_not_interpret_data():
+    data = {"name": "{other}", "other": "x"}
+    assert replace_values("Hello {name}", data) == "Hello {other}"
+    assert "__builtins__" not in data
+
+
+def test_templates_are_compiled_once():
+    assert compile_template("Hello {name}") is compile_template("Hello {name}")
+    assert compile_template("Hello {name}").render({"name": "Bob"}) == "Hello Bob"
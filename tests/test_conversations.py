@@ -0,0 +1,155 @@
+import threading
+
+import pytest
+
+from taskyto.server.conversations import ConversationRegistry, HibernationStore, SharedConversationRegistry
+from taskyto.server.store import SQLiteConversationStore, VersionConflict
+
+
+class FakeConversation:
+    def __init__(self, state: str):
+        self.state = state
+        self.lock = threading.Lock()
+        self.hibernated = False
+
+    def snapshot(self):
+        return self.state
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def new_registry(tmp_path, clock, **limits):
+    return ConversationRegistry(store=HibernationStore(str(tmp_path)), restore=FakeConversation, clock=clock,
+                                sweep_interval=0, **limits)
+
+
+def test_least_recently_used_conversations_are_hibernated(tmp_path):
+    clock = Clock()
+    registry = new_registry(tmp_path, clock, max_live=2)
+    first, second = registry.add(FakeConversation("first")), registry.add(FakeConversation("second"))
+    registry.get(first)
+    third = registry.add(FakeConversation("third"))
+
+    assert len(registry) == 2 and registry.hibernated_count == 1
+    assert (tmp_path / f"{second}.json").read_text() == '"second"'
+
+    conversation = registry.acquire(second)
+    assert conversation.state == "second" and not conversation.hibernated
+    conversation.lock.release()
+    assert registry.stats.rehydrations == 1 and not (tmp_path / f"{second}.json").exists()
+    assert {first, second, third} == {id for id in [first, second, third] if id in registry}
+
+    # A new registry finds the hibernated conversations, e.g., after a restart
+    assert new_registry(tmp_path, clock).hibernated_count == registry.hibernated_count
+
+
+def test_idle_conversations_are_hibernated_and_then_expire(tmp_path):
+    clock = Clock()
+    registry = new_registry(tmp_path, clock, idle_ttl=10, expire_after=100)
+    idle, busy = registry.add(FakeConversation("idle")), registry.add(FakeConversation("busy"))
+    registry.acquire(busy)
+
+    clock.now += 20
+    registry.add(FakeConversation("new"))
+    assert registry.stats.hibernations == 1 and idle not in registry._live
+    # Conversations processing a message are kept in memory
+    assert busy in registry._live
+
+    clock.now += 200
+    registry.add(FakeConversation("new"))
+    assert registry.stats.expirations == 2 and list(tmp_path.iterdir()) == []
+    with pytest.raises(KeyError):
+        registry.get(idle)
+
+
+def test_hibernation_does_not_block_the_other_conversations(tmp_path):
+    class SlowStore(HibernationStore):
+        def __init__(self, folder):
+            super().__init__(folder)
+            self.saving, self.proceed = threading.Event(), threading.Event()
+
+        def save(self, id, snapshot, last_used):
+            self.saving.set()
+            assert self.proceed.wait(5)
+            super().save(id, snapshot, last_used)
+
+    store = SlowStore(str(tmp_path))
+    registry = ConversationRegistry(max_live=1, store=store, restore=FakeConversation)
+    first = registry.add(FakeConversation("first"))
+    adding = threading.Thread(target=registry.add, args=(FakeConversation("second"),), kwargs={"id": "second"})
+    adding.start()
+    assert store.saving.wait(5)
+
+    # The first conversation is being written while the second one is used
+    assert registry.get("second").state == "second" and first in registry
+    store.proceed.set()
+    adding.join()
+    assert registry.hibernated_count == 1 and registry.acquire(first).state == "first"
+
+
+def test_without_store_conversations_are_evicted():
+    registry = ConversationRegistry(max_live=1)
+    first = registry.add(FakeConversation("first"))
+    registry.add(FakeConversation("second"))
+    assert registry.stats.evictions == 1
+    with pytest.raises(KeyError):
+        registry.acquire(first)
+
+
+def test_workers_share_the_conversations_of_a_store(tmp_path):
+    def new_worker():
+        store = SQLiteConversationStore(str(tmp_path / "conversations.db"))
+        return SharedConversationRegistry(store, restore=FakeConversation)
+
+    first, second = new_worker(), new_worker()
+    id = first.add(FakeConversation({"messages": ["Hi"]}))
+
+    conversation = second.acquire(id)
+    conversation.state["messages"].append("Hello")
+    second.release(id, conversation)
+
+    # The first worker reloads the conversation, since the second one has changed it
+    conversation = first.acquire(id)
+    assert conversation.state["messages"] == ["Hi", "Hello"]
+    assert first.stats.rehydrations == 1
+
+    # A message processed at the same time by the second worker is discarded
+    concurrent = second.acquire(id)
+    concurrent.state["messages"].append("Concurrent")
+    second.release(id, concurrent)
+    conversation.state["messages"].append("Late")
+    with pytest.raises(VersionConflict):
+        first.release(id, conversation)
+    assert first.stats.conflicts == 1 and conversation.hibernated
+
+    conversation = first.acquire(id)
+    assert conversation.state["messages"] == ["Hi", "Hello", "Concurrent"]
+    first.release(id, conversation, failed=True)
+    with pytest.raises(KeyError):
+        first.acquire("unknown")
+
+
+def test_conversations_expire_from_the_store(tmp_path):
+    clock = Clock()
+    store = SQLiteConversationStore(str(tmp_path / "conversations.db"), clock=clock)
+    registry = SharedConversationRegistry(store, restore=FakeConversation, idle_ttl=10, expire_after=100,
+                                          clock=clock, sweep_interval=0)
+    old, recent = registry.add(FakeConversation({"messages": []})), registry.add(FakeConversation({"messages": []}))
+
+    clock.now += 50
+    conversation = registry.acquire(recent)
+    registry.release(recent, conversation)
+    # Idle conversations are only dropped from memory
+    assert len(registry) == 1 and store.count() == 2
+
+    clock.now += 60
+    registry.add(FakeConversation({"messages": []}))
+    assert registry.stats.expirations == 1 and store.count() == 2
+    with pytest.raises(KeyError):
+        registry.acquire(old)
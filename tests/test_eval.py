@@ -1,4 +1,4 @@
-from taskyto.engine.common.evaluator import Evaluator
+from taskyto.engine.common.evaluator import Evaluator, compile_python_inline, load_python_file
 from taskyto.spec import ExecuteElement
 
 evaluator = Evaluator()
@@ -24,3 +24,32 @@ return number + 10"""
 #    r = evaluator.eval_code(ExecuteElement(language="python", code=code), {})
 #    assert isinstance(r, Stay)
 #    assert r.reason == 'Because this is a test'
+
+
+def test_inline_code_is_compiled_once():
+    code = "return number * 2"
+    assert evaluator.eval_code(ExecuteElement(language="python", code=code), {"number": 2}) == 4
+    function = compile_python_inline(code, ("number",))
+    assert evaluator.eval_code(ExecuteElement(language="python", code=code), {"number": 3}) == 6
+    assert compile_python_inline(code, ("number",)) is function
+
+
+def test_file_is_reloaded_when_changed(tmp_path):
+    script = tmp_path / "action.py"
+    script.write_text("def main(a, b):\n    return a + b\n")
+    file_evaluator = Evaluator(load_path=[str(tmp_path)])
+    execute = ExecuteElement(language="python", code="action.py")
+
+    assert file_evaluator.eval_code(execute, {"a": 1, "b": 2}) == 3
+    assert load_python_file(str(script)) is load_python_file(str(script))
+
+    script.write_text("def main(a, b):\n    return a * b * 10\n")
+    assert file_evaluator.eval_code(execute, {"a": 1, "b": 2}) == 20
+
+
+def test_file_globals_are_visible_in_main(tmp_path):
+    script = tmp_path / "action.py"
+    script.write_text("PRICES = {'small': 10}\n\ndef price(size):\n    return PRICES[size]\n\n"
+                      "def main(size):\n    return price(size)\n")
+    file_evaluator = Evaluator(load_path=[str(tmp_path)])
+    assert file_evaluator.eval_code(ExecuteElement(language="python", code="action.py"), {"size": "small"}) == 10
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from taskyto.engine.common.configuration import ConfigurationModel
+from taskyto.engine.common.llm import OpenAILLM
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.dumps({"id": "test", "object": "chat.completion", "created": 0, "model": "test",
+                           "choices": [{"index": 0, "finish_reason": "stop",
+                                        "message": {"role": "assistant", "content": "Hello"}}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture()
+def openai_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CompletionHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("OPENAI_API_KEY", "not-used")
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+    yield server
+    server.shutdown()
+
+
+def test_llms_are_resolved_once(openai_server):
+    config = ConfigurationModel.model_validate({
+        "default_llm": "gpt-4",
+        "modules": [{"name": "other", "llm": "gpt-4o"}, {"name": "same", "llm": "gpt-4"}]
+    })
+    config.resolve_llms(["other", "same"])
+
+    default_llm = config.get_llm_for_module_or_default(None)
+    assert config.get_llm_for_module_or_default("top_level") is default_llm
+    assert config.get_llm_for_module_or_default("same") is default_llm
+
+    other_llm = config.get_llm_for_module_or_default("other")
+    assert isinstance(other_llm, OpenAILLM) and other_llm.model_name == "gpt-4o"
+    assert other_llm.clients is default_llm.clients
+
+
+def test_connections_are_reused(openai_server):
+    config = ConfigurationModel(default_llm="gpt-4")
+
+    for module_name in ["a", "b", "c", None]:
+        assert config.get_llm_for_module_or_default(module_name)("Hi").content == "Hello"
+
+    assert config.connection_stats.requests == 4
+    assert config.connection_stats.new_connections == 1
+    assert config.connection_stats.reused_connections == 3
+
+
+def test_async_clients_belong_to_an_event_loop(openai_server):
+    llm = ConfigurationModel(default_llm="gpt-4").get_llm_for_module_or_default(None)
+
+    async def converse():
+        assert [(await llm.ainvoke("Hi")).content for _ in range(2)] == ["Hello", "Hello"]
+        return llm.clients.async_client
+
+    # Each asyncio.run is a new loop, which cannot use the connections of the previous one
+    first, second = asyncio.run(converse()), asyncio.run(converse())
+    assert first is not second
+    assert llm.clients.stats.requests == 4
@@ -0,0 +1,122 @@
+import asyncio
+from typing import Optional, List
+
+from taskyto.engine.common.configuration import ConfigurationModel
+from taskyto.engine.common.llm import LLM, LLMInput, LLMResponse, Message
+from taskyto.engine.common.llm_cache import LLMCache, CachedLLM
+
+
+class CountingLLM(LLM):
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
+        self.calls += 1
+        return LLMResponse(f"Answer {self.calls}")
+
+
+def test_memory_cache():
+    llm = CountingLLM()
+    cached = CachedLLM(llm, LLMCache(), model_id="gpt-4", temperature=0.0)
+
+    prompt = [Message("You are a chatbot", "system"), Message("Hi", "human")]
+    assert cached(prompt).content == "Answer 1"
+    # The same request, modulo trailing whitespace
+    assert cached([Message("You are a chatbot  ", "system"), Message("Hi\n", "human")]).content == "Answer 1"
+    assert llm.calls == 1
+
+    # Different stop sequences and parameters are different requests
+    assert cached(prompt, stop=["\nObservation:"]).content == "Answer 2"
+    assert CachedLLM(llm, cached.cache, model_id="gpt-4", temperature=0.5)(prompt).content == "Answer 3"
+
+    assert cached.cache.stats.memory_hits == 1
+    assert cached.cache.stats.misses == 3
+
+
+def test_memory_cache_eviction():
+    llm = CountingLLM()
+    cached = CachedLLM(llm, LLMCache(memory_entries=2), model_id="gpt-4", temperature=0.0)
+    for prompt in ["a", "b", "c", "a"]:
+        cached(prompt)
+    assert llm.calls == 4
+    assert cached.cache.stats.evictions == 2
+
+
+def test_disk_cache_is_shared(tmp_path):
+    path = str(tmp_path / "cache.db")
+    llm = CountingLLM()
+    CachedLLM(llm, LLMCache(path=path), model_id="gpt-4", temperature=0.0)("Hi")
+
+    # Another process would open its own cache over the same file
+    other_cache = LLMCache(path=path)
+    assert CachedLLM(llm, other_cache, model_id="gpt-4", temperature=0.0)("Hi").content == "Answer 1"
+    assert llm.calls == 1
+    assert other_cache.stats.disk_hits == 1
+
+
+def test_disk_cache_eviction(tmp_path):
+    cache = LLMCache(path=str(tmp_path / "cache.db"), max_disk_bytes=25)
+    for i in range(5):
+        cache.put(str(i), "0123456789")
+    assert cache.disk.get("0") is None
+    assert cache.disk.get("4") == "0123456789"
+    assert cache.disk.connection.execute("SELECT SUM(size) FROM llm_cache").fetchone()[0] <= 25
+
+
+def test_disk_cache_size_is_kept_across_processes(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache, other_cache = LLMCache(path=path, max_disk_bytes=25), LLMCache(path=path, max_disk_bytes=25)
+    cache.put("a", "0123456789")
+    other_cache.put("b", "0123456789")
+    # Replacing an entry does not count its old size
+    cache.put("a", "01234")
+    assert other_cache.disk.total_size() == 15
+
+    other_cache.put("c", "0123456789abcde")
+    assert cache.disk.get("b") is None
+    assert cache.disk.total_size() == \
+        cache.disk.connection.execute("SELECT SUM(size) FROM llm_cache").fetchone()[0] == 20
+
+
+def test_cache_configuration_per_module(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "not-used")
+    config = ConfigurationModel.model_validate({
+        "default_llm": "gpt-4",
+        "cache": {"memory_entries": 10},
+        "modules": [{"name": "creative", "llm": {"id": "gpt-4", "temperature": 0.9}},
+                    {"name": "no_cache", "cache": False}]
+    })
+
+    assert isinstance(config.get_llm_for_module_or_default("top_level"), CachedLLM)
+    assert not isinstance(config.get_llm_for_module_or_default("creative"), CachedLLM)
+    assert not isinstance(config.get_llm_for_module_or_default("no_cache"), CachedLLM)
+    # The cache is shared by all the LLMs created from the configuration
+    assert config.get_llm_for_module_or_default("a").cache is config.get_llm_for_module_or_default("b").cache
+
+
+class EmptyLLM(CountingLLM):
+
+    def __call__(self, input_: LLMInput, stop: Optional[List[str]] = None) -> LLMResponse:
+        self.calls += 1
+        return LLMResponse(None)
+
+
+def test_completions_without_content_are_not_cached(tmp_path):
+    llm = EmptyLLM()
+    cached = CachedLLM(llm, LLMCache(path=str(tmp_path / "cache.db")), model_id="gpt-4", temperature=0.0)
+    assert cached("Hi").content is None
+    assert asyncio.run(cached.ainvoke("Hi")).content is None
+    assert llm.calls == 2
+    assert cached.cache.stats.misses == 2 and cached.cache.stats.hits == 0
+
+
+def test_async_cache_reads_the_disk(tmp_path):
+    path = str(tmp_path / "cache.db")
+    llm = CountingLLM()
+    asyncio.run(CachedLLM(llm, LLMCache(path=path), model_id="gpt-4", temperature=0.0).ainvoke("Hi"))
+
+    other_cache = LLMCache(path=path)
+    assert asyncio.run(CachedLLM(llm, other_cache, model_id="gpt-4", temperature=0.0).ainvoke("Hi")).content == \
+        "Answer 1"
+    assert llm.calls == 1 and other_cache.stats.disk_hits == 1
@@ -0,0 +1,165 @@
+import pydantic
+import pytest
+
+from taskyto.engine.common.memory import ConversationMemory, MemoryPiece, HumanMessage, InstructionMessage, \
+    MessageLog, AIResponse, DataMessage, message_to_dict, message_from_dict
+
+
+def test_messages_with_the_same_timestamp_are_kept():
+    memory = ConversationMemory()
+    memory.add_memory(MemoryPiece(messages=[HumanMessage(message="Hi", timestamp=1.0),
+                                            HumanMessage(message="Hi again", timestamp=1.0)]))
+    assert [m.message for m in memory.messages] == ["Hi", "Hi again"]
+
+
+def test_only_the_latest_instruction_and_data_are_kept():
+    memory = ConversationMemory()
+    for i in range(10):
+        memory.add_memory(MemoryPiece().add_human_message(f"Message {i}"))
+        memory.add_memory(MemoryPiece().add_instruction_message(f"Instruction {i}"))
+        memory.add_memory(MemoryPiece().add_data_message(f"Data {i}", {"turn": i}))
+
+    instructions = [m.message for m in memory.messages if isinstance(m, InstructionMessage)]
+    assert instructions == ["Instruction 9"]
+    assert memory.data == {"turn": 9}
+    assert len(memory.messages) == 12
+    assert memory.to_text_messages(["human"]).count("Human: ") == 10
+
+
+def test_adding_the_same_instruction_and_data_again_keeps_them():
+    memory = ConversationMemory()
+    piece = MemoryPiece().add_instruction_message("Instruction").add_data_message("Data", {"service": "repair"})
+    memory.add_memory(piece)
+    memory.add_memory(piece)
+    assert memory.data == {"service": "repair"}
+
+    # The instruction is still tracked, so it is replaced by the next one
+    memory.add_memory(MemoryPiece().add_instruction_message("Another instruction"))
+    instructions = [m.message for m in memory.messages if isinstance(m, InstructionMessage)]
+    assert instructions == ["Another instruction"]
+    assert [m.message for m in memory.messages] == ["Data", "Another instruction"]
+
+
+def test_copies_are_merged_in_order_and_without_duplicates():
+    source = ConversationMemory()
+    target = ConversationMemory()
+    source.add_memory(MemoryPiece().add_human_message("1"))
+    target.add_memory(MemoryPiece().add_human_message("2"))
+    source.add_memory(MemoryPiece().add_human_message("3").add_data_message("data", {"a": 1}))
+
+    target.copy_memory_from(source)
+    target.copy_memory_from(source)
+    assert [m.message for m in target.messages] == ["1", "2", "3", "data"]
+    assert target.data == {"a": 1}
+
+    target.copy_memory_from(source, filter=[HumanMessage])
+    assert len(target.messages) == 4
+
+
+def test_data_is_merged_from_copied_messages():
+    first = MemoryPiece().add_data_message("first", {"a": 1, "b": 1})
+    second = MemoryPiece().add_data_message("second", {"b": 2})
+
+    memory = ConversationMemory()
+    memory.copy_memory_from(second)
+    memory.copy_memory_from(first)
+    assert memory.data == {"a": 1, "b": 2}
+
+    memory.add_memory(MemoryPiece().add_data_message("replaced", {"c": 3}))
+    assert memory.data == {"c": 3}
+
+
+def _render(memory, memory_types):
+    messages = memory.messages
+    if isinstance(memory_types, list):
+        messages = [m for m in messages if m.memory_type in memory_types]
+    return "".join(m.prefix() + m.message + "\n" for m in messages)
+
+
+def test_rendered_text_follows_the_changes_of_the_memory():
+    memory = ConversationMemory()
+    other = ConversationMemory()
+    for memory_types in ['default', ["human", "ai_response"], ["instruction", "data"]]:
+        memory.to_text_messages(memory_types)
+
+    for i in range(5):
+        memory.add_memory(MemoryPiece().add_human_message(f"Message {i}").add_ai_response(f"Response {i}"))
+        memory.add_memory(MemoryPiece().add_instruction_message(f"Instruction {i}"))
+        other.add_memory(MemoryPiece().add_data_message(f"Data {i}", {"turn": i}))
+        if i % 2 == 0:
+            memory.copy_memory_from(other)
+
+        for memory_types in ['default', ["human", "ai_response"], ["instruction", "data"]]:
+            assert memory.to_text_messages(memory_types) == _render(memory, memory_types)
+
+    assert memory.to_text_messages(["instruction"]) == "Instruction: Instruction 4\n"
+
+
+def test_memories_sharing_a_log_copy_the_same_messages_as_independent_memories():
+    log = MessageLog()
+    shared = [ConversationMemory(log=log) for _ in range(3)]
+    independent = [ConversationMemory() for _ in range(3)]
+    filter = [HumanMessage, AIResponse, DataMessage]
+
+    for i in range(4):
+        piece = (MemoryPiece().add_human_message(f"Message {i}").add_ai_response(f"Response {i}")
+                 .add_instruction_message(f"Instruction {i}").add_data_message(f"Data {i}", {f"field_{i}": i}))
+        for memories in (shared, independent):
+            memories[i % 3].add_memory(piece)
+            memories[(i + 1) % 3].copy_memory_from(memories[i % 3], filter=filter)
+            memories[(i + 2) % 3].to_text_messages()
+            memories[(i + 2) % 3].copy_memory_from(memories[(i + 1) % 3])
+
+    for memory, expected in zip(shared, independent):
+        assert memory.to_text_messages() == expected.to_text_messages()
+        assert memory.data == expected.data
+    # Every message is stored once in the log
+    assert len(log) == 16
+
+
+def test_removing_a_message_does_not_affect_the_memories_it_was_copied_to():
+    log = MessageLog()
+    source = ConversationMemory(log=log)
+    target = ConversationMemory(log=log)
+    source.add_memory(MemoryPiece().add_human_message("Hi").add_instruction_message("First"))
+    target.copy_memory_from(source)
+
+    source.add_memory(MemoryPiece().add_instruction_message("Second"))
+    assert source.to_text_messages(["instruction"]) == "Instruction: Second\n"
+    assert target.to_text_messages(["instruction"]) == "Instruction: First\n"
+
+
+def test_messages_are_validated_when_they_are_deserialized():
+    message = DataMessage("Collected data", {"name": "Bob"}, timestamp=1.0)
+    restored = message_from_dict(message_to_dict(message))
+    assert isinstance(restored, DataMessage)
+    assert (restored.message, restored.data, restored.timestamp) == ("Collected data", {"name": "Bob"}, 1.0)
+    assert restored.seq != message.seq
+    assert not hasattr(restored, "__dict__")
+
+    with pytest.raises(pydantic.ValidationError):
+        message_from_dict({"type": "unknown", "message": "Hi", "timestamp": 1.0})
+    with pytest.raises(pydantic.ValidationError):
+        message_from_dict({"type": "human", "timestamp": 1.0})
+
+
+def test_log_removes_the_messages_which_are_no_longer_in_any_memory():
+    log = MessageLog()
+    first = ConversationMemory(log=log)
+    second = ConversationMemory(log=log)
+    for i in range(10):
+        first.add_memory(MemoryPiece().add_human_message(f"Message {i}").add_data_message(f"Data {i}", {"turn": i}))
+        if i == 4:
+            second.copy_memory_from(first, filter=[HumanMessage])
+    # The replaced data messages are collected once they are a quarter of the log
+    assert len(log) < 20
+    first.retain([m for m in first.messages if m.message in ("Message 7", "Data 9")])
+    assert len(log) == 7
+    assert log.collect() == 0
+    assert first.to_text_messages() == "Human: Message 7\nData 9\n"
+    assert first.data == {"turn": 9}
+    assert second.to_text_messages() == "".join(f"Human: Message {i}\n" for i in range(5))
+
+    second.add_memory(MemoryPiece().add_human_message("Message 10"))
+    second.copy_memory_from(first)
+    assert [m.message for m in second.messages][-4:] == ["Message 4", "Message 7", "Data 9", "Message 10"]
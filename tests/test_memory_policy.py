@@ -0,0 +1,105 @@
+from taskyto.engine.common.configuration import ConfigurationModel
+from taskyto.engine.common.memory import ConversationMemory, MemoryPiece
+from taskyto.engine.common.memory_policy import MemoryPolicy, count_tokens, compact
+from taskyto.testing.test_engine import TestChannel
+from test_utils import MockedLLM, TestConfiguration
+
+
+def new_memory(turns):
+    memory = ConversationMemory()
+    memory.add_memory(MemoryPiece().add_data_message("Data: {'name': 'Bob'}", {"name": "Bob"}))
+    for i in range(turns):
+        memory.add_memory(MemoryPiece().add_human_message(f"Message {i}").add_ai_response(f"Answer {i}"))
+    memory.add_memory(MemoryPiece().add_instruction_message("Ask for the date"))
+    return memory
+
+
+def test_no_limits_renders_everything():
+    memory = new_memory(5)
+    assert MemoryPolicy().render(memory) == memory.to_text_messages()
+
+
+def test_last_turns_keeps_pinned_messages():
+    policy = MemoryPolicy(last_turns=2)
+    text = policy.render(new_memory(5))
+    assert text == ("Data: {'name': 'Bob'}\n"
+                    "Human: Message 3\nAI: Answer 3\n"
+                    "Human: Message 4\nAI: Answer 4\n"
+                    "Instruction: Ask for the date\n")
+    assert policy.stats.saved_tokens > 0
+
+
+def test_token_budget():
+    memory = new_memory(50)
+    policy = MemoryPolicy(max_tokens=100)
+    text = policy.render(memory)
+    assert count_tokens(text) <= 100 + len(text.splitlines())
+    assert text.startswith("Data:")
+    assert "Human: Message 49\nAI: Answer 49\nInstruction: Ask for the date\n" in text
+    assert "Message 0\n" not in text
+
+    assert policy.stats.renders == 1
+    assert policy.stats.sent_tokens < policy.stats.full_tokens
+
+
+def test_memory_types_are_filtered_before_the_policy():
+    policy = MemoryPolicy(last_turns=1)
+    assert policy.render(new_memory(3), ["human", "ai_response"]) == "Human: Message 2\nAI: Answer 2\n"
+
+
+def test_memory_policy_per_module():
+    config = ConfigurationModel.model_validate({
+        "default_llm": "gpt-4",
+        "memory": {"last_turns": 10},
+        "modules": [{"name": "short", "memory": {"last_turns": 1, "pinned": []}}]
+    })
+
+    assert config.get_memory_policy("top_level").last_turns == 10
+    assert config.get_memory_policy("short").last_turns == 1
+    assert config.get_memory_policy("short") is config.get_memory_policy("short")
+
+    config.get_memory_policy("short").render(new_memory(3))
+    assert config.memory_policy_stats["short"].renders == 1
+    assert ConfigurationModel(default_llm="gpt-4").get_memory_policy("top_level") is None
+
+
+def test_compaction_on_exit():
+    memory = new_memory(3)
+    compact(memory, "summary")
+    assert memory.to_text_messages() == "Data: {'name': 'Bob'}\nAI: Answer 2\n"
+    assert memory.data == {"name": "Bob"}
+
+    compact(memory, "data")
+    assert memory.to_text_messages() == "Data: {'name': 'Bob'}\n"
+
+
+class PolicyConfiguration(TestConfiguration):
+    def get_memory_policy(self, module_name=None):
+        return self.model.get_memory_policy(module_name)
+
+
+def test_memory_of_finished_modules_is_compacted():
+    missing = "Check in the previous conversation history, and if the data is not present, ask the Human to provide the missing data: "
+    mock = MockedLLM()
+    mock.module_activation(input="I need a repair", module="make_appointment", query="{'service': 'repair'}")
+    mock.ai_answer(input=missing + "date, time, service", output="Tell me the data!", prefix="Instruction:")
+    mock.module_activation(input="Tomorrow at 10", module="make_appointment",
+                           query='{"service": "repair", "date": "2024-01-31", "time": "10:00"}')
+    mock.prefixes.add("New input:")
+
+    configuration = PolicyConfiguration("examples/yaml/bike-shop", mock)
+    configuration.model = ConfigurationModel.model_validate({
+        "default_llm": "mocked",
+        "modules": [{"name": "make_appointment", "memory": {"on_exit": "data"}}]
+    })
+    engine, channel = configuration.new_engine(), TestChannel()
+    engine.start(channel)
+    engine.execute_with_input("I need a repair")
+    assert "history" in engine.execution_state.memory["make_appointment"]
+
+    engine.execute_with_input("Tomorrow at 10")
+    assert channel.last_response.chatbot_msg.startswith("Ok, I have scheduled your appointment")
+    assert list(engine.execution_state.memory["make_appointment"]) == ["collected_data"]
+    messages = [m for memories in engine.execution_state.memory.values() for memory in memories.values()
+                for m in memory.messages]
+    assert len(engine.execution_state.message_log) == len(set(m.seq for m in messages))
@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+from taskyto.engine.common.configuration import ConfigurationModel
+from taskyto.engine.common.spans import Tracer
+from taskyto.server.conversations import ConversationRegistry
+from taskyto.server.metrics import Counter, Histogram, ServerMetrics, MetricsRegistry, merge_metrics
+
+
+def test_prometheus_text_format():
+    counter = Counter("requests_total", "Requests", ["path"])
+    counter.inc('/a"b')
+    counter.inc('/a"b', amount=2)
+    assert counter.render() == ["# HELP requests_total Requests", "# TYPE requests_total counter",
+                                'requests_total{path="/a\\"b"} 3']
+
+    histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in [0.05, 0.1, 0.5, 2.0]:
+        histogram.observe(value)
+    assert histogram.render()[2:] == ['latency_seconds_bucket{le="0.1"} 2', 'latency_seconds_bucket{le="1"} 3',
+                                      'latency_seconds_bucket{le="+Inf"} 4', "latency_seconds_sum 2.65",
+                                      "latency_seconds_count 4"]
+
+
+def test_server_metrics_are_taken_from_spans():
+    model = ConfigurationModel(default_llm="gpt-4o-mini", cache=True)
+    model.get_llm_for_module_or_default(None)
+    metrics = ServerMetrics(SimpleNamespace(model=model), conversations=ConversationRegistry())
+    tracer = Tracer(metrics)
+    # Only the spans which are measured are recorded
+    assert not tracer.span("action").recording
+    with tracer.span("turn", module="top-level"):
+        with tracer.span("llm", module="top-level", model="gpt-4o-mini", prompt_tokens=100) as span:
+            span.set(completion_tokens=20)
+    try:
+        with tracer.span("turn", module="top-level"):
+            raise KeyError("x")
+    except KeyError:
+        pass
+
+    assert metrics.llm_calls.value("gpt-4o-mini", "top-level") == 1
+    assert metrics.llm_tokens.value("gpt-4o-mini", "prompt") == 100
+    assert metrics.errors.value("KeyError") == 1
+    text = metrics.render()
+    assert 'taskyto_turn_duration_seconds_count{module="top-level"} 2' in text
+    assert 'taskyto_llm_tokens_total{model="gpt-4o-mini",kind="completion"} 20' in text
+    assert "taskyto_active_conversations 0" in text
+    assert 'taskyto_llm_cache_misses_total{cache="memory:1024"} 0' in text
+
+
+def test_metrics_of_several_workers_are_merged():
+    def rendered(calls):
+        registry = MetricsRegistry()
+        registry.register(Counter("taskyto_llm_calls_total", "LLM calls", ["model"])).inc("gpt", amount=calls)
+        registry.register(Histogram("taskyto_turn_seconds", "Turns", buckets=(1,))).observe(0.5)
+        return registry.render()
+
+    merged = merge_metrics({"0": rendered(1), "1": rendered(2)}, "worker").splitlines()
+    assert merged[:4] == ['# HELP taskyto_llm_calls_total LLM calls', '# TYPE taskyto_llm_calls_total counter',
+                          'taskyto_llm_calls_total{model="gpt",worker="0"} 1',
+                          'taskyto_llm_calls_total{model="gpt",worker="1"} 2']
+    assert 'taskyto_turn_seconds_count{worker="1"} 1' in merged
+    assert sum(line.startswith("# TYPE") for line in merged) == 2
@@ -0,0 +1,59 @@
+import os
+import signal
+
+from test_utils import MockedLLM, TestConfiguration
+from taskyto.server.pool import shard, ShardIds, rebalance_hibernated, WorkerPool, PooledChatbotApp
+
+
+def new_configuration():
+    # Called in the worker processes
+    mock = MockedLLM()
+    mock.ai_answer(input="Hi", output="Welcome to my bike shop", prefix="New input:")
+    return TestConfiguration("examples/yaml/bike-shop", mock)
+
+
+def test_conversation_ids_belong_to_the_shard_of_their_worker():
+    assert all(shard(ShardIds(2, 4)(), 4) == 2 for _ in range(20))
+    # The same in every process
+    assert shard("0b7ee0ae-d0b8-4c37-a7ea-2f3f0e0a4f47", 8) == shard("0b7ee0ae-d0b8-4c37-a7ea-2f3f0e0a4f47", 8)
+
+
+def test_hibernated_conversations_are_rebalanced(tmp_path):
+    ids = [ShardIds(i % 2, 2)() for i in range(10)]
+    for i, id in enumerate(ids):
+        folder = tmp_path / f"worker-{i % 2}"
+        folder.mkdir(exist_ok=True)
+        (folder / f"{id}.json").write_text("{}")
+
+    rebalance_hibernated(str(tmp_path), 3)
+    for id in ids:
+        assert (tmp_path / f"worker-{shard(id, 3)}" / f"{id}.json").exists()
+    assert rebalance_hibernated(str(tmp_path), 3) == 0
+
+
+def test_messages_are_routed_to_the_worker_of_their_conversation(caplog):
+    pool = WorkerPool(new_configuration, 2, restart_delay=0, metrics=True)
+    client = PooledChatbotApp(pool).app.test_client()
+    pool.start()
+    try:
+        ids = [client.post('/conversation/new').json["id"] for _ in range(4)]
+        assert sorted(pool.worker_of(id) for id in ids) == [0, 0, 1, 1]
+        for id in ids:
+            response = client.post('/conversation/user_message', json={"id": id, "message": "Hi"})
+            assert response.json["message"] == "Welcome to my bike shop"
+        assert 'taskyto_active_conversations{worker="1"} 2' in client.get('/metrics').get_data(as_text=True)
+
+        # A worker which crashes is restarted, without its conversations
+        crashed = ids[0]
+        os.kill(pool.workers[pool.worker_of(crashed)].process.pid, signal.SIGKILL)
+        response = client.post('/conversation/user_message', json={"id": crashed, "message": "Hi"})
+        assert response.status_code in (404, 503)
+        response = client.post('/conversation/user_message', json={"id": crashed, "message": "Hi"})
+        assert response.status_code == 404 and pool.restarts == 1
+        assert f"Worker {pool.worker_of(crashed)} stopped" in caplog.text
+
+        other = next(id for id in ids if pool.worker_of(id) != pool.worker_of(crashed))
+        response = client.post('/conversation/user_message', json={"id": other, "message": "Hi"})
+        assert response.status_code == 200
+    finally:
+        pool.stop()
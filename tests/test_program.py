@@ -0,0 +1,52 @@
+from test_utils import MockedLLM, TestConfiguration
+from taskyto.testing.test_engine import TestChannel
+
+
+def new_configuration():
+    mock = MockedLLM()
+    mock.ai_answer(input="Hi", output="Welcome to my bike shop", prefix="New input:")
+    mock.ai_answer(input="Bye", output="See you soon", prefix="New input:")
+    return TestConfiguration("examples/yaml/bike-shop", mock)
+
+
+def test_engines_share_the_compiled_program():
+    configuration = new_configuration()
+    engine1 = configuration.new_engine()
+    engine2 = configuration.new_engine()
+
+    assert engine1.program is engine2.program
+    assert engine1.statemachine is engine2.statemachine
+
+
+def test_conversations_do_not_share_state():
+    configuration = new_configuration()
+    engine1, channel1 = configuration.new_engine(), TestChannel()
+    engine2, channel2 = configuration.new_engine(), TestChannel()
+    engine1.start(channel1)
+    engine2.start(channel2)
+
+    engine1.execute_with_input("Hi")
+    engine2.execute_with_input("Bye")
+
+    assert channel1.last_response.chatbot_msg == "Welcome to my bike shop"
+    assert channel2.last_response.chatbot_msg == "See you soon"
+    assert engine1.execution_state is not engine2.execution_state
+    assert [i.message for i in engine1.recorded_interaction.interactions] == ["Hello", "Hi", "Welcome to my bike shop"]
+    assert [i.message for i in engine2.recorded_interaction.interactions] == ["Hello", "Bye", "See you soon"]
+
+
+def test_static_prompt_is_built_once():
+    configuration = new_configuration()
+    engine = configuration.new_engine()
+    engine.start(TestChannel())
+    module = engine.program.runtime_module("top-level")
+
+    templates = module.get_prompt_templates(allow_tools=True)
+    assert module.get_prompt_templates(allow_tools=True) is templates
+    assert module.get_prompt_templates(allow_tools=False) is not templates
+
+    first = module.build_prompt(engine.execution_state, "Hi")
+    engine.execute_with_input("Hi")
+    second = module.build_prompt(engine.execution_state, "Bye")
+    assert first[0] is second[0]
+    assert "New input: Bye" in second[1].content
@@ -0,0 +1,71 @@
+import yaml
+
+from test_utils import MockedLLM, TestConfiguration
+from taskyto.engine.common.configuration import TracingConfiguration
+from taskyto.recording import RecordedInteraction, dump_test_recording, JsonlRecordingWriter, \
+    convert_jsonl_recording, read_jsonl_recording
+from taskyto.testing.test_engine import TestChannel
+
+
+class TracingTestConfiguration(TestConfiguration):
+    def __init__(self, root_folder, mocked_llm, tracing: TracingConfiguration):
+        super().__init__(root_folder, mocked_llm)
+        self.tracing = tracing
+
+    def new_recording(self):
+        return self.tracing.new_recording()
+
+
+def converse(tracing: TracingConfiguration, turns=3, writer=None):
+    mock = MockedLLM()
+    mock.ai_answer(input="Hi", output="Welcome to my bike shop", prefix="New input:")
+    engine = TracingTestConfiguration("examples/yaml/bike-shop", mock, tracing).new_engine()
+    engine.recorded_interaction.writer = writer
+    engine.start(TestChannel())
+    for _ in range(turns):
+        engine.execute_with_input("Hi")
+    return engine.recorded_interaction
+
+
+def test_events_are_serialized_when_they_are_traced(tmp_path):
+    recording = converse(TracingConfiguration())
+    assert [e["type"] for e in recording.trace] == ["UserInput", "AIResponseEvent"] * 3
+
+    file = tmp_path / "recording.yaml"
+    dump_test_recording(recording, str(file), trace=True)
+    dumped = yaml.safe_load(file.read_text())
+    assert dumped["interaction"][:2] == [{"chatbot": ["Hello"]}, {"user": "Hi"}]
+    assert dumped["trace"][0] == {"type": "event-transition", "event": {"type": "UserInput", "message": "Hi"}}
+
+
+def test_tracing_off_and_bounded():
+    recording = converse(TracingConfiguration(mode="off", max_items=2), turns=5)
+    assert len(recording.trace) == 0
+    assert [i.message for i in recording.interactions] == ["Hi", "Welcome to my bike shop"]
+    assert len(recording.response_times) == 2
+
+    assert len(converse(TracingConfiguration(mode="sampled", sample_rate=0.0)).trace) == 0
+    assert len(converse(TracingConfiguration(mode="sampled", sample_rate=1.0)).trace) == 6
+
+
+def test_average_response_time_covers_the_whole_conversation():
+    recording = RecordedInteraction(max_items=2)
+    for time in [1.0, 2.0, 3.0, 6.0]:
+        recording.record_response_time(time)
+    assert list(recording.response_times) == [3.0, 6.0]
+    assert recording.average_response_time() == 3.0
+
+
+def test_jsonl_recording_is_written_while_the_conversation_runs(tmp_path):
+    jsonl_file = str(tmp_path / "recording.jsonl")
+    with JsonlRecordingWriter(jsonl_file) as writer:
+        recording = converse(TracingConfiguration(), writer=writer)
+        # Each turn is flushed, so the file is complete before it is closed
+        items = list(read_jsonl_recording(jsonl_file))
+        assert [i["type"] for i in items[:5]] == ["chatbot", "user", "event-transition", "event-transition", "chatbot"]
+        assert len([i for i in items if i["type"] == "response_time"]) == 3
+
+    converted, dumped = tmp_path / "converted.yaml", tmp_path / "dumped.yaml"
+    convert_jsonl_recording(jsonl_file, str(converted), trace=True)
+    dump_test_recording(recording, str(dumped), trace=True)
+    assert converted.read_text() == dumped.read_text()
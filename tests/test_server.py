@@ -1,9 +1,12 @@
-import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 import uuid
 
 from test_utils import MockedLLM, TestConfiguration
+from taskyto.engine.common.llm import LLM
 
 
 @pytest.fixture()
@@ -20,9 +23,9 @@ def app():
 
     configuration = TestConfiguration(chatbot_folder, mock)
 
-    chatbot_app = FlaskChatbotApp(configuration)
+    chatbot_app = FlaskChatbotApp(configuration, metrics=True)
     yield chatbot_app.app
-    # clean up / reset resources here
+    chatbot_app.close()
 
 
 @pytest.fixture()
@@ -63,3 +66,206 @@ def test_conversation_steps(client):
     assert data['id'] == id
     assert data['type'] == 'chatbot_response'
     assert "Tell me the data!" in data['message']
+
+
+def parse_sse(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_conversation_streaming(client):
+    id = create_conversation(client)
+
+    response = client.post(f'/conversation/user_message', json={"id": id, "message": "Hi"},
+                           headers={"Accept": "text/event-stream"})
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+
+    events = parse_sse(response.get_data(as_text=True))
+    chunks = "".join(data["text"] for event, data in events if event == "chunk")
+    assert chunks == "Welcome to my bike shop"
+
+    assert events[-1][0] == "chatbot_response"
+    assert "Welcome to my bike shop" in events[-1][1]["message"]
+
+
+class CharacterStreamLLM(LLM):
+    def __init__(self, mock):
+        self.mock = mock
+
+    def __call__(self, input_, stop=None):
+        return self.mock(input_, stop)
+
+    def stream(self, input_, stop=None):
+        yield from self(input_, stop).content
+
+
+def test_streaming_is_reset_at_another_ai_marker():
+    from taskyto.server import FlaskChatbotApp
+
+    mock = MockedLLM()
+    mock.ai_answer(input="Hi", output="Hi\nHuman: Hello\nAI: Welcome to my bike shop", prefix="New input:")
+    client = FlaskChatbotApp(TestConfiguration("examples/yaml/bike-shop", CharacterStreamLLM(mock))).app.test_client()
+    id = create_conversation(client)
+
+    response = client.post(f'/conversation/user_message', json={"id": id, "message": "Hi"},
+                           headers={"Accept": "text/event-stream"})
+    events = parse_sse(response.get_data(as_text=True))
+    kinds = [event for event, data in events]
+    assert kinds.count("reset") == 1
+    # The chunks streamed after the reset are the response
+    after_reset = events[kinds.index("reset") + 1:]
+    assert "".join(data["text"] for event, data in after_reset if event == "chunk") == "Welcome to my bike shop"
+    assert events[-1][1]["message"] == "Welcome to my bike shop"
+
+
+def test_metrics(client):
+    id = create_conversation(client)
+    client.post(f'/conversation/user_message', json={"id": id, "message": "Hi"})
+    client.post(f'/conversation/user_message', json={"id": "unknown", "message": "Hi"})
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    metrics = response.get_data(as_text=True)
+    assert 'taskyto_turn_duration_seconds_count{module="top-level"} 1' in metrics
+    assert 'taskyto_turn_duration_seconds_bucket{module="top-level",le="+Inf"} 1' in metrics
+    assert 'taskyto_errors_total{type="NotFound"} 1' in metrics
+    assert "taskyto_active_conversations" in metrics
+
+
+def test_metrics_are_detached_from_the_configuration():
+    from taskyto.server import FlaskChatbotApp
+
+    configuration = TestConfiguration("examples/yaml/bike-shop", MockedLLM())
+    assert FlaskChatbotApp(configuration).app.test_client().get('/metrics').status_code == 404
+    assert not configuration.get_tracer().enabled
+
+    apps = [FlaskChatbotApp(configuration, metrics=True) for _ in range(2)]
+    assert len(configuration.get_tracer().sinks) == 2
+    for chatbot_app in apps:
+        chatbot_app.close()
+    assert not configuration.get_tracer().enabled
+
+
+class SlowMockedLLM(MockedLLM):
+    def __call__(self, *args, **kwargs):
+        # Other threads run while the LLM is answering, as with a real one
+        time.sleep(0.005)
+        return super().__call__(*args, **kwargs)
+
+
+def test_concurrent_conversations_do_not_interleave():
+    from taskyto.server import FlaskChatbotApp
+
+    conversations, messages = 8, 6
+    mock = SlowMockedLLM()
+    for i in range(conversations):
+        for j in range(messages):
+            mock.ai_answer(input=f"Message {i}-{j}", output=f"Answer {i}-{j}", prefix="New input:")
+    chatbot_app = FlaskChatbotApp(TestConfiguration("examples/yaml/bike-shop", mock))
+    ids = [create_conversation(chatbot_app.app.test_client()) for _ in range(conversations)]
+
+    def send(i, j):
+        response = chatbot_app.app.test_client().post('/conversation/user_message',
+                                                      json={"id": ids[i], "message": f"Message {i}-{j}"})
+        return i, j, response.json["message"]
+
+    # The messages of each conversation are also sent concurrently
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda args: send(*args),
+                                    [(i, j) for j in range(messages) for i in range(conversations)]))
+
+    assert all(message == f"Answer {i}-{j}" for i, j, message in results)
+    for i, id in enumerate(ids):
+        interactions = chatbot_app.conversations.get(id).engine.recorded_interaction.interactions
+        pairs = [(user.message, chatbot.message) for user, chatbot in zip(list(interactions)[1::2],
+                                                                           list(interactions)[2::2])]
+        assert sorted(pairs) == [(f"Message {i}-{j}", f"Answer {i}-{j}") for j in range(messages)]
+
+
+def test_hibernated_conversations_are_restored(tmp_path):
+    from taskyto.engine.common.configuration import SessionConfiguration
+    from taskyto.server import FlaskChatbotApp
+
+    mock = MockedLLM()
+    mock.module_activation(input="I need a repair", module="make_appointment", query="{'service': 'repair'}")
+    mock.ai_answer(input="Check in the previous conversation history, and if the data is not present, ask the Human to provide the missing data: date, time, service",
+                   output="Tell me the data!",
+                   prefix="Instruction:")
+    mock.prefixes.add("New input:")
+    sessions = SessionConfiguration(max_live=1, hibernation_folder=str(tmp_path))
+    chatbot_app = FlaskChatbotApp(TestConfiguration("examples/yaml/bike-shop", mock), metrics=True,
+                                  sessions=sessions)
+    client = chatbot_app.app.test_client()
+
+    first = create_conversation(client)
+    response = client.post('/conversation/user_message', json={"id": first, "message": "I need a repair"})
+    assert "Tell me the data!" in response.json["message"]
+    create_conversation(client)
+    assert (tmp_path / f"{first}.json").exists()
+
+    conversation = chatbot_app.conversations.get(first)
+    assert conversation.engine.execution_state.current.state_id() == "make_appointment"
+    assert "taskyto_conversation_rehydrations_total 1" in client.get('/metrics').get_data(as_text=True)
+
+
+def test_workers_share_the_conversations_of_a_store(tmp_path):
+    from taskyto.engine.common.configuration import SessionConfiguration
+    from taskyto.server import FlaskChatbotApp
+
+    mock = MockedLLM()
+    mock.module_activation(input="I need a repair", module="make_appointment", query="{'service': 'repair'}")
+    mock.ai_answer(input="Check in the previous conversation history, and if the data is not present, ask the Human to provide the missing data: date, time, service",
+                   output="Tell me the data!",
+                   prefix="Instruction:")
+    mock.prefixes.add("New input:")
+    sessions = SessionConfiguration(store=str(tmp_path / "conversations.db"))
+    workers = [FlaskChatbotApp(TestConfiguration("examples/yaml/bike-shop", mock), sessions=sessions)
+               for _ in range(2)]
+
+    id = create_conversation(workers[0].app.test_client())
+    response = workers[1].app.test_client().post('/conversation/user_message',
+                                                 json={"id": id, "message": "I need a repair"})
+    assert "Tell me the data!" in response.json["message"]
+
+    # The first worker continues where the second one left
+    conversation = workers[0].conversations.acquire(id)
+    assert conversation.engine.execution_state.current.state_id() == "make_appointment"
+    workers[0].conversations.release(id, conversation)
+
+
+def test_stateless_conversations(monkeypatch):
+    from taskyto.engine.common.configuration import SessionConfiguration, StatelessConfiguration
+    from taskyto.server import FlaskChatbotApp
+
+    monkeypatch.setenv("TASKYTO_STATE_SECRET", "secret")
+    mock = MockedLLM()
+    mock.module_activation(input="I need a repair", module="make_appointment", query="{'service': 'repair'}")
+    mock.ai_answer(input="Check in the previous conversation history, and if the data is not present, ask the Human to provide the missing data: date, time, service",
+                   output="Tell me the data!",
+                   prefix="Instruction:")
+    mock.prefixes.add("New input:")
+    sessions = SessionConfiguration(stateless=StatelessConfiguration())
+    replicas = [FlaskChatbotApp(TestConfiguration("examples/yaml/bike-shop", mock), sessions=sessions)
+                for _ in range(2)]
+
+    response = replicas[0].app.test_client().post('/conversation/new')
+    id, state = response.json["id"], response.json["state"]
+    response = replicas[1].app.test_client().post('/conversation/user_message',
+                                                  json={"id": id, "message": "I need a repair", "state": state})
+    assert "Tell me the data!" in response.json["message"]
+    assert len(replicas[0].conversations) == len(replicas[1].conversations) == 0
+
+    # The state which is sent back has the conversation in the appointment module
+    snapshot = replicas[0].state_codec.decode(id, response.json["state"])
+    assert snapshot["current"] != replicas[0].state_codec.decode(id, state)["current"]
+
+    client = replicas[0].app.test_client()
+    response = client.post('/conversation/user_message', json={"id": id, "message": "Hi"})
+    assert response.status_code == 400
+    response = client.post('/conversation/user_message', json={"id": id, "message": "Hi", "state": state[:-8]})
+    assert response.status_code == 400
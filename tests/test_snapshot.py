@@ -0,0 +1,79 @@
+import datetime
+
+from test_utils import MockedLLM, TestConfiguration
+from taskyto.engine.custom import snapshot
+from taskyto.testing.test_engine import TestChannel
+
+
+def new_configuration():
+    mock = MockedLLM()
+    mock.ai_answer(input="Hi", output="Welcome to my bike shop", prefix="New input:")
+    mock.module_activation(input="I need a repair", module="make_appointment", query="{'service': 'repair'}")
+    mock.ai_answer(input="Check in the previous conversation history, and if the data is not present, ask the Human to provide the missing data: date, time, service",
+                   output="Tell me the data!",
+                   prefix="Instruction:")
+    return TestConfiguration("examples/yaml/bike-shop", mock)
+
+
+def test_snapshot_round_trip():
+    configuration = new_configuration()
+    engine = configuration.new_engine()
+    engine.start(TestChannel())
+    engine.execution_state.data["make_appointment"] = {"date": datetime.date(2024, 1, 31)}
+    engine.execute_with_input("I need a repair")
+
+    serialized = snapshot.dumps(engine.snapshot())
+    restored = configuration.new_engine()
+    restored.restore(snapshot.loads(serialized), TestChannel())
+
+    assert restored.execution_state.current is engine.execution_state.current
+    assert restored.execution_state.data == engine.execution_state.data
+    original_memory = engine.execution_state.get_memory(engine.execution_state.current.module, 'history')
+    restored_memory = restored.execution_state.get_memory(restored.execution_state.current.module, 'history')
+    assert restored_memory.to_text_messages() == original_memory.to_text_messages()
+    assert snapshot.dumps(restored.snapshot()) == serialized
+
+
+def test_forked_conversations_are_independent():
+    configuration = new_configuration()
+    engine = configuration.new_engine()
+    engine.start(TestChannel())
+
+    channel = TestChannel()
+    fork = engine.fork(channel)
+    fork.execute_with_input("I need a repair")
+
+    assert channel.last_response.chatbot_msg == "Tell me the data!"
+    assert fork.execution_state.current is not engine.execution_state.current
+    assert len(engine.execution_state.memory) == 0
+
+
+def test_unsupported_version():
+    configuration = new_configuration()
+    engine = configuration.new_engine()
+    engine.start(TestChannel())
+
+    data = engine.snapshot()
+    data["version"] = 0
+    try:
+        engine.restore(data, TestChannel())
+        assert False, "Expected ValueError"
+    except ValueError:
+        pass
+
+
+def test_trimmed_snapshot_keeps_the_last_turns():
+    configuration = new_configuration()
+    engine = configuration.new_engine()
+    engine.start(TestChannel())
+    for _ in range(5):
+        engine.execute_with_input("Hi")
+
+    trimmed = snapshot.trim_snapshot(engine.snapshot(), last_turns=2)
+    restored = configuration.new_engine()
+    restored.restore(trimmed, TestChannel())
+
+    memory = restored.execution_state.get_memory(restored.execution_state.current.module, 'history')
+    assert [m.memory_type for m in memory.messages] == ["human", "ai_response"] * 2
+    assert len(trimmed["messages"]) < len(engine.snapshot()["messages"])
+    assert snapshot.trim_snapshot(trimmed, last_turns=2) == trimmed
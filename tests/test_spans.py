@@ -0,0 +1,123 @@
+import json
+
+import pytest
+
+from test_utils import MockedLLM, TestConfiguration
+from taskyto.engine.common.configuration import ConfigurationModel
+from taskyto.engine.common.llm import LLMResponse
+from taskyto.engine.common.spans import Tracer, InMemorySpanSink, JsonlSpanSink, TracedLLM, NULL_TRACER
+from taskyto.testing.test_engine import TestChannel
+
+
+class SpanTestConfiguration(TestConfiguration):
+    def __init__(self, root_folder, mocked_llm, sink):
+        super().__init__(root_folder, mocked_llm)
+        self.tracer = Tracer(sink)
+
+    def get_tracer(self):
+        return self.tracer
+
+    def new_llm(self, module_name=None):
+        return TracedLLM(self.llm, self.tracer, module_name=module_name, model_id="mocked")
+
+
+def test_spans_of_a_conversation_are_nested():
+    mock = MockedLLM()
+    mock.module_activation(input="I need a repair", module="make_appointment",
+                           query='{"service": "repair", "date": "2024-01-31", "time": "10:00"}')
+    mock.prefixes.add("New input:")
+
+    sink = InMemorySpanSink()
+    engine, channel = SpanTestConfiguration("examples/yaml/bike-shop", mock, sink).new_engine(), TestChannel()
+    engine.start(channel)
+    sink.clear()
+    engine.execute_with_input("I need a repair")
+    assert channel.last_response.chatbot_msg.startswith("Ok, I have scheduled your appointment")
+
+    [turn] = sink.named("turn")
+    assert all(span.trace_id == turn.span_id for span in sink.spans)
+    assert turn.attributes["module"] == "top-level"
+
+    transitions = sink.children(turn)
+    assert len(transitions) > 1 and all(span.name == "transition" for span in transitions)
+    assert transitions[0].attributes["event"] == "UserInput"
+
+    [llm] = sink.named("llm")
+    assert llm.attributes["module"] == "top-level"
+    assert llm.attributes["prompt_tokens"] > 0 and llm.attributes["completion_tokens"] > 0
+    [run] = [span for span in sink.spans if span.span_id == llm.parent_id]
+    assert run.name == "module.run" and run.attributes["module"] == "top-level"
+    assert [span.name for span in sink.children(run)] == ["prompt", "llm"]
+
+    formatters = sink.named("formatter")
+    assert {span.attributes["property"] for span in formatters} == {"service", "date", "time"}
+    assert {span.attributes["module"] for span in formatters} == {"make_appointment"}
+    assert len(sink.named("action")) > 0
+    # Children finish before their parents, and the turn covers all of them
+    assert sink.spans[-1] is turn
+    assert turn.duration >= max(span.duration for span in transitions)
+
+
+def test_actions_of_transitions_are_spans():
+    sink = InMemorySpanSink()
+    engine = SpanTestConfiguration("examples/yaml/bike-shop", MockedLLM(), sink).new_engine()
+    engine.start(TestChannel())
+
+    # The initial transition says hello with a single action, which is not in a CompositeAction
+    [transition] = sink.named("transition")
+    assert [(span.name, span.attributes["action"]) for span in sink.children(transition)] == [("action", "SayAction")]
+
+
+def test_jsonl_sink_writes_spans_before_it_is_closed(tmp_path):
+    file = tmp_path / "spans.jsonl"
+    tracer = Tracer(JsonlSpanSink(str(file)))
+    with tracer.span("turn"):
+        pass
+    assert json.loads(file.read_text())["name"] == "turn"
+    tracer.close()
+
+
+def test_jsonl_sink_writes_finished_spans(tmp_path):
+    file = tmp_path / "spans.jsonl"
+    tracer = Tracer(JsonlSpanSink(str(file)))
+    with tracer.span("turn") as turn:
+        with pytest.raises(ValueError):
+            with tracer.span("action", action="Failing"):
+                raise ValueError()
+        turn.set(tokens=3)
+    tracer.close()
+
+    action, turn = [json.loads(line) for line in file.read_text().splitlines()]
+    assert action["name"] == "action" and action["parent"] == turn["id"] and action["trace"] == turn["id"]
+    assert action["attributes"] == {"action": "Failing", "error": "ValueError"}
+    assert turn["parent"] is None and turn["attributes"] == {"tokens": 3}
+    assert turn["duration"] >= action["duration"] >= 0
+
+
+def test_tracing_is_disabled_by_default(tmp_path):
+    assert not NULL_TRACER.span("turn").recording
+    with NULL_TRACER.span("turn", state="top-level") as span:
+        span.set(tokens=3)
+
+    model = ConfigurationModel(default_llm="gpt-4o-mini")
+    assert model.get_tracer() is NULL_TRACER
+    assert not isinstance(model.get_llm_for_module_or_default(None), TracedLLM)
+
+    model = ConfigurationModel.model_validate({"default_llm": "gpt-4o-mini",
+                                               "tracing": {"spans": str(tmp_path / "spans.jsonl")}})
+    llm = model.get_llm_for_module_or_default("top-level")
+    assert isinstance(llm, TracedLLM) and llm.module_name == "top-level" and llm.model_id == "gpt-4o-mini"
+
+
+def test_prompt_is_not_tokenized_if_no_sink_receives_llm_spans(monkeypatch):
+    tokenized = []
+    monkeypatch.setattr("taskyto.engine.common.spans.count_tokens_uncached",
+                        lambda text: tokenized.append(text) or 1)
+
+    class TurnSink(InMemorySpanSink):
+        names = ("turn",)
+
+    sink = TurnSink()
+    llm = TracedLLM(lambda input_, stop=None: LLMResponse("Hello"), Tracer(sink))
+    assert llm("Hi").content == "Hello"
+    assert tokenized == [] and len(sink.spans) == 0
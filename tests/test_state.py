@@ -0,0 +1,46 @@
+import random
+
+import pytest
+
+from taskyto.server.state import StateCodec, InvalidState, StateTooLarge
+
+
+def snapshot(turns: int):
+    messages = []
+    for i in range(turns):
+        messages.append({"type": "human", "message": f"Question {i}", "timestamp": i})
+        messages.append({"type": "ai_response", "message": f"Answer {i} " + "x" * 200, "timestamp": i})
+    return {"version": 2, "current": "top-level", "messages": messages, "events": [],
+            "memory": {"top-level": {"history": list(range(len(messages)))}}, "data": {}}
+
+
+def test_states_are_signed():
+    codec = StateCodec(b"secret", last_turns=None)
+    blob = codec.encode("a", snapshot(3))
+    assert codec.decode("a", blob) == snapshot(3)
+
+    with pytest.raises(InvalidState):
+        StateCodec(b"another secret").decode("a", blob)
+    with pytest.raises(InvalidState):
+        codec.decode("b", blob)
+    tampered = blob[:60] + ("A" if blob[60] != "A" else "B") + blob[61:]
+    with pytest.raises(InvalidState):
+        codec.decode("a", tampered)
+
+
+def test_states_are_trimmed_to_fit():
+    codec = StateCodec(b"secret", last_turns=2)
+    assert len(codec.decode("a", codec.encode("a", snapshot(10)))["messages"]) == 4
+
+    # Random text does not compress, so only a few turns fit
+    state = snapshot(40)
+    for m in state["messages"]:
+        m["message"] = "".join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(200))
+    codec = StateCodec(b"secret", max_size=3000, last_turns=None)
+    decoded = codec.decode("a", codec.encode("a", state))
+    assert 0 < len(decoded["messages"]) < 20 and decoded["messages"][-1] == state["messages"][-1]
+
+    with pytest.raises(StateTooLarge):
+        StateCodec(b"secret", max_size=100).encode("a", state)
+    with pytest.raises(StateTooLarge):
+        codec.decode("a", "A" * 3001)
@@ -0,0 +1,70 @@
+import base_test
+from taskyto import spec
+from taskyto.engine.custom.events import ActivateModuleEvent, ActivateModuleEventType, UserInput, UserInputEventType, \
+    TaskFinishEvent, TaskFinishEventEventType, Event
+from taskyto.engine.custom.statemachine import StateMachine, State, CompositeState, Initial, TriggerEventMatchByClass
+
+
+class RuntimeStub:
+    def __init__(self, module):
+        self.module = module
+
+
+def new_state(name):
+    module = spec.ActionModule(name=name, data=[])
+    return State(module, RuntimeStub(module))
+
+
+def test_first_compatible_transition_wins():
+    sm = StateMachine()
+    a, b, c = new_state("a"), new_state("b"), new_state("c")
+    sm.add_transition(a, b, TriggerEventMatchByClass(Event))
+    sm.add_transition(a, c, UserInputEventType)
+
+    assert sm.transition_for(a, UserInput("hi")).target is b
+    assert sm.transition_for(b, UserInput("hi")) is None
+    assert sm.transition_for(a, None) is None
+
+
+def test_activate_module_indexed_by_target_module():
+    sm = StateMachine()
+    initial, menu, b, c = Initial(), new_state("menu"), new_state("b"), new_state("c")
+    sm.add_state(initial)
+    sm.add_transition(initial, menu, None)
+    sm.add_transition(menu, b, ActivateModuleEventType(b.module))
+    sm.add_transition(menu, c, ActivateModuleEventType(c.module))
+
+    assert sm.transition_for(initial, None).target is menu
+    assert sm.transition_for(menu, ActivateModuleEvent(c.runtime_module, None, None)).target is c
+    assert sm.transition_for(menu, ActivateModuleEvent(b.runtime_module, None, None)).target is b
+
+
+def test_composite_state_tries_inner_transitions_first():
+    sm = StateMachine()
+    menu, first = new_state("menu"), new_state("first")
+    seq_module = spec.SequenceModule(name="seq", references=["first"])
+    composite = CompositeState(seq_module, RuntimeStub(seq_module))
+    inner_initial = Initial()
+    composite.add_state(inner_initial)
+    composite.add_state(first)
+    composite.add_transition(inner_initial, first, ActivateModuleEventType(first.module))
+    composite.add_transition(first, composite, TaskFinishEventEventType)
+
+    sm.add_state(menu)
+    sm.add_state(composite)
+    sm.add_transition(menu, composite, ActivateModuleEventType(seq_module))
+    sm.add_transition(composite, menu, TaskFinishEventEventType)
+    sm.add_transition(composite, menu, ActivateModuleEventType(first.module))
+
+    assert sm.transition_for(composite, ActivateModuleEvent(first.runtime_module, None, None)).target is first
+    assert sm.transition_for(first, TaskFinishEvent(None)).target is composite
+    assert sm.transition_for(composite, TaskFinishEvent(None)).target is menu
+
+
+def test_dispatch_table_is_rebuilt_after_modification():
+    sm = StateMachine()
+    a, b = new_state("a"), new_state("b")
+    assert sm.transition_for(a, UserInput("hi")) is None
+
+    sm.add_transition(a, b, UserInputEventType)
+    assert sm.transition_for(a, UserInput("hi")).target is b
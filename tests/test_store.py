@@ -0,0 +1,54 @@
+import pytest
+
+from taskyto.server.store import SQLiteConversationStore, VersionConflict
+
+
+def snapshot(messages: int, current="top-level"):
+    return {"version": 1, "current": current, "messages": [{"content": f"Message {i}"} for i in range(messages)]}
+
+
+def test_snapshots_are_stored_with_versions(tmp_path):
+    path = str(tmp_path / "conversations.db")
+    store = SQLiteConversationStore(path)
+    assert store.create("a", snapshot(40)) == 1
+    assert store.save("a", snapshot(41, current="make_appointment"), 1) == 2
+
+    # Another worker sees the latest version
+    other = SQLiteConversationStore(path)
+    assert other.version("a") == 2 and other.count() == 1
+    assert other.load("a") == (2, snapshot(41, current="make_appointment"))
+    with pytest.raises(KeyError):
+        other.load("b")
+
+    store.delete("a")
+    assert other.version("a") is None
+
+
+def test_concurrent_saves_conflict(tmp_path):
+    path = str(tmp_path / "conversations.db")
+    first, second = SQLiteConversationStore(path), SQLiteConversationStore(path)
+    first.create("a", snapshot(1))
+    second.load("a")
+
+    first.save("a", snapshot(2), 1)
+    with pytest.raises(VersionConflict):
+        second.save("a", snapshot(3), 1)
+    assert second.load("a") == (2, snapshot(2))
+
+
+def test_only_the_changed_segments_are_written(tmp_path):
+    store = SQLiteConversationStore(str(tmp_path / "conversations.db"))
+    store.create("a", snapshot(70))
+    written = []
+    store.connection.set_trace_callback(written.append)
+    store.save("a", snapshot(71), 1)
+    store.connection.set_trace_callback(None)
+
+    segments = [statement for statement in written if statement.startswith("INSERT OR REPLACE")]
+    # Only the last segment of messages, neither the two full segments before it nor the unchanged header
+    assert len(segments) == 1 and "'messages:000002'" in segments[0]
+    assert SQLiteConversationStore(store.path).load("a") == (2, snapshot(71))
+
+    # A conversation which shrinks loses its stale segments
+    store.save("a", snapshot(10), 2)
+    assert store.load("a") == (3, snapshot(10))
@@ -0,0 +1,50 @@
+from taskyto.engine.custom.runtime import Channel, ResponseStreamFilter, ChatbotOutputParser
+
+
+class ChunkChannel(Channel):
+    streaming = True
+
+    def __init__(self):
+        self.chunks = []
+        self.resets = 0
+
+    def output_chunk(self, chunk, who=None):
+        self.chunks.append(chunk)
+
+    def discard_chunks(self, who=None):
+        # As a client does with the reset events
+        self.chunks.clear()
+        self.resets += 1
+
+
+def feed_by_characters(text, channel=None):
+    channel = channel if channel is not None else ChunkChannel()
+    response_filter = ResponseStreamFilter(channel, "AI")
+    for c in text:
+        response_filter.feed(c)
+    assert response_filter.close() == text
+    return channel.chunks
+
+
+def test_stream_response():
+    chunks = feed_by_characters("Thought: Do I need to use a tool? No\nAI: Hello, how can I help you?\n```")
+    assert "".join(chunks) == "Hello, how can I help you?"
+    assert len(chunks) > 1
+
+
+def test_stream_tool_action_is_not_forwarded():
+    chunks = feed_by_characters("Thought: Do I need to use a tool? Yes\nAction: make_appointment\nAction Input: {}")
+    assert chunks == []
+
+
+def test_stream_takes_the_response_after_the_last_marker():
+    text = "Thought: Do I need to use a tool? No\nAI: AI: Hello"
+    assert "".join(feed_by_characters(text)) == ChatbotOutputParser(ai_prefix="AI").parse(text).return_values["output"]
+
+
+def test_stream_is_reset_at_a_marker_after_the_response_has_started():
+    text = "Thought: Do I need to use a tool? No\nAI: Hi\nHuman: Bye\nAI: Goodbye"
+    channel = ChunkChannel()
+    chunks = feed_by_characters(text, channel)
+    assert channel.resets == 1
+    assert "".join(chunks) == ChatbotOutputParser(ai_prefix="AI").parse(text).return_values["output"] == "Goodbye"
@@ -7,7 +7,7 @@ from langchain.schema import BaseMessage
 import taskyto.spec
 from taskyto.engine.common import Configuration, Engine, BasicConfiguration
 from taskyto.engine.common.configuration import ConfigurationModel
-from taskyto.engine.custom.engine import CustomPromptEngine
+from taskyto.engine.custom.engine import CustomPromptEngine, ChatbotProgram
 
 
 class AIAnswer:
@@ -78,6 +78,7 @@ class TestConfiguration(BasicConfiguration):
         super().__init__(root_folder)
         self.llm = mocked_llm
         self.model = ConfigurationModel(default_llm="mocked", languages="en")
+        self.program = None
 
     @property
     def is_user_beginning(self) -> bool:
@@ -94,7 +95,9 @@ class TestConfiguration(BasicConfiguration):
         raise NotImplementedError()
 
     def new_engine(self) -> Engine:
-        return CustomPromptEngine(self.chatbot_model, configuration=self)
+        if self.program is None:
+            self.program = ChatbotProgram(self.chatbot_model, configuration=self)
+        return CustomPromptEngine(self.chatbot_model, configuration=self, program=self.program)
 
     def new_llm(self, module_name: Optional[str] = None):
         return self.llm